@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import time
+
+import logging
+
+import openai
+from openai.types.chat import ChatCompletion
+
+logging.basicConfig(level=logging.INFO)
+
+
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+BATCH_RETRY_STATUSES = {"failed", "expired", "cancelled"}
+
+
+class BatchJob:
+    """Run chat completions through the provider's batch API.
+
+    Requests are written to JSONL batch files (one line per request, with
+    custom_id set to the entry id) of at most ``max_requests`` lines and
+    ``max_bytes`` bytes, uploaded, submitted and polled until every batch has
+    finished. Submitted batches are recorded in ``state.json`` under
+    ``batch_dir``, keyed by the hash of their file, so re-running with
+    ``resume`` after an interruption polls the batches already submitted
+    instead of paying for them again. Without ``resume`` every batch file is
+    submitted anew.
+
+    Attributes:
+        llm_api: Backend whose ``client`` talks to the batch and files APIs.
+        price_factor: Multiplier applied to the cost of batched requests
+            (batch requests are typically billed at half price).
+        resume: Reuse the batches recorded in the state for identical files.
+    """
+
+    def __init__(
+        self,
+        llm_api,
+        batch_dir,
+        max_requests=50000,
+        max_bytes=190 * 1024 * 1024,
+        poll_interval=30,
+        completion_window="24h",
+        price_factor=0.5,
+        resume=False,
+    ):
+        if getattr(llm_api, "client", None) is None:
+            raise ValueError("Batch mode needs a single backend with an OpenAI client, not a deployment pool")
+
+        self.llm_api = llm_api
+        self.client = llm_api.client
+        self.batch_dir = batch_dir
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.price_factor = price_factor
+        self.resume = resume
+
+        os.makedirs(self.batch_dir, exist_ok=True)
+        self.state_path = os.path.join(self.batch_dir, "state.json")
+        self.state = self.load_state()
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {"batches": {}}
+
+        with open(self.state_path, "r") as f:
+            return json.load(f)
+
+    def save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def write_batch_files(self, requests):
+        """Write (custom_id, request) pairs to batch files respecting the size limits.
+
+        Returns:
+            List of paths of the written batch files.
+        """
+        paths = []
+        lines = []
+        size = 0
+
+        def flush():
+            path = os.path.join(self.batch_dir, f"batch_{len(paths):04d}.jsonl")
+            with open(path, "w") as f:
+                f.writelines(lines)
+            paths.append(path)
+
+        for custom_id, request in requests:
+            line = json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": self.llm_api.batch_endpoint,
+                "body": request,
+            }) + "\n"
+            line_size = len(line.encode("utf-8"))
+
+            if lines and (len(lines) >= self.max_requests or size + line_size > self.max_bytes):
+                flush()
+                lines, size = [], 0
+
+            lines.append(line)
+            size += line_size
+
+        if lines:
+            flush()
+
+        return paths
+
+    def has_output(self, batch):
+        """Whether the output files of a finished batch can still be downloaded (providers delete them after a while)."""
+        for file_id in [batch["output_file_id"], batch["error_file_id"]]:
+            if not file_id:
+                continue
+            try:
+                self.client.files.retrieve(file_id)
+            except openai.NotFoundError:
+                return False
+        return True
+
+    def submit(self, path):
+        """Upload and submit a batch file, unless resuming and an identical one was already submitted.
+
+        Returns:
+            Hash of the batch file, which keys its entry in the state.
+        """
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+
+        batch = self.state["batches"].get(digest)
+        if self.resume and batch and batch["status"] not in BATCH_RETRY_STATUSES:
+            if batch["status"] != "completed" or self.has_output(batch):
+                logging.info(f"Reusing batch {batch['batch_id']} ({batch['status']}) for {path}")
+                return digest
+            logging.warning(f"Output of batch {batch['batch_id']} no longer exists; submitting {path} again")
+
+        with open(path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+
+        created = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.llm_api.batch_endpoint,
+            completion_window=self.completion_window,
+        )
+        logging.info(f"Submitted batch {created.id} for {path}")
+
+        self.state["batches"][digest] = {
+            "path": path,
+            "batch_id": created.id,
+            "status": created.status,
+            "output_file_id": None,
+            "error_file_id": None,
+        }
+        self.save_state()
+        return digest
+
+    def poll(self, digests):
+        """Wait until every batch in ``digests`` has reached a terminal status."""
+        while True:
+            pending = [
+                digest for digest in digests
+                if self.state["batches"][digest]["status"] not in BATCH_TERMINAL_STATUSES
+            ]
+            if not pending:
+                return
+
+            for digest in pending:
+                batch = self.state["batches"][digest]
+                retrieved = self.client.batches.retrieve(batch["batch_id"])
+                batch["status"] = retrieved.status
+                batch["output_file_id"] = retrieved.output_file_id
+                batch["error_file_id"] = retrieved.error_file_id
+
+                counts = retrieved.request_counts
+                if counts:
+                    logging.info(f"Batch {batch['batch_id']}: {retrieved.status}, {counts.completed}/{counts.total} completed, {counts.failed} failed")
+                else:
+                    logging.info(f"Batch {batch['batch_id']}: {retrieved.status}")
+
+            self.save_state()
+
+            if any(self.state["batches"][digest]["status"] not in BATCH_TERMINAL_STATUSES for digest in digests):
+                time.sleep(self.poll_interval)
+
+    def build_metadata(self, record):
+        """Convert one line of a batch output or error file to generate_with_metadata() metadata."""
+        response = record.get("response") or {}
+        if response.get("status_code") == 200:
+            completion = ChatCompletion.construct(**response["body"])
+            metadata = self.llm_api.build_metadata(completion, None)
+            if metadata["cost"] is not None:
+                metadata["cost"] *= self.price_factor
+            return metadata, completion
+
+        metadata = self.llm_api.build_metadata(None, None)
+        error = record.get("error") or (response.get("body") or {}).get("error") or {}
+        metadata["error"] = {
+            "type": error.get("code") or "BatchError",
+            "status": response.get("status_code"),
+        }
+        return metadata, None
+
+    def download(self, digest):
+        """Return {custom_id: (metadata, completion)} for a finished batch."""
+        batch = self.state["batches"][digest]
+        outputs = {}
+
+        for file_id in [batch["output_file_id"], batch["error_file_id"]]:
+            if not file_id:
+                continue
+
+            content = self.client.files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                outputs[record["custom_id"]] = self.build_metadata(record)
+
+        if batch["status"] != "completed":
+            logging.error(f"Batch {batch['batch_id']} ended with status {batch['status']}")
+
+        return outputs
+
+    def run(self, entries):
+        """Send entries through the batch API.
+
+        Entries already in the response cache are answered from it and not
+        submitted.
+
+        Args:
+            entries: Task entries with an "id", a "prompt" and optionally
+                their "max_new_tokens".
+
+        Returns:
+            Dictionary mapping entry ids to metadata, as returned by
+            generate_with_metadata(). Entries missing from the batch output are
+            absent.
+        """
+        metadata = {}
+        cache_keys = {}
+        requests = []
+
+        for entry in entries:
+            request = self.llm_api.build_request(entry["prompt"], entry.get("max_new_tokens"))
+            cache_key, cached = self.llm_api.lookup_cache(request)
+            if cached:
+                metadata[entry["id"]] = self.llm_api.build_cached_metadata(cached)
+                continue
+
+            cache_keys[entry["id"]] = cache_key
+            requests.append((entry["id"], request))
+
+        if not requests:
+            return metadata
+
+        paths = self.write_batch_files(requests)
+        logging.info(f"Wrote {len(requests)} requests to {len(paths)} batch files in {self.batch_dir}")
+
+        digests = [self.submit(path) for path in paths]
+        self.poll(digests)
+
+        for digest in digests:
+            for custom_id, (entry_metadata, completion) in self.download(digest).items():
+                metadata[custom_id] = entry_metadata
+                if completion is not None and custom_id in cache_keys:
+                    self.llm_api.store_cache(cache_keys[custom_id], completion)
+
+        return metadata
@@ -0,0 +1,263 @@
+"""
+Estimate the tokens, cost and duration of a run before sending any request.
+
+Prompts are tokenized with the gpt-4 encoding (contexts shared by several
+prompts are tokenized once, in parallel threads) and the token counts of each
+task file are cached on disk, keyed by the path, size and modification time of
+the file. Output tokens are estimated from the length of the reference answer.
+"""
+
+import json
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from evaluate import format_reference
+from inference import compute_cost
+from task.context_utils import ContextGenerator
+
+# Provider-side prompt caching serves prompts of at least 1024 tokens, in blocks of 128 tokens
+MIN_CACHED_PROMPT_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+
+
+class TokenCounter:
+    """Count the prompt, context and reference tokens of task entries.
+
+    Attributes:
+        cache_path: JSON file holding the counts of already tokenized task
+            files (None to disable the cache).
+        num_threads: Number of threads used to tokenize.
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, num_threads: Optional[int] = None) -> None:
+        self.cache_path = cache_path
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.cache: Dict[str, Dict[str, List[int]]] = {}
+        self.dirty = False
+
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r') as f:
+                self.cache = json.load(f)
+
+    def count(self, texts: List[str]) -> List[int]:
+        """Return the number of tokens of each text, tokenizing each distinct text once."""
+        unique_texts = list(dict.fromkeys(texts))
+        encoded = ContextGenerator.tokenizer.encode_ordinary_batch(unique_texts, num_threads=self.num_threads)
+        counts = {text: len(tokens) for text, tokens in zip(unique_texts, encoded)}
+        return [counts[text] for text in texts]
+
+    def count_task(self, task_data_path: str, task_data: List[Dict[str, Any]], delimiter: str) -> Dict[str, List[int]]:
+        """Return the prompt, context and reference token counts of each entry of a task file.
+
+        Args:
+            task_data_path: Path of the task file, used as cache key with its size and modification time.
+            task_data: Entries of the task file.
+            delimiter: String separating the context of a prompt from its instruction.
+
+        Returns:
+            Dictionary with "prompt", "prefix" and "reference" lists aligned with task_data.
+        """
+        stat = os.stat(task_data_path)
+        key = f"{os.path.abspath(task_data_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        if key in self.cache:
+            return self.cache[key]
+
+        prefixes, suffixes = [], []
+        for entry in task_data:
+            prefix, separator, suffix = entry.get("prompt", "").partition(delimiter)
+            prefixes.append(prefix)
+            suffixes.append(separator + suffix)
+
+        prefix_counts = self.count(prefixes)
+        suffix_counts = self.count(suffixes)
+        counts = {
+            "prompt": [prefix + suffix for prefix, suffix in zip(prefix_counts, suffix_counts)],
+            "prefix": prefix_counts,
+            "reference": self.count([format_reference(entry.get("reference", "")) for entry in task_data]),
+        }
+
+        self.cache[key] = counts
+        self.dirty = True
+        return counts
+
+    def save(self) -> None:
+        if not self.cache_path or not self.dirty:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.cache, f)
+        os.replace(tmp_path, self.cache_path)
+        self.dirty = False
+
+
+def get_cacheable_tokens(prefix_tokens: int) -> int:
+    """Number of prompt tokens a provider prefix cache can serve for a shared context."""
+    if prefix_tokens < MIN_CACHED_PROMPT_TOKENS:
+        return 0
+    return prefix_tokens // CACHE_BLOCK_TOKENS * CACHE_BLOCK_TOKENS
+
+
+def get_entry_usage(entry: Dict[str, Any], follower: bool = False) -> Dict[str, int]:
+    """Estimated usage of an entry; a follower of its context is served from the prompt cache."""
+    return {
+        "prompt_tokens": entry["prompt_tokens"],
+        "completion_tokens": entry["output_tokens"],
+        "cached_tokens": get_cacheable_tokens(entry["prefix_tokens"]) if follower else 0,
+        "total_tokens": entry["prompt_tokens"] + entry["output_tokens"],
+    }
+
+
+def estimate_usage(entries: List[Dict[str, Any]], prefix_ordering: bool = True) -> List[Dict[str, int]]:
+    """Estimate the usage of each entry when sent in order.
+
+    With ``prefix_ordering``, every entry but the first of each shared context
+    is assumed to be served from the provider's prompt cache.
+
+    Args:
+        entries: Entry estimates with "task", "prefix_key", "prompt_tokens",
+            "prefix_tokens" and "output_tokens".
+        prefix_ordering: Entries sharing a context are sent back-to-back.
+
+    Returns:
+        Usage dictionaries (as LLM_API.get_usage()) aligned with entries.
+    """
+    leaders = set()
+    usages = []
+    for entry in entries:
+        prefix_key = (entry["task"], entry["prefix_key"])
+        usages.append(get_entry_usage(entry, follower=prefix_ordering and prefix_key in leaders))
+        leaders.add(prefix_key)
+
+    return usages
+
+
+def estimate_cost(usages: List[Dict[str, int]], prices: List[Optional[Dict[str, float]]]) -> Optional[float]:
+    """Total cost of the usages for every model priced in ``prices`` (None if a model has no price)."""
+    if not prices or any(price is None for price in prices):
+        return None
+    return sum(compute_cost(usage, price) for usage in usages for price in prices)
+
+
+def estimate_minutes(
+    usages: List[Dict[str, int]],
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+) -> Optional[float]:
+    """Minimum wall time in minutes to send the usages under a request and token quota (None without a quota)."""
+    bounds = []
+    if requests_per_minute:
+        bounds.append(len(usages) / requests_per_minute)
+    if tokens_per_minute:
+        bounds.append(sum(usage["total_tokens"] for usage in usages) / tokens_per_minute)
+    return max(bounds) if bounds else None
+
+
+def summarize_estimate(
+    entries: List[Dict[str, Any]],
+    prices: List[Optional[Dict[str, float]]],
+    quota: Tuple[Optional[float], Optional[float]] = (None, None),
+    prefix_ordering: bool = True,
+) -> Dict[str, Any]:
+    """Project the tokens, cost and minimum duration of sending entries, overall and per task."""
+    usages = estimate_usage(entries, prefix_ordering)
+
+    def summarize(indices: List[int]) -> Dict[str, Any]:
+        selected = [usages[index] for index in indices]
+        return {
+            "requests": len(selected),
+            "prompt_tokens": sum(usage["prompt_tokens"] for usage in selected),
+            "cached_tokens": sum(usage["cached_tokens"] for usage in selected),
+            "completion_tokens": sum(usage["completion_tokens"] for usage in selected),
+            "cost": estimate_cost(selected, prices),
+            "rate_limited_minutes": estimate_minutes(selected, *quota),
+        }
+
+    indices_by_task: Dict[str, List[int]] = {}
+    for index, entry in enumerate(entries):
+        indices_by_task.setdefault(entry["task"], []).append(index)
+
+    summary = summarize(list(range(len(entries))))
+    summary["tasks"] = {task: summarize(indices) for task, indices in indices_by_task.items()}
+    return summary
+
+
+def select_within_budget(
+    entries: List[Dict[str, Any]],
+    budget: float,
+    prices: List[Dict[str, float]],
+    prefix_ordering: bool = True,
+) -> List[Dict[str, Any]]:
+    """Select the largest subset of entries whose cost fits the budget, stratified by variables.
+
+    Entries are grouped into strata by task and variable values. The same
+    fraction of every stratum is taken (at least one entry per stratum, from
+    the start of the stratum so that entries sharing a context stay
+    together), with the fraction found by bisection; the remaining budget is
+    then spent one entry at a time on the least covered strata.
+
+    Args:
+        entries: Entry estimates with a "stratum" key, in run order.
+        budget: Maximum cost of the selection.
+        prices: Price entry of every model the entries will be sent to.
+        prefix_ordering: Entries sharing a context are sent back-to-back.
+
+    Returns:
+        Selected entries, in run order.
+    """
+    strata: Dict[Any, List[int]] = {}
+    for index, entry in enumerate(entries):
+        strata.setdefault(entry["stratum"], []).append(index)
+
+    def select(taken: Dict[Any, int]) -> List[Dict[str, Any]]:
+        indices = sorted(index for stratum, count in taken.items() for index in strata[stratum][:count])
+        return [entries[index] for index in indices]
+
+    def cost_of(selection: List[Dict[str, Any]]) -> float:
+        return estimate_cost(estimate_usage(selection, prefix_ordering), prices)
+
+    def allocate(fraction: float) -> Dict[Any, int]:
+        return {
+            stratum: max(1, math.floor(fraction * len(indices)))
+            for stratum, indices in strata.items()
+        }
+
+    if cost_of(entries) <= budget:
+        return list(entries)
+
+    taken = {stratum: 0 for stratum in strata}
+    if cost_of(select(allocate(0.0))) <= budget:
+        low, high = 0.0, 1.0
+        for _ in range(30):
+            middle = (low + high) / 2
+            if cost_of(select(allocate(middle))) <= budget:
+                low = middle
+            else:
+                high = middle
+        taken = allocate(low)
+
+    # Spend what is left on the least covered strata. Adding an entry costs it
+    # as a prompt cache follower if its context is already selected.
+    selection = select(taken)
+    spent = cost_of(selection)
+    contexts = {(entry["task"], entry["prefix_key"]) for entry in selection}
+
+    while True:
+        candidates = sorted(
+            (stratum for stratum in strata if taken[stratum] < len(strata[stratum])),
+            key=lambda stratum: taken[stratum] / len(strata[stratum]),
+        )
+        for stratum in candidates:
+            entry = entries[strata[stratum][taken[stratum]]]
+            context = (entry["task"], entry["prefix_key"])
+            usage = get_entry_usage(entry, follower=prefix_ordering and context in contexts)
+            cost = estimate_cost([usage], prices)
+            if spent + cost <= budget:
+                taken[stratum] += 1
+                spent += cost
+                contexts.add(context)
+                break
+        else:
+            return select(taken)
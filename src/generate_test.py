@@ -1,13 +1,20 @@
 import argparse
+import hashlib
 import json
 import logging
+import multiprocessing
 import os
+import random
 import sys
-from typing import Dict, List, Any, Optional
+import traceback
+from typing import Dict, List, Any, Optional, Tuple
 
+import tiktoken
+import yaml
 from tqdm import tqdm
 
 from utils import TASK_CLASSES
+from task.context_utils import ContextGenerator
 
 # Import all task modules
 from task.search import *
@@ -27,18 +34,194 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Fingerprints of the task files of an output directory, see generate_memory_tests
+MANIFEST_FILENAME = "manifest.json"
+
+
+def load_generation_config(config_path: Optional[str]) -> Dict[str, Any]:
+    """Load the overrides of task variables and sample counts (see src/generation_config.yaml)."""
+    if not config_path:
+        return {}
+
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f) or {}
+
+    unknown_keys = set(config) - {"defaults", "tasks"}
+    if unknown_keys:
+        raise ValueError(f"Unknown keys in {config_path}: {', '.join(sorted(unknown_keys))}")
+    return config
+
+
+def create_task(task_class_info: Any, config: Optional[Dict[str, Any]] = None) -> Any:
+    """Instantiate a task from a TASK_CLASSES entry (a class, or a dict with the class and its params).
+
+    Args:
+        task_class_info: Entry of TASK_CLASSES.
+        config: Generation config. Its "defaults" set ``num_samples`` and the
+            variables the task has, and its "tasks" entry for the task name
+            sets ``num_samples`` and variables, which must exist.
+
+    Raises:
+        ValueError: If the config overrides a variable the task does not have.
+    """
+    if isinstance(task_class_info, dict):
+        task_instance = task_class_info["class"](**task_class_info["params"])
+    else:
+        task_instance = task_class_info()
+
+    config = config or {}
+    defaults = config.get("defaults") or {}
+    task_config = (config.get("tasks") or {}).get(task_instance.task_name) or {}
+
+    for name, values in (defaults.get("variables") or {}).items():
+        if name in task_instance.variables:
+            task_instance.variables[name] = values
+    for name, values in (task_config.get("variables") or {}).items():
+        if name not in task_instance.variables:
+            raise ValueError(f"Task {task_instance.task_name} has no variable {name}")
+        task_instance.variables[name] = values
+
+    num_samples = task_config.get("num_samples", defaults.get("num_samples"))
+    if num_samples is not None:
+        task_instance.num_samples = num_samples
+
+    return task_instance
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_code_fingerprint() -> str:
+    """SHA-256 of the generator code: this script and the task package."""
+    task_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "task")
+    paths = [os.path.abspath(__file__)] + sorted(
+        os.path.join(task_dir, name) for name in os.listdir(task_dir) if name.endswith(".py")
+    )
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf-8"))
+        digest.update(hash_file(path).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_task_fingerprint(task_instance: Any, task_class_info: Any, seed: int, code_fingerprint: str) -> str:
+    """Fingerprint of everything a task file is generated from.
+
+    Covers the task class and its parameters, variables, number of samples
+    and output budget, the master seed, the generator code, the vocabulary
+    and the tokenizer.
+    """
+    task_class = type(task_instance)
+    description = {
+        "class": f"{task_class.__module__}.{task_class.__qualname__}",
+        "params": task_class_info["params"] if isinstance(task_class_info, dict) else {},
+        "variables": task_instance.variables,
+        "num_samples": task_instance.num_samples,
+        "output_budget": task_instance.output_budget,
+        "seed": seed,
+        "code": code_fingerprint,
+        "vocabulary": ContextGenerator.WORDS.get_fingerprint(),
+        "tokenizer": [ContextGenerator.tokenizer.name, tiktoken.__version__],
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def load_manifest(output_dir: str) -> Dict[str, Any]:
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {"tasks": {}}
+
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except json.JSONDecodeError:
+        logger.warning(f"Ignoring invalid manifest {manifest_path}")
+        return {"tasks": {}}
+    manifest.setdefault("tasks", {})
+    return manifest
+
+
+def save_manifest(output_dir: str, manifest: Dict[str, Any]) -> None:
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def is_up_to_date(manifest: Dict[str, Any], output_dir: str, task_output_path: str, fingerprint: str) -> bool:
+    """Whether the task file exists, is unchanged and was generated with the same fingerprint."""
+    record = manifest["tasks"].get(os.path.relpath(task_output_path, output_dir))
+    if not record or record.get("fingerprint") != fingerprint or not os.path.exists(task_output_path):
+        return False
+    return hash_file(task_output_path) == record.get("sha256")
+
+
+def get_unit_seed(seed: int, category: str, task_name: str, sample: int) -> int:
+    """Seed of one sample of a task, derived from the master seed and stable identifiers only."""
+    digest = hashlib.sha256(f"{seed}/{category}/{task_name}/{sample}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def generate_unit(unit: Tuple[str, int, int, int, Dict[str, Any]]) -> Tuple[Optional[str], Optional[str]]:
+    """Generate the entries of one sample of a task.
+
+    The task is instantiated with ``num_samples = 1`` and the random module is
+    seeded for this sample alone, so the result does not depend on the
+    process it runs in or on what ran there before.
+
+    Args:
+        unit: Category, position of the task in TASK_CLASSES[category],
+            sample index, seed and generation config.
+
+    Returns:
+        The entries as JSONL text, or None and the formatted error.
+    """
+    category, position, sample, seed, config = unit
+    try:
+        task_instance = create_task(TASK_CLASSES[category][position], config)
+        task_instance.num_samples = 1
+        random.seed(seed)
+        task_data = task_instance.add_output_budgets(task_instance.compile_task_data())
+        return "".join(json.dumps(entry) + "\n" for entry in task_data), None
+    except Exception as e:
+        return None, f"{str(e)}\n{traceback.format_exc()}"
+
 
 def generate_memory_tests(
     output_dir: str, 
     task_category: Optional[str] = None, 
     task_name: Optional[str] = None,
+    workers: int = 1,
+    seed: Optional[int] = None,
+    config: Optional[Dict[str, Any]] = None,
+    force: bool = False,
 ) -> List[Dict[str, Any]]:
     """Generate LLM memory tests.
     
+    Each task is generated one sample at a time (its variables with
+    ``num_samples = 1``), each sample seeded from ``seed`` and the task and
+    sample identifiers. Samples run in a pool of ``workers`` processes and are
+    written in order, so the output is the same for any number of workers.
+    
+    The fingerprint of each task (see get_task_fingerprint) is recorded in
+    manifest.json in ``output_dir``; tasks whose file is unchanged and whose
+    fingerprint matches are skipped.
+    
     Args:
         output_dir: Directory to save the generated tests.
         task_category: Category of tasks to generate tests for (optional).
         task_name: Specific task to generate tests for (optional).
+        workers: Number of processes generating samples.
+        seed: Master seed (optional). A random one is drawn and logged if it
+            is not given, in which case every task is regenerated.
+        config: Overrides of task variables and sample counts (see
+            load_generation_config).
+        force: Regenerate tasks that are up to date.
     
     Returns:
         List of dictionaries containing information about generated tests.
@@ -58,64 +241,110 @@ def generate_memory_tests(
     else:
         categories = TASK_CLASSES.keys()
 
-    # Generate tests for each category
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    logger.info(f"Generating with seed {seed} (pass --seed {seed} to reproduce)")
+
+    config = config or {}
+    task_names = {
+        create_task(task_class_info).task_name for task_class_info in sum(TASK_CLASSES.values(), [])
+    }
+    for name in config.get("tasks") or {}:
+        if name not in task_names:
+            logger.warning(f"The generation config overrides an unknown task: {name}")
+
+    manifest = load_manifest(output_dir)
+    code_fingerprint = get_code_fingerprint()
+
+    # Collect the tasks to generate and split them into samples
+    tasks = []
+    units = []
+    skipped = 0
     for category in categories:
-        category_dir = os.path.join(output_dir, category)
-        os.makedirs(category_dir, exist_ok=True)
-        logger.info(f"Generating tasks for category: {category}")
+        os.makedirs(os.path.join(output_dir, category), exist_ok=True)
 
-        for task_class_info in tqdm(TASK_CLASSES[category], desc=f"Tasks in {category}"):
+        for position, task_class_info in enumerate(TASK_CLASSES[category]):
             try:
-                # Handle both simple class references and parameterized classes
-                if isinstance(task_class_info, dict):
-                    task_class = task_class_info["class"]
-                    params = task_class_info["params"]
-                    task_instance = task_class(**params)
-                else:
-                    task_class = task_class_info
-                    task_instance = task_class()
-            
-                # Skip if we're filtering by task name and this doesn't match
-                if task_name and task_instance.task_name != task_name:
-                    continue
-                
-                logger.info(f"Generating task: {task_instance.task_name} ({task_class.__name__})")
-                
-                # Set the output path for this task
-                file_extension = ".jsonl"
-                task_output_path = os.path.join(category_dir, f"{task_instance.task_name}{file_extension}")
-                task_instance.task_data_filepath = task_output_path
-
-                # Generate the task data
-                task_data = task_instance.compile_task_data()
-
-                # Save the task data to a file
-
-                with open(task_output_path, "w") as f:
-                    for entry in task_data:
-                        f.write(json.dumps(entry) + "\n")
-
-                logger.info(f"Saved {len(task_data)} samples to {task_output_path}")
-
-                generated_tests.append({
-                    "category": category,
-                    "task_name": task_instance.task_name,
-                    "class_name": task_class.__name__,
-                    "samples": len(task_data),
-                    "path": task_output_path
-                })
+                task_instance = create_task(task_class_info, config)
             except Exception as e:
-                logger.error(f"Error generating task {task_class.__name__}: {str(e)}")
+                logger.error(f"Error creating task {task_class_info}: {str(e)}")
+                continue
+
+            # Skip if we're filtering by task name and this doesn't match
+            if task_name and task_instance.task_name != task_name:
+                continue
+
+            # Set the output path for this task
+            file_extension = ".jsonl"
+            task_output_path = os.path.join(output_dir, category, f"{task_instance.task_name}{file_extension}")
+            task_instance.task_data_filepath = task_output_path
+
+            fingerprint = get_task_fingerprint(task_instance, task_class_info, seed, code_fingerprint)
+            if not force and is_up_to_date(manifest, output_dir, task_output_path, fingerprint):
+                logger.info(f"{category} - {task_instance.task_name} is up to date, skipping")
+                skipped += 1
+                continue
+
+            tasks.append({
+                "category": category,
+                "task_name": task_instance.task_name,
+                "class_name": type(task_instance).__name__,
+                "samples": 0,
+                "path": task_output_path,
+                "units": task_instance.num_samples,
+                "fingerprint": fingerprint,
+                "error": None,
+            })
+            for sample in range(task_instance.num_samples):
+                units.append((category, position, sample, get_unit_seed(seed, category, task_instance.task_name, sample), config))
+
+    logger.info(f"Generating {len(tasks)} tasks ({len(units)} samples) with {workers} worker(s), {skipped} up to date")
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        results = pool.imap(generate_unit, units) if pool else map(generate_unit, units)
+        results = iter(tqdm(results, total=len(units), desc="Samples"))
+
+        for task in tasks:
+            temp_path = task["path"] + ".tmp"
+            with open(temp_path, "w") as f:
+                for _ in range(task.pop("units")):
+                    data, error = next(results)
+                    if error is not None:
+                        task["error"] = task["error"] or error
+                    elif task["error"] is None:
+                        # Save the task data to a file
+                        f.write(data)
+                        task["samples"] += data.count("\n")
+
+            if task["error"] is not None:
+                os.remove(temp_path)
+                logger.error(f"Error generating task {task['class_name']}: {task['error'].splitlines()[0]}")
                 if "--debug" in sys.argv:
-                    import traceback
-                    traceback.print_exc()
+                    print(task["error"], file=sys.stderr)
+                continue
+
+            os.replace(temp_path, task["path"])
+            logger.info(f"Saved {task['samples']} samples to {task['path']}")
+
+            manifest["tasks"][os.path.relpath(task["path"], output_dir)] = {
+                "fingerprint": task["fingerprint"],
+                "sha256": hash_file(task["path"]),
+                "samples": task["samples"],
+            }
+            save_manifest(output_dir, manifest)
+
+            generated_tests.append({key: task[key] for key in ["category", "task_name", "class_name", "samples", "path"]})
+    finally:
+        if pool:
+            pool.terminate()
 
     # Output summary of generated tests
     if generated_tests:
         logger.info(f"Generated {len(generated_tests)} test sets:")
         for test in generated_tests:
             logger.info(f"  {test['category']} - {test['task_name']} ({test['class_name']}): {test['samples']} samples")
-    else:
+    elif not skipped:
         logger.warning("No tests were generated. Check your filters or task configurations.")
 
     return generated_tests
@@ -142,6 +371,29 @@ def main():
         type=str, 
         help="Generate tests only for this specific task"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes generating samples in parallel (the output does not depend on it)"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Master seed; each sample is seeded from it and its task and sample index (random if not set)"
+    )
+    parser.add_argument(
+        "--generation_config",
+        type=str,
+        default=None,
+        help="YAML file overriding the variables and num_samples of tasks (see src/generation_config.yaml)"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate tasks whose files are up to date according to the manifest"
+    )
     parser.add_argument(
         "--debug", 
         action="store_true", 
@@ -180,6 +432,10 @@ def main():
             output_dir=args.output_dir,
             task_category=args.task_category,
             task_name=args.task_name,
+            workers=args.workers,
+            seed=args.seed,
+            config=load_generation_config(args.generation_config),
+            force=args.force,
         )
     except Exception as e:
         logger.error(f"Error: {str(e)}")
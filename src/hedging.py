@@ -0,0 +1,171 @@
+import asyncio
+import time
+from collections import deque
+
+import logging
+
+from run_summary import Reservoir, percentile
+
+logging.basicConfig(level=logging.INFO)
+
+
+class Hedger:
+    """Duplicate requests that are slower than usual and keep the first answer.
+
+    Latencies are tracked per key (the task and context length), measured
+    from when a request is sent, after the rate limiter let it through, so
+    throttling is not taken for slowness. Once ``min_samples`` requests of a
+    key have completed, a request still running after the ``quantile``
+    percentile of the last ``window`` latencies gets a second copy; the
+    first copy to return a generation wins and the other one is cancelled.
+    At most ``budget`` times the number of requests are duplicated, and the
+    second copy waits for a slot of the caller's semaphore like any other
+    request.
+
+    Attributes:
+        requests: Number of requests sent through the hedger.
+        hedged: Number of requests that were duplicated.
+    """
+
+    def __init__(self, budget=0.05, quantile=95, min_samples=20, window=1000, refresh=10):
+        self.budget = budget
+        self.quantile = quantile
+        self.min_samples = min_samples
+        # The trigger of a key is the percentile of its last ``window`` latencies, recomputed every
+        # ``refresh`` new latencies
+        self.window = window
+        self.refresh = refresh
+
+        self.requests = 0
+        self.hedged = 0
+        # Reported distributions, over all keys (per key in ``tasks``)
+        self.latency = Reservoir()
+        self.hedged_latency = Reservoir()
+        self.latencies = {}
+        self.samples = {}
+        self.triggers = {}
+        self.tasks = {}
+
+    def get_trigger(self, key):
+        """Seconds after which a request of ``key`` is duplicated, or None while too few latencies are known."""
+        latencies = self.latencies.get(key, ())
+        if len(latencies) < self.min_samples:
+            return None
+
+        samples = self.samples[key]
+        computed_at, trigger = self.triggers.get(key, (None, None))
+        if computed_at is None or samples - computed_at >= self.refresh:
+            trigger = percentile(list(latencies), self.quantile)
+            self.triggers[key] = (samples, trigger)
+        return trigger
+
+    def record_latency(self, key, latency):
+        self.latencies.setdefault(key, deque(maxlen=self.window)).append(latency)
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+    @staticmethod
+    async def run_backup(call, semaphore):
+        if semaphore is None:
+            return await call(None)
+        async with semaphore:
+            return await call(None)
+
+    async def run(self, key, call, semaphore=None):
+        """Await ``call(on_send)``, duplicating it if it is slow.
+
+        Args:
+            key: Key whose latencies set the hedging trigger.
+            call: Coroutine function returning generate_with_metadata()
+                metadata; it must call ``on_send`` (if not None) when the
+                request is sent.
+            semaphore: Semaphore bounding the requests in flight, held by the
+                caller for the first copy; the second copy acquires its own slot.
+
+        Returns:
+            Metadata of the winning copy, with the latency measured from when
+            the first copy was sent and "hedged" set if a second copy was sent.
+        """
+        stats = self.tasks.setdefault(key, {"requests": 0, "hedged": 0, "backup_wins": 0, "latency": Reservoir()})
+        self.requests += 1
+        stats["requests"] += 1
+
+        start_time = time.time()
+        sent_at = None
+        sent = asyncio.Event()
+
+        def on_send():
+            nonlocal sent_at
+            if sent_at is None:
+                sent_at = time.time()
+                sent.set()
+
+        primary = asyncio.ensure_future(call(on_send))
+        pending = {primary}
+
+        trigger = self.get_trigger(key)
+        if trigger is not None:
+            # Start the clock once the request is sent, not while it waits for the rate limiter
+            waiter = asyncio.ensure_future(sent.wait())
+            await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+
+            if not primary.done():
+                done, _ = await asyncio.wait(pending, timeout=max(0.0, sent_at + trigger - time.time()))
+                if not done and self.hedged < self.budget * self.requests:
+                    self.hedged += 1
+                    stats["hedged"] += 1
+                    pending.add(asyncio.ensure_future(self.run_backup(call, semaphore)))
+        hedged = len(pending) > 1
+
+        metadata, winner = None, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer a generation over a failure, and the first copy if both returned at once
+                for task in sorted(done, key=lambda task: task is not primary):
+                    result = task.result()
+                    if metadata is None or (metadata["generation"] is None and result["generation"] is not None):
+                        metadata, winner = result, task
+
+                if metadata["generation"] is not None:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+
+        latency = time.time() - (sent_at or start_time)
+        if sent_at is not None and not metadata.get("cache_hit"):
+            self.record_latency(key, latency)
+            self.latency.add(latency)
+            stats["latency"].add(latency)
+
+        if hedged:
+            self.hedged_latency.add(latency)
+            if winner is not primary:
+                stats["backup_wins"] += 1
+            metadata = dict(metadata, latency=latency, hedged=True)
+
+        return metadata
+
+    def get_stats(self):
+        tasks = {}
+        for key, stats in self.tasks.items():
+            tasks[key] = {
+                "requests": stats["requests"],
+                "hedged": stats["hedged"],
+                "backup_wins": stats["backup_wins"],
+                "trigger": self.get_trigger(key),
+                "latency": stats["latency"].distribution(),
+            }
+
+        return {
+            "budget": self.budget,
+            "quantile": self.quantile,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            "backup_wins": sum(stats["backup_wins"] for stats in self.tasks.values()),
+            "latency": self.latency.distribution(),
+            "hedged_latency": self.hedged_latency.distribution(),
+            "tasks": tasks,
+        }
@@ -1,5 +1,11 @@
+import asyncio
+import importlib.util
+import httpx
 import openai
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI, OpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+import random
 import time
 import yaml
 
@@ -7,39 +13,154 @@ from azure.identity import (
     AzureCliCredential,
     get_bearer_token_provider,
 )
+from azure.identity.aio import (
+    AzureCliCredential as AsyncAzureCliCredential,
+    get_bearer_token_provider as get_async_bearer_token_provider,
+)
+
+from rate_limiter import estimate_request_tokens, get_prompt_chars, parse_retry_after
 
 import logging
 logging.basicConfig(level=logging.INFO)
 
 
-class Azure_LLM_API:
-    def __init__(self, model_name, endpoint, api_version, client_id, scope):
-        self.model_name = model_name
+# Errors that are not worth retrying
+RETRY_ABORT_ERRORS = (
+    openai.BadRequestError,
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.NotFoundError,
+    openai.UnprocessableEntityError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    openai.APIStatusError,
+)
 
-        self.azure_endpoint = endpoint
-        self.api_version = api_version
-        self.client_id = client_id
-        self.scope = scope
 
-        token_provider = get_bearer_token_provider(
-            AzureCliCredential(),
-            self.scope,
-        )
+def is_transient_error(error):
+    """Whether an error is worth retrying after a short backoff (connection errors, 408, 409 and 5xx)."""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return False
 
-        self.client = AzureOpenAI(
-            azure_endpoint=self.azure_endpoint,
-            api_version=self.api_version,
-            azure_ad_token_provider=token_provider,
-        )
+
+def get_transient_backoff(attempt):
+    """Seconds to wait before retrying a transient error (the backoff the OpenAI clients would have used)."""
+    return min(0.5 * 2 ** attempt, 8) * random.uniform(0.75, 1)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs past its deadline (see LLM_API.get_deadline)."""
+
+
+# HTTP/2 needs the optional h2 package
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Requests are retried by LLM_API (which honors the rate limiter and Retry-After) and failed over by
+# Pooled_LLM_API, so the OpenAI clients must not retry them on their own
+SDK_MAX_RETRIES = 0
+
+
+def compute_cost(usage, price):
+    """Compute the cost of a request from its usage and a price entry.
+
+    Args:
+        usage: Usage dict as returned by LLM_API.get_usage().
+        price: Prices per million tokens: "prompt", "completion" and optionally
+            "cached_prompt" (defaults to the prompt price).
+
+    Returns:
+        Cost in the currency of the price table, or None if either is missing.
+    """
+    if not usage or not price:
+        return None
+
+    cached_tokens = usage.get("cached_tokens") or 0
+    uncached_tokens = (usage.get("prompt_tokens") or 0) - cached_tokens
+    cached_price = price.get("cached_prompt", price.get("prompt", 0.0))
+
+    return (
+        uncached_tokens * price.get("prompt", 0.0)
+        + cached_tokens * cached_price
+        + (usage.get("completion_tokens") or 0) * price.get("completion", 0.0)
+    ) / 1_000_000
+
+
+class LLM_API:
+    """Base class of the chat-completion backends.
+
+    Subclasses create the sync and async OpenAI clients; request building,
+    caching, rate limiting and retries are shared. Every backend exposes
+    generate() / generate_with_metadata() and their async counterparts.
+    """
+
+    def __init__(self, model_name, rate_limiter=None, response_cache=None):
+        self.model_name = model_name
+
+        self.client = None
+        self.async_client = None
+
+        # Optional RateLimiter shared by all workers of a run
+        self.rate_limiter = rate_limiter
+        # Optional ResponseCache consulted before sending a request
+        self.response_cache = response_cache
 
         self.max_tries = 3
+        self.rate_limit_wait = 60
+
+        # Deadline of each attempt: request_timeout seconds plus request_timeout_per_token
+        # for every token of the completion budget (a request_timeout of None disables it)
+        self.request_timeout = 60
+        self.request_timeout_per_token = 0.1
+
+        # Stream completions to measure time-to-first-token and decode rate
+        self.stream = False
+        # Prices per million tokens of this model, used to compute the cost of each request
+        self.price = None
+        # Endpoint named in batch request files (see batch.BatchJob)
+        self.batch_endpoint = "/v1/chat/completions"
 
         self.system_message = "You are a helpful AI assistant."
         self.max_new_tokens = 4096
         self.temperature = 0.0
         self.top_p = 1.0
 
-    def generate(
+    @classmethod
+    def from_config(cls, config, model_name, rate_limiter=None, response_cache=None, max_connections=None):
+        """Create the backend from its section of the API configuration."""
+        raise NotImplementedError
+
+    def create_async_client(self):
+        raise NotImplementedError
+
+    def get_async_client(self):
+        # Created lazily so the client binds to the running event loop
+        if self.async_client is None:
+            self.async_client = self.create_async_client()
+
+        return self.async_client
+
+    async def aclose(self):
+        if self.async_client is not None:
+            await self.async_client.close()
+            self.async_client = None
+
+    def build_messages(self, prompt, chat_history=None):
+        messages = [
+            {"role": "user", "content": prompt},
+        ]
+
+        if chat_history:
+            messages = chat_history + messages
+
+        else:
+            messages = [{"role": "system", "content": self.system_message}] + messages
+
+        return messages
+
+    def build_request(
         self,
         prompt,
         max_new_tokens=None,
@@ -47,6 +168,7 @@ class Azure_LLM_API:
         top_p=None,
         chat_history=None,
     ):
+        """Build the keyword arguments of a chat completion request (without streaming options)."""
 
         if max_new_tokens is None:
             max_new_tokens = self.max_new_tokens
@@ -57,64 +179,635 @@ class Azure_LLM_API:
         if top_p is None:
             top_p = self.top_p
 
-        messages = [
-            {"role": "user", "content": prompt},
-        ]
+        return dict(
+            model=self.model_name,
+            messages=self.build_messages(prompt, chat_history),
+            max_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            frequency_penalty=0.0,
+            presence_penalty=0.0,
+            stop=None,
+        )
 
-        if chat_history:
-            messages = chat_history + messages
+    @staticmethod
+    def get_usage(response):
+        usage = response.usage
+        if not usage:
+            return None
 
-        else:
-            messages = [{"role": "system", "content": self.system_message}] + messages
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) if details else None
+
+        return {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+            "cached_tokens": cached_tokens or 0,
+        }
+
+    @staticmethod
+    def describe_error(error):
+        if error is None:
+            return None
+
+        return {
+            "type": type(error).__name__,
+            "status": getattr(error, "status_code", None),
+        }
+
+    def build_metadata(self, response, latency, error=None, timing=None):
+        """Build the metadata returned by generate_with_metadata().
+
+        Args:
+            response: Parsed ChatCompletion, or None if the request failed.
+            latency: Total wall time of the call, including retries.
+            error: Last error raised by the client, if the request failed.
+            timing: (ttft, decode_seconds) measured on a streamed response.
+        """
+        if response is None:
+            return {
+                "generation": None,
+                "usage": None,
+                "latency": latency,
+                "ttft": None,
+                "output_tokens": None,
+                "tokens_per_second": None,
+                "cost": None,
+                "cache_hit": False,
+                "error": self.describe_error(error),
+            }
+
+        usage = self.get_usage(response)
+        output_tokens = usage["completion_tokens"] if usage else None
+        ttft, decode_seconds = timing or (None, None)
+
+        tokens_per_second = None
+        if output_tokens and decode_seconds:
+            tokens_per_second = output_tokens / decode_seconds
+
+        return {
+            "generation": response.choices[0].message.content,
+            "usage": usage,
+            "latency": latency,
+            "ttft": ttft,
+            "output_tokens": output_tokens,
+            "tokens_per_second": tokens_per_second,
+            "cost": compute_cost(usage, self.price),
+            "cache_hit": False,
+        }
+
+    def build_cached_metadata(self, cached):
+        return {
+            "generation": cached["generation"],
+            "usage": None,
+            "latency": 0.0,
+            "ttft": None,
+            "output_tokens": cached.get("completion_tokens"),
+            "tokens_per_second": None,
+            "cost": 0.0,
+            "cache_hit": True,
+        }
+
+    def build_stream_request(self, request):
+        return dict(request, stream=True, stream_options={"include_usage": True})
+
+    def start_stream(self):
+        return {"start": time.time(), "first_token": None, "content": [], "finish_reason": None, "usage": None, "id": None, "created": None}
+
+    def add_stream_chunk(self, state, chunk):
+        """Accumulate one streamed chunk, noting when the first content token arrived."""
+        if state["id"] is None:
+            state["id"] = chunk.id
+            state["created"] = chunk.created
+
+        if chunk.usage:
+            state["usage"] = chunk.usage
+
+        if not chunk.choices:
+            return
+
+        choice = chunk.choices[0]
+        if choice.delta and choice.delta.content:
+            if state["first_token"] is None:
+                state["first_token"] = time.time()
+            state["content"].append(choice.delta.content)
+
+        if choice.finish_reason:
+            state["finish_reason"] = choice.finish_reason
+
+    def finish_stream(self, state):
+        """Assemble a streamed response into a ChatCompletion and return it with its (ttft, decode_seconds)."""
+        end_time = time.time()
+        first_token = state["first_token"] or end_time
+
+        response = ChatCompletion.construct(
+            id=state["id"] or "",
+            created=state["created"] or int(state["start"]),
+            model=self.model_name,
+            object="chat.completion",
+            choices=[
+                Choice.construct(
+                    index=0,
+                    finish_reason=state["finish_reason"] or "stop",
+                    message=ChatCompletionMessage.construct(
+                        role="assistant",
+                        content="".join(state["content"]),
+                    ),
+                )
+            ],
+            usage=state["usage"],
+        )
+
+        return response, (first_token - state["start"], end_time - first_token)
+
+    def get_deadline(self, request):
+        """Seconds an attempt of the request may take, scaled by its completion budget."""
+        if self.request_timeout is None:
+            return None
+        return self.request_timeout + self.request_timeout_per_token * request["max_tokens"]
+
+    def lookup_cache(self, request):
+        if not self.response_cache:
+            return None, None
+
+        cache_key = self.response_cache.make_key(request)
+        return cache_key, self.response_cache.get(cache_key)
+
+    def store_cache(self, cache_key, response):
+        if not self.response_cache:
+            return
 
+        usage = response.usage
+        self.response_cache.put(
+            cache_key,
+            self.model_name,
+            response.choices[0].message.content,
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None,
+        )
+
+    def estimate_tokens(self, request):
+        if not self.rate_limiter:
+            return 0
+        return estimate_request_tokens(request["messages"], request["max_tokens"], self.rate_limiter.chars_per_token)
+
+    def record_response(self, headers, response, reserved_tokens, request=None):
+        if not self.rate_limiter:
+            return
+
+        self.rate_limiter.update_from_headers(headers)
+        usage = response.usage
+        used_tokens = usage.total_tokens if usage else reserved_tokens
+        self.rate_limiter.record_usage(
+            reserved_tokens,
+            used_tokens,
+            prompt_chars=get_prompt_chars(request["messages"]) if request and usage else None,
+            prompt_tokens=usage.prompt_tokens if usage else None,
+        )
+
+    def release_reservation(self, reserved_tokens):
+        if self.rate_limiter:
+            self.rate_limiter.record_usage(reserved_tokens, 0)
+
+    def record_rate_limit(self, error, reserved_tokens):
+        """Handle a 429 and return how long this worker should sleep before retrying."""
+        headers = error.response.headers if error.response is not None else None
+        retry_after = parse_retry_after(headers)
+        if retry_after is None:
+            retry_after = self.rate_limit_wait
+
+        if not self.rate_limiter:
+            return retry_after
+
+        # The shared limiter pauses every worker, so acquire() does the waiting
+        self.release_reservation(reserved_tokens)
+        self.rate_limiter.record_rate_limit(retry_after)
+        return 0
+
+    def generate(
+        self,
+        prompt,
+        max_new_tokens=None,
+        temperature=None,
+        top_p=None,
+        chat_history=None,
+    ):
+
+        return self.generate_with_metadata(
+            prompt, max_new_tokens, temperature, top_p, chat_history
+        )["generation"]
+
+    def generate_with_metadata(
+        self,
+        prompt,
+        max_new_tokens=None,
+        temperature=None,
+        top_p=None,
+        chat_history=None,
+    ):
+        """Like generate(), but return a dict with the generation, token usage and latency."""
+
+        request = self.build_request(
+            prompt, max_new_tokens, temperature, top_p, chat_history
+        )
+
+        cache_key, cached = self.lookup_cache(request)
+        if cached:
+            return self.build_cached_metadata(cached)
+
+        reserved_tokens = self.estimate_tokens(request)
         response = None
+        error = None
 
         start_time = time.time()
 
-        for _ in range(self.max_tries):
-            
+        timing = None
+        deadline = self.get_deadline(request)
+        timeout = deadline if deadline is not None else openai.NOT_GIVEN
+
+        for attempt in range(self.max_tries):
+            if self.rate_limiter:
+                self.rate_limiter.acquire(reserved_tokens)
+
             try:
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    max_tokens=max_new_tokens,
-                    temperature=temperature,
-                    top_p=top_p,
-                    frequency_penalty=0.0,
-                    presence_penalty=0.0,
-                    stop=None,
-                )
+                if self.stream:
+                    state = self.start_stream()
+                    raw_response = self.client.chat.completions.with_raw_response.create(
+                        **self.build_stream_request(request), timeout=timeout
+                    )
+                    stream = raw_response.parse()
+                    try:
+                        for chunk in stream:
+                            self.add_stream_chunk(state, chunk)
+                            # The client timeout only bounds the wait for each chunk
+                            if deadline is not None and time.time() - state["start"] > deadline:
+                                raise DeadlineExceeded(f"Streamed response exceeded its {deadline:.0f}s deadline")
+                    finally:
+                        stream.close()
+                    response, timing = self.finish_stream(state)
+
+                else:
+                    raw_response = self.client.chat.completions.with_raw_response.create(**request, timeout=timeout)
+                    response = raw_response.parse()
+
+                self.record_response(raw_response.headers, response, reserved_tokens, request)
 
                 if response.choices[0]:
                     break
 
             except openai.RateLimitError as e:
-                logging.info("Rate limit exceeded. Waiting for 60 seconds.")
-                time.sleep(60)
+                error = e
+                wait = self.record_rate_limit(e, reserved_tokens)
+                if attempt < self.max_tries - 1 and wait > 0:
+                    logging.info(f"Rate limit exceeded. Waiting for {wait:.0f} seconds.")
+                    time.sleep(wait)
                 continue
 
-            except (
-                openai.BadRequestError,
-                openai.AuthenticationError,
-                openai.PermissionDeniedError,
-                openai.NotFoundError,
-                openai.UnprocessableEntityError,
-                openai.InternalServerError,
-                openai.APIConnectionError,
-                openai.APIStatusError,
-            ) as e:
+            except (openai.APITimeoutError, DeadlineExceeded) as e:
+                logging.warning(f"Request timed out after its {deadline}s deadline (attempt {attempt + 1}/{self.max_tries})")
+                error = e
+                self.release_reservation(reserved_tokens)
+                continue
+
+            except RETRY_ABORT_ERRORS as e:
                 
-                logging.error(e)
+                error = e
+                self.release_reservation(reserved_tokens)
+                if is_transient_error(e) and attempt < self.max_tries - 1:
+                    wait = get_transient_backoff(attempt)
+                    logging.warning(f"{e} (attempt {attempt + 1}/{self.max_tries}), retrying in {wait:.1f}s")
+                    time.sleep(wait)
+                    continue
 
+                logging.error(e)
                 break
 
+        end_time = time.time()
+
         if not response:
-            return None
+            return self.build_metadata(None, end_time - start_time, error)
         
+        logging.info(f"Time taken: {end_time - start_time:.2f} seconds")
+
+        self.store_cache(cache_key, response)
+
+        return self.build_metadata(response, end_time - start_time, timing=timing)
+
+    async def agenerate(
+        self,
+        prompt,
+        max_new_tokens=None,
+        temperature=None,
+        top_p=None,
+        chat_history=None,
+    ):
+        """Async counterpart of generate() backed by the backend's async client."""
+
+        metadata = await self.agenerate_with_metadata(
+            prompt, max_new_tokens, temperature, top_p, chat_history
+        )
+        return metadata["generation"]
+
+    async def agenerate_with_metadata(
+        self,
+        prompt,
+        max_new_tokens=None,
+        temperature=None,
+        top_p=None,
+        chat_history=None,
+        on_send=None,
+    ):
+        """Async counterpart of generate_with_metadata().
+
+        ``on_send`` is called each time an attempt is sent, once the rate
+        limiter has let it through (e.g. to time requests without their
+        throttling, see hedging.Hedger).
+        """
+
+        client = self.get_async_client()
+        request = self.build_request(
+            prompt, max_new_tokens, temperature, top_p, chat_history
+        )
+
+        cache_key, cached = self.lookup_cache(request)
+        if cached:
+            return self.build_cached_metadata(cached)
+
+        reserved_tokens = self.estimate_tokens(request)
+        response = None
+        error = None
+
+        start_time = time.time()
+        timing = None
+        deadline = self.get_deadline(request)
+
+        async def attempt_request():
+            if self.stream:
+                state = self.start_stream()
+                raw_response = await client.chat.completions.with_raw_response.create(
+                    **self.build_stream_request(request)
+                )
+                stream = raw_response.parse()
+                try:
+                    async for chunk in stream:
+                        self.add_stream_chunk(state, chunk)
+                finally:
+                    # Frees the connection when the deadline or a cancellation interrupts the stream
+                    await stream.close()
+                return raw_response, self.finish_stream(state)
+
+            raw_response = await client.chat.completions.with_raw_response.create(**request)
+            return raw_response, (raw_response.parse(), None)
+
+        for attempt in range(self.max_tries):
+            if self.rate_limiter:
+                await self.rate_limiter.aacquire(reserved_tokens)
+            if on_send:
+                on_send()
+
+            try:
+                raw_response, (response, timing) = await asyncio.wait_for(attempt_request(), deadline)
+
+                self.record_response(raw_response.headers, response, reserved_tokens, request)
+
+                if response.choices[0]:
+                    break
+
+            except openai.RateLimitError as e:
+                error = e
+                wait = self.record_rate_limit(e, reserved_tokens)
+                if attempt < self.max_tries - 1 and wait > 0:
+                    logging.info(f"Rate limit exceeded. Waiting for {wait:.0f} seconds.")
+                    await asyncio.sleep(wait)
+                continue
+
+            except (openai.APITimeoutError, asyncio.TimeoutError) as e:
+                logging.warning(f"Request timed out after its {deadline}s deadline (attempt {attempt + 1}/{self.max_tries})")
+                error = e
+                self.release_reservation(reserved_tokens)
+                continue
+
+            except asyncio.CancelledError:
+                # e.g. the slower copy of a hedged request
+                self.release_reservation(reserved_tokens)
+                raise
+
+            except RETRY_ABORT_ERRORS as e:
+
+                error = e
+                self.release_reservation(reserved_tokens)
+                if is_transient_error(e) and attempt < self.max_tries - 1:
+                    wait = get_transient_backoff(attempt)
+                    logging.warning(f"{e} (attempt {attempt + 1}/{self.max_tries}), retrying in {wait:.1f}s")
+                    await asyncio.sleep(wait)
+                    continue
+
+                logging.error(e)
+                break
+
         end_time = time.time()
+
+        if not response:
+            return self.build_metadata(None, end_time - start_time, error)
+
         logging.info(f"Time taken: {end_time - start_time:.2f} seconds")
 
-        return response.choices[0].message.content
+        self.store_cache(cache_key, response)
+
+        return self.build_metadata(response, end_time - start_time, timing=timing)
+
+
+class Azure_LLM_API(LLM_API):
+    def __init__(self, model_name, endpoint, api_version, client_id, scope, rate_limiter=None, response_cache=None, api_key=None):
+        super().__init__(model_name, rate_limiter=rate_limiter, response_cache=response_cache)
+
+        self.azure_endpoint = endpoint
+        self.api_version = api_version
+        self.client_id = client_id
+        self.scope = scope
+        # Key-based auth (e.g. the local mock server) instead of the Azure CLI credential
+        self.api_key = api_key
+
+        self.async_credential = None
+        self.batch_endpoint = "/chat/completions"
+
+        if self.api_key:
+            self.client = AzureOpenAI(
+                max_retries=SDK_MAX_RETRIES,
+                azure_endpoint=self.azure_endpoint,
+                api_version=self.api_version,
+                api_key=self.api_key,
+            )
+
+        else:
+            token_provider = get_bearer_token_provider(
+                AzureCliCredential(),
+                self.scope,
+            )
+
+            self.client = AzureOpenAI(
+                max_retries=SDK_MAX_RETRIES,
+                azure_endpoint=self.azure_endpoint,
+                api_version=self.api_version,
+                azure_ad_token_provider=token_provider,
+            )
+
+    @classmethod
+    def from_config(cls, config, model_name, rate_limiter=None, response_cache=None, max_connections=None):
+        return cls(
+            model_name=model_name,
+            endpoint=config.get("endpoint"),
+            api_version=config.get("api_version"),
+            client_id=config.get("client_id"),
+            scope=config.get("scope"),
+            rate_limiter=rate_limiter,
+            response_cache=response_cache,
+            api_key=config.get("api_key"),
+        )
+
+    def create_async_client(self):
+        if self.api_key:
+            return AsyncAzureOpenAI(
+                max_retries=SDK_MAX_RETRIES,
+                azure_endpoint=self.azure_endpoint,
+                api_version=self.api_version,
+                api_key=self.api_key,
+            )
+
+        self.async_credential = AsyncAzureCliCredential()
+        token_provider = get_async_bearer_token_provider(
+            self.async_credential,
+            self.scope,
+        )
+
+        return AsyncAzureOpenAI(
+            max_retries=SDK_MAX_RETRIES,
+            azure_endpoint=self.azure_endpoint,
+            api_version=self.api_version,
+            azure_ad_token_provider=token_provider,
+        )
+
+    async def aclose(self):
+        await super().aclose()
+        if self.async_credential is not None:
+            await self.async_credential.close()
+            self.async_credential = None
+
+
+class OpenAI_LLM_API(LLM_API):
+    """Backend for any server exposing /v1/chat/completions (OpenAI, vLLM, TGI, llama.cpp, ...).
+
+    All workers share one HTTP client per event loop whose connection pool is
+    sized to the runner's concurrency, so connections are kept alive and
+    reused instead of being re-established for every request. HTTP/2 is used
+    when the h2 package is installed.
+    """
+
+    def __init__(
+        self,
+        model_name,
+        base_url,
+        api_key=None,
+        rate_limiter=None,
+        response_cache=None,
+        max_connections=8,
+        http2=True,
+        timeout=600,
+    ):
+        super().__init__(model_name, rate_limiter=rate_limiter, response_cache=response_cache)
+
+        self.base_url = base_url
+        # Self-hosted servers usually ignore the key, but the client requires one
+        self.api_key = api_key or "EMPTY"
+        self.max_connections = max_connections
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.timeout = timeout
+
+        self.client = OpenAI(
+            max_retries=SDK_MAX_RETRIES,
+            base_url=self.base_url,
+            api_key=self.api_key,
+            http_client=httpx.Client(
+                limits=self.get_limits(),
+                http2=self.http2,
+                timeout=self.timeout,
+            ),
+        )
+
+    @classmethod
+    def from_config(cls, config, model_name, rate_limiter=None, response_cache=None, max_connections=None):
+        return cls(
+            model_name=model_name,
+            base_url=config.get("base_url"),
+            api_key=config.get("api_key"),
+            rate_limiter=rate_limiter,
+            response_cache=response_cache,
+            max_connections=config.get("max_connections") or max_connections or 8,
+            http2=config.get("http2", True),
+            timeout=config.get("timeout", 600),
+        )
+
+    def get_limits(self):
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+            keepalive_expiry=60,
+        )
+
+    def create_async_client(self):
+        return AsyncOpenAI(
+            max_retries=SDK_MAX_RETRIES,
+            base_url=self.base_url,
+            api_key=self.api_key,
+            http_client=httpx.AsyncClient(
+                limits=self.get_limits(),
+                http2=self.http2,
+                timeout=self.timeout,
+            ),
+        )
+
+
+# Backends selectable with the "backend" key of the API configuration
+BACKENDS = {
+    "azure": Azure_LLM_API,
+    "openai": OpenAI_LLM_API,
+}
+
+
+def create_backend(config, model_name, rate_limiter=None, response_cache=None, max_connections=None):
+    """Create the LLM API named by config["backend"] (default "azure").
+
+    Args:
+        config: API configuration (or one deployment of it).
+        model_name: Name of the model to request.
+        rate_limiter: Optional RateLimiter for this backend.
+        response_cache: Optional ResponseCache.
+        max_connections: Size of the HTTP connection pool, usually the runner's concurrency.
+
+    Returns:
+        LLM_API instance.
+    """
+    backend = config.get("backend", "azure")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {sorted(BACKENDS)}")
+
+    llm_api = BACKENDS[backend].from_config(
+        config,
+        model_name,
+        rate_limiter=rate_limiter,
+        response_cache=response_cache,
+        max_connections=max_connections,
+    )
+    llm_api.stream = config.get("stream", False)
+    llm_api.request_timeout = config.get("request_timeout", llm_api.request_timeout)
+    llm_api.request_timeout_per_token = config.get("request_timeout_per_token", llm_api.request_timeout_per_token)
+
+    llm_api.price = (config.get("prices") or {}).get(model_name)
+    if config.get("prices") and llm_api.price is None:
+        logging.warning(f"No price configured for model {model_name}, its cost will not be reported")
+
+    return llm_api
     
 
 if __name__ == "__main__":
@@ -123,11 +816,7 @@ if __name__ == "__main__":
     with open(config_path, "r") as f:
         config = yaml.safe_load(f)
 
-    llm = Azure_LLM_API(model_name=config["model_name"],
-                        endpoint=config["endpoint"],
-                        api_version=config["api_version"],
-                        client_id=config["client_id"],
-                        scope=config["scope"])
+    llm = create_backend(config, model_name=config["model_name"])
     
     prompt = "What is the capital of France?"
     response = llm.generate(prompt)
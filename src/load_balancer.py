@@ -0,0 +1,210 @@
+import asyncio
+import threading
+import time
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+
+# Errors after which a deployment is taken out of rotation for a while
+EJECT_STATUSES = {429, 500, 502, 503, 504}
+EJECT_ERROR_TYPES = {"RateLimitError", "InternalServerError", "APIConnectionError", "APITimeoutError"}
+
+
+class Pooled_LLM_API:
+    """Route requests across several deployments of the same model.
+
+    Each request goes to the healthy member with the fewest in-flight
+    requests relative to its weight. A member that answers with a 429, a 5xx
+    or a connection error is ejected for ``eject_seconds`` (doubling on
+    consecutive failures, up to ``max_eject_seconds``) and the request is
+    retried on another member.
+
+    Members are LLM API instances exposing generate_with_metadata() and
+    agenerate_with_metadata(), e.g. any inference.LLM_API backend. They should each have their
+    own rate limiter since quotas are per deployment.
+    """
+
+    def __init__(self, members, weights=None, names=None, eject_seconds=30, max_eject_seconds=300):
+        if not members:
+            raise ValueError("A deployment pool needs at least one member")
+
+        weights = weights or [1.0] * len(members)
+        names = names or [
+            f"{getattr(member, 'azure_endpoint', None) or getattr(member, 'base_url', '')}{member.model_name}"
+            for member in members
+        ]
+
+        self.members = []
+        for api, weight, name in zip(members, weights, names):
+            # The pool fails over to another member instead of retrying in place
+            api.max_tries = 1
+            self.members.append({
+                "name": name,
+                "api": api,
+                "weight": float(weight),
+                "in_flight": 0,
+                "ejected_until": 0.0,
+                "consecutive_failures": 0,
+                "requests": 0,
+                "successes": 0,
+                "errors": {},
+                "ejections": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            })
+
+        self.model_name = members[0].model_name
+        self.max_tries = max(3, len(self.members))
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+
+        # Pool-level rate limiting and caching are delegated to the members
+        self.rate_limiter = None
+        self.response_cache = getattr(members[0], "response_cache", None)
+
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+
+    def select_member(self, exclude):
+        """Pick the least-loaded healthy member, or return how long to wait for one."""
+        with self.lock:
+            now = time.monotonic()
+            candidates = [
+                member for member in self.members if member["name"] not in exclude
+            ] or self.members
+
+            healthy = [member for member in candidates if member["ejected_until"] <= now]
+            if not healthy:
+                return None, min(member["ejected_until"] for member in candidates) - now
+
+            member = min(healthy, key=lambda m: (m["in_flight"] + 1) / m["weight"])
+            member["in_flight"] += 1
+            member["requests"] += 1
+            return member, 0.0
+
+    def release_member(self, member):
+        with self.lock:
+            member["in_flight"] -= 1
+
+    def record_result(self, member, metadata):
+        """Update member statistics and return True if the request should be retried elsewhere."""
+        with self.lock:
+            member["in_flight"] -= 1
+
+            if metadata["generation"] is not None or metadata.get("cache_hit"):
+                member["successes"] += 1
+                member["consecutive_failures"] = 0
+                usage = metadata.get("usage") or {}
+                member["prompt_tokens"] += usage.get("prompt_tokens") or 0
+                member["completion_tokens"] += usage.get("completion_tokens") or 0
+                return False
+
+            error = metadata.get("error") or {}
+            error_key = str(error.get("status") or error.get("type") or "empty_response")
+            member["errors"][error_key] = member["errors"].get(error_key, 0) + 1
+
+            if error.get("status") not in EJECT_STATUSES and error.get("type") not in EJECT_ERROR_TYPES:
+                return False
+
+            member["consecutive_failures"] += 1
+            member["ejections"] += 1
+            eject_for = min(
+                self.max_eject_seconds,
+                self.eject_seconds * 2 ** (member["consecutive_failures"] - 1),
+            )
+            member["ejected_until"] = time.monotonic() + eject_for
+
+        logging.warning(f"Ejecting deployment {member['name']} for {eject_for:.0f}s after error {error_key}")
+        return True
+
+    def generate(self, prompt, max_new_tokens=None, temperature=None, top_p=None, chat_history=None):
+        return self.generate_with_metadata(
+            prompt, max_new_tokens, temperature, top_p, chat_history
+        )["generation"]
+
+    def generate_with_metadata(self, prompt, max_new_tokens=None, temperature=None, top_p=None, chat_history=None):
+        tried = set()
+        metadata = None
+
+        for _ in range(self.max_tries):
+            member, wait = self.select_member(tried)
+            while member is None:
+                time.sleep(wait)
+                member, wait = self.select_member(tried)
+
+            try:
+                metadata = member["api"].generate_with_metadata(
+                    prompt, max_new_tokens, temperature, top_p, chat_history
+                )
+            except BaseException:
+                self.release_member(member)
+                raise
+
+            metadata["deployment"] = member["name"]
+            if not self.record_result(member, metadata):
+                break
+            tried.add(member["name"])
+
+        return metadata
+
+    async def agenerate(self, prompt, max_new_tokens=None, temperature=None, top_p=None, chat_history=None):
+        metadata = await self.agenerate_with_metadata(
+            prompt, max_new_tokens, temperature, top_p, chat_history
+        )
+        return metadata["generation"]
+
+    async def agenerate_with_metadata(self, prompt, max_new_tokens=None, temperature=None, top_p=None, chat_history=None, on_send=None):
+        tried = set()
+        metadata = None
+
+        for _ in range(self.max_tries):
+            member, wait = self.select_member(tried)
+            while member is None:
+                await asyncio.sleep(wait)
+                member, wait = self.select_member(tried)
+
+            try:
+                metadata = await member["api"].agenerate_with_metadata(
+                    prompt, max_new_tokens, temperature, top_p, chat_history, on_send=on_send
+                )
+            except BaseException:
+                self.release_member(member)
+                raise
+
+            metadata["deployment"] = member["name"]
+            if not self.record_result(member, metadata):
+                break
+            tried.add(member["name"])
+
+        return metadata
+
+    async def aclose(self):
+        for member in self.members:
+            if hasattr(member["api"], "aclose"):
+                await member["api"].aclose()
+
+    def get_stats(self):
+        elapsed = max(time.monotonic() - self.start_time, 1e-9)
+
+        stats = []
+        for member in self.members:
+            member_stats = {
+                "name": member["name"],
+                "weight": member["weight"],
+                "requests": member["requests"],
+                "successes": member["successes"],
+                "errors": member["errors"],
+                "ejections": member["ejections"],
+                "prompt_tokens": member["prompt_tokens"],
+                "completion_tokens": member["completion_tokens"],
+                "requests_per_minute": member["successes"] * 60 / elapsed,
+                "tokens_per_minute": (member["prompt_tokens"] + member["completion_tokens"]) * 60 / elapsed,
+            }
+            rate_limiter = getattr(member["api"], "rate_limiter", None)
+            if rate_limiter:
+                member_stats["rate_limit"] = rate_limiter.get_stats()
+            stats.append(member_stats)
+
+        return stats
@@ -0,0 +1,237 @@
+"""
+Merge the outputs of a sharded run (run_test.py --shard-index i --num-shards N).
+
+For every task, the shard result files <task>_results.shard-<i>-of-<N>.jsonl are
+combined into the usual <task>_results.jsonl (in task file order), and a
+summary.json is rebuilt from the merged results. Entries present in more than
+one shard and entries without a successful result are reported.
+
+Example:
+    python src/merge_results.py --task_dir ./memory_tests --result_dir ./results --model_name gpt-4o --num_shards 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from run_test import (
+    add_task_stats,
+    collect_tasks,
+    get_categories_to_run,
+    get_prompt_prefix_key,
+    get_shard_suffix,
+    init_summary,
+    load_task_data,
+    update_summary,
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+
+def read_shard_results(path: str) -> List[Dict[str, Any]]:
+    """Read the records of one shard result file, skipping truncated lines."""
+    records = []
+    if not os.path.exists(path):
+        return records
+
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping invalid JSON line in {path}")
+
+    return records
+
+
+def merge_task(task: Dict[str, Any], num_shards: int) -> Dict[str, Any]:
+    """Merge the shard result files of one task into its result file.
+
+    Args:
+        task: Task returned by collect_tasks (without a shard).
+        num_shards: Number of shards the run was split into.
+
+    Returns:
+        Dictionary with the merge report of the task: expected, merged,
+        duplicate, failed and missing ids, and missing shard files.
+    """
+    task_data = load_task_data(task["task_data_path"])
+    expected_ids = [entry.get("id") for entry in task_data]
+
+    # Latest record of each id per shard, preferring successful ones
+    records_by_id: Dict[Any, Dict[str, Any]] = {}
+    shards_by_id: Dict[Any, set] = {}
+    missing_shard_files = []
+
+    for shard_index in range(num_shards):
+        suffix = get_shard_suffix((shard_index, num_shards))
+        path = task["result_file_path"].replace("_results.jsonl", f"_results{suffix}.jsonl")
+        if not os.path.exists(path):
+            missing_shard_files.append(path)
+            continue
+
+        for record in read_shard_results(path):
+            entry_id = record.get("id")
+            previous = records_by_id.get(entry_id)
+            if previous is None or record.get("generation") is not None or previous.get("generation") is None:
+                records_by_id[entry_id] = record
+
+            if record.get("generation") is not None:
+                shards_by_id.setdefault(entry_id, set()).add(shard_index)
+
+    expected = set(expected_ids)
+    duplicate_ids = sorted(str(entry_id) for entry_id, shards in shards_by_id.items() if len(shards) > 1)
+    unexpected_ids = sorted(str(entry_id) for entry_id in records_by_id if entry_id not in expected)
+    failed_ids = [
+        entry_id for entry_id in expected_ids
+        if entry_id in records_by_id and records_by_id[entry_id].get("generation") is None
+    ]
+    missing_ids = [entry_id for entry_id in expected_ids if entry_id not in records_by_id]
+
+    # Rewrite the merged results in task file order and rebuild the task statistics
+    merged = 0
+    leaders = set()
+    with open(task["result_file_path"], 'w') as f:
+        for entry in task_data:
+            record = records_by_id.get(entry.get("id"))
+            if record is None:
+                continue
+
+            prefix_key = get_prompt_prefix_key(entry.get("prompt", ""))
+            task["stats"].add(record, prefix_leader=prefix_key not in leaders, context_length=entry.get("context_length"))
+            leaders.add(prefix_key)
+
+            f.write(json.dumps(record) + "\n")
+            merged += 1
+
+    return {
+        "expected": len(expected_ids),
+        "merged": merged,
+        "duplicate_ids": duplicate_ids,
+        "unexpected_ids": unexpected_ids,
+        "failed_ids": failed_ids,
+        "missing_ids": missing_ids,
+        "missing_shard_files": missing_shard_files,
+    }
+
+
+def merge_shards(
+    task_dir: str,
+    result_dir: str,
+    model_name: str,
+    num_shards: int,
+    task_category: Optional[str] = None,
+    task_name: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Merge all shard outputs of a model into the normal result layout and write summary.json.
+
+    Returns:
+        The merged summary, with a "merge" section holding the per-task reports.
+    """
+    model_result_dir = os.path.join(result_dir, model_name)
+    tasks = collect_tasks(task_dir, model_result_dir, get_categories_to_run(task_category), task_name)
+    summary = init_summary(model_name, tasks)
+    summary["merged_shards"] = num_shards
+
+    # Keep the per-shard run information (mode, duration, rate limits, ...)
+    summary["shards"] = []
+    for shard_index in range(num_shards):
+        shard_summary_path = os.path.join(model_result_dir, f"summary{get_shard_suffix((shard_index, num_shards))}.json")
+        if os.path.exists(shard_summary_path):
+            with open(shard_summary_path, 'r') as f:
+                shard_summary = json.load(f)
+            summary["shards"].append({
+                key: shard_summary.get(key)
+                for key in ["shard", "mode", "start_time", "end_time", "duration_seconds", "interrupted", "rate_limit", "response_cache"]
+                if key in shard_summary
+            })
+
+    if summary["shards"]:
+        summary["mode"] = summary["shards"][0].get("mode")
+
+    summary["merge"] = {}
+    for task in tasks:
+        if not os.path.exists(task["task_data_path"]):
+            continue
+
+        report = merge_task(task, num_shards)
+        task_key = f"{task['category']}/{task['task_instance'].task_name}"
+        summary["merge"][task_key] = report
+
+        update_summary(summary, task["category"], report["expected"], report["merged"])
+        add_task_stats(summary, task)
+
+        if report["duplicate_ids"]:
+            logger.error(f"{task_key}: {len(report['duplicate_ids'])} ids were answered by more than one shard")
+        if report["missing_ids"] or report["failed_ids"]:
+            logger.warning(f"{task_key}: {len(report['missing_ids'])} ids missing, {len(report['failed_ids'])} failed")
+        if report["missing_shard_files"]:
+            logger.warning(f"{task_key}: missing shard files {report['missing_shard_files']}")
+
+    # Drop categories without any task file
+    summary["categories"] = {
+        category: category_summary for category, category_summary in summary["categories"].items()
+        if category_summary["tasks_run"]
+    }
+    summary["end_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    summary_path = os.path.join(model_result_dir, "summary.json")
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    logger.info(f"Merged {summary['examples_completed']}/{summary['examples_total']} examples across {summary['tasks_run']} tasks into {model_result_dir}")
+    return summary
+
+
+def main():
+    """Parse arguments and merge the shard outputs of a run."""
+    parser = argparse.ArgumentParser(
+        description="Merge the result files of a sharded run of run_test.py",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--task_dir", type=str, required=True,
+                        help="Directory containing test data files")
+    parser.add_argument("--result_dir", type=str, required=True,
+                        help="Directory containing the shard results")
+    parser.add_argument("--model_name", type=str, default="gpt-4o",
+                        help="Name of the model whose shards to merge")
+    parser.add_argument("--num_shards", type=int, required=True,
+                        help="Number of shards the run was split into")
+    parser.add_argument("--task_category", type=str,
+                        help="Merge only tasks in this category")
+    parser.add_argument("--task_name", type=str,
+                        help="Merge only this specific task")
+    parser.add_argument("--allow_incomplete", action="store_true",
+                        help="Exit successfully even if ids are missing, failed or duplicated")
+    args = parser.parse_args()
+
+    summary = merge_shards(
+        task_dir=args.task_dir,
+        result_dir=args.result_dir,
+        model_name=args.model_name,
+        num_shards=args.num_shards,
+        task_category=args.task_category,
+        task_name=args.task_name,
+    )
+
+    incomplete = any(
+        report["duplicate_ids"] or report["missing_ids"] or report["failed_ids"] or report["unexpected_ids"]
+        for report in summary["merge"].values()
+    )
+    if incomplete and not args.allow_incomplete:
+        logger.error("Merged results are incomplete, see the merge section of summary.json")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
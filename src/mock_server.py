@@ -0,0 +1,640 @@
+"""
+Offline OpenAI-compatible chat-completions server for exercising the harness.
+
+The server answers both Azure-style (/openai/deployments/<name>/chat/completions)
+and OpenAI-style (/v1/chat/completions) requests, streamed or not, with a
+configurable latency distribution and decode rate, injected 429/5xx errors and
+one of several response policies, so that run_test.py can be run and
+benchmarked without credentials. It also implements the files and batches
+APIs used by ``run_test.py --mode batch``.
+
+Example:
+    python src/mock_server.py --task_dir resource/minerva_snapshot --policy echo_reference
+    python src/run_test.py --task_dir resource/minerva_snapshot --result_dir ./results --backend mock
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import tiktoken
+
+from evaluate import format_reference
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+POLICIES = ["echo_reference", "random_yes_no", "truncate"]
+LATENCY_DISTRIBUTIONS = ["constant", "uniform", "exponential", "lognormal"]
+
+# Same delimiter run_test uses to find the shared context of a prompt
+PROMPT_PREFIX_DELIMITER = "\n\nInstruction:\n"
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_references(task_dir: str) -> Dict[str, str]:
+    """Index the formatted reference of every entry under a task directory by prompt hash.
+
+    Args:
+        task_dir: Directory containing <category>/<task>.jsonl files.
+
+    Returns:
+        Dictionary mapping prompt hashes to reference strings.
+    """
+    references = {}
+    for root, _, files in os.walk(task_dir):
+        for filename in files:
+            if not filename.endswith(".jsonl") or filename.endswith("_results.jsonl"):
+                continue
+            with open(os.path.join(root, filename), "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if "prompt" in entry:
+                        references[hash_text(entry["prompt"])] = format_reference(entry.get("reference", ""))
+
+    logger.info(f"Indexed {len(references)} references from {task_dir}")
+    return references
+
+
+class MockBackend:
+    """Response policy, latency model and fault injection shared by all request handlers."""
+
+    def __init__(
+        self,
+        policy: str = "random_yes_no",
+        references: Optional[Dict[str, str]] = None,
+        latency_distribution: str = "constant",
+        latency_mean: float = 0.5,
+        latency_stddev: float = 0.2,
+        rate_limit_rate: float = 0.0,
+        server_error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        truncate_ratio: float = 0.5,
+        tokens_per_second: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.policy = policy
+        self.references = references or {}
+        self.latency_distribution = latency_distribution
+        self.latency_mean = latency_mean
+        self.latency_stddev = latency_stddev
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        self.truncate_ratio = truncate_ratio
+        # Simulated decode rate; 0 returns the whole answer at once
+        self.tokens_per_second = tokens_per_second
+
+        self.random = random.Random(seed)
+        self.tokenizer = tiktoken.encoding_for_model("gpt-4")
+
+        # Simulated provider prompt cache: recently seen prompt prefixes
+        self.prefix_cache: "OrderedDict[str, int]" = OrderedDict()
+        self.prefix_cache_size = 1024
+
+        self.lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "responses": 0,
+            "rate_limited": 0,
+            "server_errors": 0,
+            "unknown_prompts": 0,
+        }
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] += 1
+
+    def sample_latency(self) -> float:
+        with self.lock:
+            if self.latency_distribution == "uniform":
+                half_width = self.latency_stddev * math.sqrt(3)
+                latency = self.random.uniform(self.latency_mean - half_width, self.latency_mean + half_width)
+            elif self.latency_distribution == "exponential":
+                latency = self.random.expovariate(1 / self.latency_mean) if self.latency_mean > 0 else 0.0
+            elif self.latency_distribution == "lognormal":
+                # Parameterize by the mean and standard deviation of the latency itself
+                variance = math.log(1 + (self.latency_stddev / self.latency_mean) ** 2) if self.latency_mean > 0 else 0.0
+                mu = math.log(self.latency_mean) - variance / 2 if self.latency_mean > 0 else 0.0
+                latency = self.random.lognormvariate(mu, math.sqrt(variance)) if self.latency_mean > 0 else 0.0
+            else:
+                latency = self.latency_mean
+
+        return max(0.0, latency)
+
+    def sample_fault(self) -> Optional[int]:
+        """Return the status code of an injected error, or None."""
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.rate_limit_rate:
+            self.count("rate_limited")
+            return 429
+        if draw < self.rate_limit_rate + self.server_error_rate:
+            self.count("server_errors")
+            return 503
+        return None
+
+    def cached_tokens(self, prompt: str) -> int:
+        """Return how many prompt tokens a provider-side prefix cache would serve."""
+        if PROMPT_PREFIX_DELIMITER not in prompt:
+            return 0
+
+        prefix = prompt.split(PROMPT_PREFIX_DELIMITER, 1)[0]
+        key = hash_text(prefix)
+        with self.lock:
+            if key in self.prefix_cache:
+                self.prefix_cache.move_to_end(key)
+                return self.prefix_cache[key]
+
+            # Providers cache in blocks of 128 tokens
+            self.prefix_cache[key] = len(self.tokenizer.encode(prefix)) // 128 * 128
+            if len(self.prefix_cache) > self.prefix_cache_size:
+                self.prefix_cache.popitem(last=False)
+
+        return 0
+
+    def respond(self, prompt: str, max_tokens: int) -> str:
+        if self.policy == "random_yes_no":
+            with self.lock:
+                return self.random.choice(["yes", "no"])
+
+        reference = self.references.get(hash_text(prompt))
+        if reference is None:
+            self.count("unknown_prompts")
+            reference = ""
+
+        if self.policy == "truncate":
+            words = reference.split(" ")
+            reference = " ".join(words[: int(len(words) * self.truncate_ratio)])
+
+        tokens = self.tokenizer.encode(reference)
+        if max_tokens and len(tokens) > max_tokens:
+            reference = self.tokenizer.decode(tokens[:max_tokens])
+
+        return reference
+
+    def decode_delay(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def generate(self, request: Dict[str, Any]) -> Tuple[List[int], Dict[str, Any]]:
+        """Return the answer as a list of tokens together with its usage."""
+        messages: List[Dict[str, str]] = request.get("messages", [])
+        prompt = messages[-1]["content"] if messages else ""
+        tokens = self.tokenizer.encode(self.respond(prompt, request.get("max_tokens")))
+
+        prompt_tokens = sum(len(self.tokenizer.encode(message["content"])) for message in messages)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+            "prompt_tokens_details": {"cached_tokens": self.cached_tokens(prompt)},
+        }
+        return tokens, usage
+
+    def complete(self, request: Dict[str, Any], model: str) -> Dict[str, Any]:
+        tokens, usage = self.generate(request)
+        time.sleep(self.decode_delay(len(tokens)))
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.tokenizer.decode(tokens)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage,
+        }
+
+    def stream(self, request: Dict[str, Any], model: str) -> Iterator[Dict[str, Any]]:
+        """Yield chat.completion.chunk objects, one per token, paced at the decode rate."""
+        tokens, usage = self.generate(request)
+        chunk = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+        }
+
+        yield dict(chunk, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+
+        # Decode whole tokens so multi-byte characters are never split across chunks
+        pending = []
+        for token in tokens:
+            pending.append(token)
+            text = self.tokenizer.decode(pending)
+            if text.endswith("\ufffd"):
+                continue
+            time.sleep(self.decode_delay(len(pending)))
+            pending = []
+            yield dict(chunk, choices=[{"index": 0, "delta": {"content": text}, "finish_reason": None}])
+
+        if pending:
+            yield dict(chunk, choices=[{"index": 0, "delta": {"content": self.tokenizer.decode(pending)}, "finish_reason": None}])
+
+        yield dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+
+        if (request.get("stream_options") or {}).get("include_usage"):
+            yield dict(chunk, choices=[], usage=usage)
+
+
+class MockBatchService:
+    """In-memory stand-in for the files and batches APIs.
+
+    Uploaded batch files are processed line by line with the MockBackend in a
+    background thread; successful responses go to the output file and
+    injected errors to the error file, like the real service.
+    """
+
+    def __init__(self, backend: MockBackend, max_requests: int = 50000, processing_seconds: float = 0.0) -> None:
+        self.backend = backend
+        self.max_requests = max_requests
+        # Extra time a batch stays in progress, to exercise polling
+        self.processing_seconds = processing_seconds
+
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def create_file(self, filename: str, purpose: str, content: bytes) -> Dict[str, Any]:
+        file_id = f"file-{uuid.uuid4().hex}"
+        file = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[file_id] = dict(file, content=content)
+        return file
+
+    def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.files.get(file_id)
+
+    def create_batch(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        input_file = self.get_file(request.get("input_file_id", ""))
+        if input_file is None:
+            return None
+
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "errors": None,
+            "input_file_id": input_file["id"],
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "in_progress_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+
+        threading.Thread(target=self.process, args=(batch["id"], input_file["content"]), daemon=True).start()
+        return dict(batch)
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            return dict(batch) if batch else None
+
+    def update_batch(self, batch_id: str, **fields: Any) -> None:
+        with self.lock:
+            self.batches[batch_id].update(fields)
+
+    def process(self, batch_id: str, content: bytes) -> None:
+        lines = [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()]
+        if len(lines) > self.max_requests:
+            self.update_batch(
+                batch_id,
+                status="failed",
+                failed_at=int(time.time()),
+                errors={"object": "list", "data": [{"code": "too_many_requests", "message": f"Batch has {len(lines)} requests, the limit is {self.max_requests}"}]},
+            )
+            return
+
+        self.update_batch(batch_id, status="in_progress", in_progress_at=int(time.time()))
+        time.sleep(self.processing_seconds)
+
+        outputs, errors = [], []
+        for line in lines:
+            self.backend.count("requests")
+            status = self.backend.sample_fault()
+            record = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": line["custom_id"], "error": None}
+
+            if status is None:
+                body = self.backend.complete(line["body"], line["body"].get("model", "mock"))
+                record["response"] = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body}
+                outputs.append(record)
+                self.backend.count("responses")
+            else:
+                record["response"] = {
+                    "status_code": status,
+                    "request_id": uuid.uuid4().hex,
+                    "body": {"error": {"message": "Injected error", "code": str(status)}},
+                }
+                errors.append(record)
+
+        def write(records: List[Dict[str, Any]], name: str) -> Optional[str]:
+            if not records:
+                return None
+            content = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+            return self.create_file(name, "batch_output", content)["id"]
+
+        self.update_batch(
+            batch_id,
+            status="completed",
+            completed_at=int(time.time()),
+            output_file_id=write(outputs, f"{batch_id}_output.jsonl"),
+            error_file_id=write(errors, f"{batch_id}_error.jsonl"),
+            request_counts={"total": len(lines), "completed": len(outputs), "failed": len(errors)},
+        )
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    backend: MockBackend = None
+    batch_service: MockBatchService = None
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(format % args)
+
+    def send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def get_route(self) -> List[str]:
+        """Split the path into parts, dropping the /openai (Azure) or /v1 (OpenAI) prefix."""
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if parts and parts[0] in ("openai", "v1"):
+            parts = parts[1:]
+        return parts
+
+    def get_model(self) -> Optional[str]:
+        parts = self.get_route()
+        if parts[-2:] != ["chat", "completions"]:
+            return None
+
+        # deployments/<deployment>/chat/completions
+        if len(parts) == 4 and parts[0] == "deployments":
+            return parts[1]
+        return ""
+
+    def send_not_found(self) -> None:
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "code": "404"}})
+
+    def read_multipart(self) -> Dict[str, Any]:
+        """Parse a multipart/form-data upload into {field: value}, with files as (filename, bytes)."""
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + body
+        )
+
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            filename = part.get_filename()
+            payload = part.get_payload(decode=True)
+            fields[name] = (filename, payload) if filename else payload.decode("utf-8")
+        return fields
+
+    def do_GET(self) -> None:
+        parts = self.get_route()
+
+        # batches/<batch_id>
+        if len(parts) == 2 and parts[0] == "batches":
+            batch = self.batch_service.get_batch(parts[1])
+            if batch is None:
+                self.send_not_found()
+                return
+            self.send_json(200, batch)
+            return
+
+        # files/<file_id>
+        if len(parts) == 2 and parts[0] == "files":
+            file = self.batch_service.get_file(parts[1])
+            if file is None:
+                self.send_not_found()
+                return
+            self.send_json(200, {key: value for key, value in file.items() if key != "content"})
+            return
+
+        # files/<file_id>/content
+        if len(parts) == 3 and parts[0] == "files" and parts[2] == "content":
+            file = self.batch_service.get_file(parts[1])
+            if file is None:
+                self.send_not_found()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(file["content"])))
+            self.end_headers()
+            self.wfile.write(file["content"])
+            return
+
+        self.send_not_found()
+
+    def handle_batch_api(self, parts: List[str]) -> None:
+        if parts == ["files"]:
+            fields = self.read_multipart()
+            filename, content = fields["file"]
+            self.send_json(200, self.batch_service.create_file(filename, fields.get("purpose", "batch"), content))
+            return
+
+        batch = self.batch_service.create_batch(self.read_body())
+        if batch is None:
+            self.send_json(400, {"error": {"message": "Unknown input_file_id", "code": "400"}})
+            return
+        self.send_json(200, batch)
+
+    def send_stream(self, chunks: Iterator[Dict[str, Any]]) -> None:
+        """Send chunks as server-sent events using chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for chunk in chunks:
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def read_body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self) -> None:
+        backend = self.backend
+        parts = self.get_route()
+        if parts in (["files"], ["batches"]):
+            self.handle_batch_api(parts)
+            return
+
+        model = self.get_model()
+        if model is None:
+            self.send_not_found()
+            return
+
+        request = self.read_body()
+        backend.count("requests")
+        time.sleep(backend.sample_latency())
+
+        status = backend.sample_fault()
+        if status == 429:
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit exceeded (injected)", "code": "429"}},
+                {"retry-after-ms": str(int(backend.retry_after * 1000)), "retry-after": str(math.ceil(backend.retry_after))},
+            )
+            return
+        if status is not None:
+            self.send_json(status, {"error": {"message": "Service unavailable (injected)", "code": str(status)}})
+            return
+
+        model = model or request.get("model", "mock")
+        if request.get("stream"):
+            self.send_stream(backend.stream(request, model))
+        else:
+            self.send_json(200, backend.complete(request, model))
+        backend.count("responses")
+
+
+def create_server(
+    host: str, 
+    port: int, 
+    backend: MockBackend, 
+    batch_service: Optional[MockBatchService] = None,
+) -> ThreadingHTTPServer:
+    """Create (but do not start) a mock server bound to host:port."""
+    handler = type(
+        "BoundMockRequestHandler", 
+        (MockRequestHandler,), 
+        {"backend": backend, "batch_service": batch_service or MockBatchService(backend)},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    """Parse arguments and serve mock chat completions until interrupted."""
+    parser = argparse.ArgumentParser(
+        description="Offline OpenAI-compatible mock server for testing the Minerva harness",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                        help="Host to bind")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="Port to bind")
+    parser.add_argument("--task_dir", type=str,
+                        help="Directory of task files to read references from (echo_reference and truncate policies)")
+    parser.add_argument("--policy", type=str, choices=POLICIES, default="echo_reference",
+                        help="How to answer prompts")
+    parser.add_argument("--truncate_ratio", type=float, default=0.5,
+                        help="Fraction of the reference kept by the truncate policy")
+    parser.add_argument("--latency_distribution", type=str, choices=LATENCY_DISTRIBUTIONS, default="constant",
+                        help="Distribution of the per-request latency")
+    parser.add_argument("--latency_mean", type=float, default=0.5,
+                        help="Mean latency in seconds")
+    parser.add_argument("--latency_stddev", type=float, default=0.2,
+                        help="Standard deviation of the latency in seconds (uniform and lognormal)")
+    parser.add_argument("--tokens_per_second", type=float, default=0.0,
+                        help="Simulated decode rate (0 returns answers without decode delay)")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0,
+                        help="Fraction of requests answered with a 429")
+    parser.add_argument("--server_error_rate", type=float, default=0.0,
+                        help="Fraction of requests answered with a 503")
+    parser.add_argument("--retry_after", type=float, default=1.0,
+                        help="Retry-After sent with injected 429s, in seconds")
+    parser.add_argument("--batch_max_requests", type=int, default=50000,
+                        help="Batches with more requests than this fail, like the real per-batch limit")
+    parser.add_argument("--batch_processing_seconds", type=float, default=0.0,
+                        help="Time a batch stays in progress before its requests are processed")
+    parser.add_argument("--seed", type=int,
+                        help="Seed for latency, fault injection and random answers")
+    args = parser.parse_args()
+
+    if args.policy != "random_yes_no" and not args.task_dir:
+        parser.error(f"--task_dir is required by the {args.policy} policy")
+
+    references = load_references(args.task_dir) if args.task_dir else {}
+    backend = MockBackend(
+        policy=args.policy,
+        references=references,
+        latency_distribution=args.latency_distribution,
+        latency_mean=args.latency_mean,
+        latency_stddev=args.latency_stddev,
+        rate_limit_rate=args.rate_limit_rate,
+        server_error_rate=args.server_error_rate,
+        retry_after=args.retry_after,
+        truncate_ratio=args.truncate_ratio,
+        tokens_per_second=args.tokens_per_second,
+        seed=args.seed,
+    )
+
+    batch_service = MockBatchService(
+        backend,
+        max_requests=args.batch_max_requests,
+        processing_seconds=args.batch_processing_seconds,
+    )
+
+    server = create_server(args.host, args.port, backend, batch_service)
+    logger.info(f"Mock server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Mock server stats: {backend.stats}")
+
+
+if __name__ == "__main__":
+    main()
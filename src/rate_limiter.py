@@ -0,0 +1,210 @@
+import asyncio
+import math
+import threading
+import time
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+# Characters per prompt token assumed until responses have reported their usage
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+
+def get_prompt_chars(messages):
+    return sum(len(message["content"]) for message in messages)
+
+
+def estimate_request_tokens(messages, max_new_tokens, chars_per_token=DEFAULT_CHARS_PER_TOKEN):
+    """Estimate the quota cost of a chat request (prompt tokens + completion budget).
+
+    The prompt is not tokenized: its length in characters is divided by
+    ``chars_per_token`` (see RateLimiter.chars_per_token), and the
+    reservation is settled with the usage reported by the response.
+    """
+    return math.ceil(get_prompt_chars(messages) / chars_per_token) + max_new_tokens
+
+
+def parse_retry_after(headers):
+    """Return the server-requested wait in seconds from response headers, if any."""
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+    return None
+
+
+class RateLimiter:
+    """Client-side token bucket pacing requests against RPM and TPM quotas.
+
+    Each request reserves one request and its estimated tokens up front, and
+    the difference with the tokens it actually used is refunded or charged
+    when its response arrives. The buckets may go into debt, in which case
+    the caller waits until they have refilled. One instance is shared by all
+    workers of a run, so concurrent requests are paced against the same
+    budget.
+
+    Attributes:
+        chars_per_token: Characters per prompt token, learned from the usage
+            of the responses and used to estimate the next reservations.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, burst_seconds=10):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+        # Quotas are enforced over short windows, so only allow a burst worth a few seconds
+        self.request_capacity = self._capacity(requests_per_minute, burst_seconds)
+        self.token_capacity = self._capacity(tokens_per_minute, burst_seconds)
+        self.request_level = self.request_capacity
+        self.token_level = self.token_capacity
+
+        self.lock = threading.Lock()
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self.chars_per_token = DEFAULT_CHARS_PER_TOKEN
+
+        self.start_time = time.monotonic()
+        self.requests = 0
+        self.tokens_reserved = 0
+        self.tokens_used = 0
+        self.throttled_requests = 0
+        self.throttled_seconds = 0.0
+        self.rate_limit_errors = 0
+
+    @staticmethod
+    def _capacity(per_minute, burst_seconds):
+        if not per_minute:
+            return None
+        return max(1.0, per_minute * burst_seconds / 60)
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        self.last_refill = now
+
+        if self.request_capacity is not None:
+            self.request_level = min(
+                self.request_capacity,
+                self.request_level + elapsed * self.requests_per_minute / 60,
+            )
+        if self.token_capacity is not None:
+            self.token_level = min(
+                self.token_capacity,
+                self.token_level + elapsed * self.tokens_per_minute / 60,
+            )
+
+    def reserve(self, tokens):
+        """Reserve quota for one request and return how many seconds to wait before sending it."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            wait = max(0.0, self.paused_until - now)
+            if self.request_capacity is not None:
+                self.request_level -= 1
+                wait = max(wait, -self.request_level * 60 / self.requests_per_minute)
+            if self.token_capacity is not None:
+                self.token_level -= tokens
+                wait = max(wait, -self.token_level * 60 / self.tokens_per_minute)
+
+            self.requests += 1
+            self.tokens_reserved += tokens
+            if wait > 0:
+                self.throttled_requests += 1
+                self.throttled_seconds += wait
+
+        return wait
+
+    def acquire(self, tokens):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, reserved_tokens, used_tokens, prompt_chars=None, prompt_tokens=None):
+        """Settle a reservation once the actual usage is known.
+
+        The unused part of the reservation is returned to the bucket, and
+        tokens used beyond it are charged. ``prompt_chars`` and
+        ``prompt_tokens`` (when the response reports them) refine the
+        characters per token used for the next estimates.
+        """
+        with self.lock:
+            self.tokens_used += used_tokens
+            if self.token_capacity is not None:
+                self.token_level = min(
+                    self.token_capacity,
+                    self.token_level + reserved_tokens - used_tokens,
+                )
+            if prompt_chars and prompt_tokens:
+                self.chars_per_token = 0.9 * self.chars_per_token + 0.1 * prompt_chars / prompt_tokens
+
+    def update_from_headers(self, headers):
+        """Align the buckets with the remaining quota reported by the server."""
+        if not headers:
+            return
+
+        with self.lock:
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            if remaining_requests is not None and self.request_capacity is not None:
+                try:
+                    self.request_level = min(self.request_level, float(remaining_requests))
+                except ValueError:
+                    pass
+
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_tokens is not None and self.token_capacity is not None:
+                try:
+                    self.token_level = min(self.token_level, float(remaining_tokens))
+                except ValueError:
+                    pass
+
+    def record_rate_limit(self, retry_after):
+        """Pause every worker after a 429 until the server-requested time has passed."""
+        with self.lock:
+            self.rate_limit_errors += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def get_stats(self):
+        elapsed_seconds = time.monotonic() - self.start_time
+        elapsed_minutes = max(elapsed_seconds, 1e-9) / 60
+
+        stats = {
+            "elapsed_seconds": round(elapsed_seconds, 2),
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "requests": self.requests,
+            "tokens_reserved": self.tokens_reserved,
+            "tokens_used": self.tokens_used,
+            "throttled_requests": self.throttled_requests,
+            "throttled_seconds": round(self.throttled_seconds, 2),
+            "rate_limit_errors": self.rate_limit_errors,
+            "chars_per_token": round(self.chars_per_token, 3),
+        }
+        if self.requests_per_minute:
+            stats["request_quota_utilization"] = self.requests / (
+                self.requests_per_minute * elapsed_minutes
+            )
+        if self.tokens_per_minute:
+            stats["token_quota_utilization"] = self.tokens_used / (
+                self.tokens_per_minute * elapsed_minutes
+            )
+
+        return stats
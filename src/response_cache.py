@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+
+CACHE_MODES = ["read-write", "read-only", "off"]
+
+
+class ResponseCache:
+    """Persistent cache of chat completions stored in a single SQLite file.
+
+    Entries are keyed by a hash of the model name, the messages and the
+    sampling parameters, so re-running the same prompts against the same
+    model is answered from disk. The database uses WAL journaling and a busy
+    timeout so several processes can share one cache file.
+
+    Attributes:
+        mode: "read-write" to look up and store responses, "read-only" to only
+            look them up.
+        max_age_days: Entries not accessed for this many days are evicted.
+        max_size_mb: Least recently used entries are evicted above this size.
+    """
+
+    def __init__(self, path, mode="read-write", max_age_days=None, max_size_mb=None):
+        if mode not in ("read-write", "read-only"):
+            raise ValueError(f"Invalid cache mode: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                generation TEXT,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                size INTEGER,
+                created_at REAL,
+                accessed_at REAL
+            )"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+
+        if self.mode == "read-write":
+            self.evict()
+
+    @staticmethod
+    def make_key(request):
+        """Hash the parts of a request that determine its response."""
+        key = {
+            "model": request["model"],
+            "messages": request["messages"],
+            "max_tokens": request["max_tokens"],
+            "temperature": request["temperature"],
+            "top_p": request["top_p"],
+        }
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for a key, or None on a miss."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT generation, prompt_tokens, completion_tokens FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.saved_prompt_tokens += row[1] or 0
+            self.saved_completion_tokens += row[2] or 0
+
+            if self.mode == "read-write":
+                self.connection.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+
+        return {
+            "generation": row[0],
+            "prompt_tokens": row[1],
+            "completion_tokens": row[2],
+        }
+
+    def put(self, key, model, generation, prompt_tokens=None, completion_tokens=None):
+        if self.mode != "read-write" or generation is None:
+            return
+
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    model,
+                    generation,
+                    prompt_tokens,
+                    completion_tokens,
+                    len(generation.encode("utf-8")),
+                    now,
+                    now,
+                ),
+            )
+
+    def evict(self):
+        """Drop entries that are too old, then the least recently used ones above the size limit."""
+        with self.lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self.connection.execute(
+                    "DELETE FROM responses WHERE accessed_at < ?", (cutoff,)
+                )
+
+            if self.max_size_mb:
+                max_size = self.max_size_mb * 1024 * 1024
+                total_size = self.connection.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()[0]
+
+                if total_size > max_size:
+                    rows = self.connection.execute(
+                        "SELECT key, size FROM responses ORDER BY accessed_at"
+                    ).fetchall()
+                    expired = []
+                    for key, size in rows:
+                        if total_size <= max_size:
+                            break
+                        expired.append((key,))
+                        total_size -= size
+                    self.connection.executemany(
+                        "DELETE FROM responses WHERE key = ?", expired
+                    )
+                    logging.info(f"Evicted {len(expired)} entries from response cache {self.path}")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_prompt_tokens": self.saved_prompt_tokens,
+            "saved_completion_tokens": self.saved_completion_tokens,
+            "saved_tokens": self.saved_prompt_tokens + self.saved_completion_tokens,
+        }
@@ -0,0 +1,172 @@
+"""
+Read result files, rejoining slim result records with their task entries.
+
+Slim result records (run_test.py --result-format slim) only hold the entry
+id, the content hash of the task file the entry came from, the output
+budget, the generation, its usage and timing, and its scores. The prompt, reference and variables of
+the entry are read back from the task file when the results are loaded: the
+task file is indexed by entry id once (byte offsets only) and each entry is
+read from disk when its result is reached.
+
+Example:
+    for result in iter_results("results/gpt-4o/search/string_search_word_results.jsonl",
+                               "memory_tests/search/string_search_word.jsonl"):
+        print(result["id"], result["prompt"][:80], result["scores"])
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Fields of a result record that do not come from the task entry (see run_test.build_result), and
+# the output budget of the request, which is filled in for task files generated without one
+RESULT_FIELDS = [
+    "id",
+    "max_new_tokens",
+    "generation",
+    "timestamp",
+    "latency",
+    "ttft",
+    "output_tokens",
+    "tokens_per_second",
+    "usage",
+    "cost",
+    "hedged",
+    "scores",
+]
+
+# Hashes of the task files already read by this process, keyed by path, size and modification time
+_task_file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def hash_task_file(task_data_path: str) -> str:
+    """Return the SHA-256 of the content of a task file (computed once per version of the file)."""
+    stat = os.stat(task_data_path)
+    key = (os.path.abspath(task_data_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _task_file_hashes:
+        digest = hashlib.sha256()
+        with open(task_data_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        _task_file_hashes[key] = digest.hexdigest()
+
+    return _task_file_hashes[key]
+
+
+def slim_result(result: Dict[str, Any], task_file_hash: str) -> Dict[str, Any]:
+    """Drop the fields a result record copied from its task entry, keeping a reference to the task file."""
+    slim = {field: result[field] for field in RESULT_FIELDS if field in result}
+    slim["task_file_hash"] = task_file_hash
+    return slim
+
+
+class TaskFileIndex:
+    """Random access to the entries of a task file by id.
+
+    Only the byte offset of each entry is kept in memory; the entry itself is
+    read and parsed when it is requested.
+
+    Attributes:
+        path: Path of the task file.
+        task_file_hash: SHA-256 of the task file, computed while indexing it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.offsets: Dict[Any, int] = {}
+
+        digest = hashlib.sha256()
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                digest.update(line)
+                try:
+                    entry_id = json.loads(line).get("id")
+                except json.JSONDecodeError:
+                    entry_id = None
+                if entry_id is not None:
+                    self.offsets.setdefault(entry_id, offset)
+                offset += len(line)
+
+        self.task_file_hash = digest.hexdigest()
+        self.file = open(path, 'rb')
+
+    def get(self, entry_id: Any) -> Optional[Dict[str, Any]]:
+        """Read the entry with the given id, or return None if the task file has no such entry."""
+        offset = self.offsets.get(entry_id)
+        if offset is None:
+            return None
+
+        self.file.seek(offset)
+        return json.loads(self.file.readline())
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def iter_results(result_file_path: str, task_data_path: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Read the records of a result file one at a time, rejoining slim records with their entries.
+
+    Full records are returned as written. Slim records are merged with their
+    entry from ``task_data_path`` (the task file is only opened if a slim
+    record is found); a warning is logged if the task file changed since the
+    results were written.
+
+    Args:
+        result_file_path: Path to a *_results.jsonl file.
+        task_data_path: Path to the task file the results were generated
+            from. Without it, slim records are returned as they are.
+
+    Yields:
+        Result records, in file order.
+    """
+    index = None
+    warned = False
+
+    try:
+        with open(result_file_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping invalid JSON line in {result_file_path}")
+                    continue
+
+                if "task_file_hash" not in record or task_data_path is None:
+                    yield record
+                    continue
+
+                if index is None:
+                    index = TaskFileIndex(task_data_path)
+
+                if record["task_file_hash"] != index.task_file_hash and not warned:
+                    logger.warning(f"{task_data_path} changed since {result_file_path} was written; rejoined entries may differ")
+                    warned = True
+
+                entry = index.get(record.get("id"))
+                if entry is None:
+                    logger.warning(f"Entry {record.get('id')} of {result_file_path} not found in {task_data_path}")
+                    yield record
+                    continue
+
+                entry.update(record)
+                yield entry
+    finally:
+        if index is not None:
+            index.close()
+
+
+def load_results(result_file_path: str, task_data_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Load all records of a result file (see iter_results)."""
+    return list(iter_results(result_file_path, task_data_path))
+
+
+def get_task_data_path(task_dir: str, result_file_path: str) -> str:
+    """Task file that a <category>/<task>_results[.shard-i-of-N].jsonl result file was generated from."""
+    category = os.path.basename(os.path.dirname(result_file_path))
+    task_name = os.path.basename(result_file_path).split("_results", 1)[0]
+    return os.path.join(task_dir, category, f"{task_name}.jsonl")
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logging.basicConfig(level=logging.INFO)
+
+
+def dump_record(record):
+    """Serialize a record to one JSONL line, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+
+class ResultWriter:
+    """Append result records to a JSONL file from a background thread.
+
+    ``write()`` only puts the record on a bounded queue (blocking when the
+    writer falls behind), so serializing and writing results does not hold up
+    the requests. From async code, ``awrite()`` and ``aclose()`` wait for the
+    writer in a thread instead, so a stalled disk does not block the event
+    loop. The writer thread serializes every record waiting in the
+    queue, writes them at once and fsyncs the file every ``sync_interval``
+    seconds or ``sync_bytes`` bytes, and on ``close()``. Records written
+    before the last sync survive a crash.
+
+    Attributes:
+        path: Path of the result file.
+        records: Number of records written.
+        syncs: Number of fsyncs.
+    """
+
+    def __init__(self, path, append=False, max_queue=1024, sync_interval=1.0, sync_bytes=4 * 1024 * 1024):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.sync_bytes = sync_bytes
+
+        self.records = 0
+        self.syncs = 0
+        self.error = None
+        self.closed = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, "ab" if append else "wb")
+        self.queue = queue.Queue(maxsize=max_queue)
+        # Keeps the records of concurrent awrite() calls in call order while one waits for room
+        self.async_lock = asyncio.Lock()
+        self.thread = threading.Thread(target=self.run, name=f"ResultWriter({os.path.basename(path)})", daemon=True)
+        self.thread.start()
+
+    def check(self):
+        if self.error:
+            raise self.error
+        if self.closed:
+            raise ValueError(f"Result writer for {self.path} is closed")
+
+    def write(self, record):
+        """Queue a record to be written."""
+        self.check()
+        self.queue.put(record)
+
+    async def awrite(self, record):
+        """Queue a record from async code, waiting for room in a thread rather than on the event loop."""
+        self.check()
+        async with self.async_lock:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                await asyncio.to_thread(self.queue.put, record)
+
+    def close(self):
+        """Write the queued records, fsync and close the file."""
+        if self.closed:
+            return
+
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+        if self.error:
+            raise self.error
+
+    async def aclose(self):
+        """close() from async code, without blocking the event loop on the final writes and fsync."""
+        await asyncio.to_thread(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.syncs += 1
+
+    def run(self):
+        unsynced_bytes = 0
+        last_sync = time.monotonic()
+        stopping = False
+
+        while not stopping:
+            timeout = max(0.0, last_sync + self.sync_interval - time.monotonic()) if unsynced_bytes else None
+            try:
+                batch = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+
+            # Take everything else already waiting
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                stopping = True
+                batch = [record for record in batch if record is not None]
+
+            try:
+                if batch and not self.error:
+                    data = b"".join(dump_record(record) for record in batch)
+                    self.file.write(data)
+                    self.records += len(batch)
+                    unsynced_bytes += len(data)
+
+                if unsynced_bytes and (
+                    stopping
+                    or unsynced_bytes >= self.sync_bytes
+                    or time.monotonic() - last_sync >= self.sync_interval
+                ):
+                    self.sync()
+                    unsynced_bytes = 0
+                    last_sync = time.monotonic()
+            except Exception as e:
+                logging.error(f"Failed to write results to {self.path}: {e}")
+                self.error = e
+                unsynced_bytes = 0
@@ -0,0 +1,207 @@
+import math
+import random
+from typing import Any, Dict, List, Optional
+
+
+def mean(values: List[float]) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Return the q-th percentile (0-100) of values using the nearest-rank method."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "mean": mean(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+class Reservoir:
+    """Count, mean and a bounded uniform sample of a stream of values.
+
+    The first ``size`` values are all kept, so percentiles are exact up to
+    that many values; beyond it each new value replaces a random kept one
+    with probability size/count (reservoir sampling), so memory stays
+    constant however long the run is. The mean is always exact.
+    """
+
+    def __init__(self, size: int = 4096) -> None:
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.values: List[float] = []
+        # A private generator, so that summaries do not consume the global random state
+        self.random = random.Random(0)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if len(self.values) < self.size:
+            self.values.append(value)
+            return
+
+        index = self.random.randrange(self.count)
+        if index < self.size:
+            self.values[index] = value
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def distribution(self) -> Dict[str, Optional[float]]:
+        return dict(distribution(self.values), mean=self.mean())
+
+
+USAGE_FIELDS = ["requests", "prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens", "cost"]
+
+
+def empty_usage() -> Dict[str, Any]:
+    return {field: 0 for field in USAGE_FIELDS}
+
+
+def add_usage(total: Dict[str, Any], usage: Dict[str, Any], cost: Optional[float] = None) -> None:
+    """Add the usage (and cost) of one request to a running total."""
+    total["requests"] += 1
+    for field in ["prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens"]:
+        total[field] += usage.get(field) or 0
+    total["cost"] += cost or 0.0
+
+
+def merge_usage(total: Dict[str, Any], other: Dict[str, Any]) -> None:
+    """Add a usage total (e.g. of a task) into another one (e.g. of its category)."""
+    for field in USAGE_FIELDS:
+        total[field] += other.get(field) or 0
+
+
+class TimingStats:
+    """Latency, time-to-first-token and decode rate of a set of requests.
+
+    Each is kept in a Reservoir, so memory does not grow with the number of
+    requests; percentiles beyond the reservoir size are estimates.
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.output_tokens = 0
+        self.latencies = Reservoir()
+        self.ttfts = Reservoir()
+        self.tokens_per_second = Reservoir()
+
+    def add(self, metadata: Dict[str, Any]) -> None:
+        self.requests += 1
+        self.output_tokens += metadata.get("output_tokens") or 0
+
+        # Unknown for batched requests
+        if metadata.get("latency") is not None:
+            self.latencies.add(metadata["latency"])
+
+        # Only known for streamed responses
+        if metadata.get("ttft") is not None:
+            self.ttfts.add(metadata["ttft"])
+        if metadata.get("tokens_per_second") is not None:
+            self.tokens_per_second.add(metadata["tokens_per_second"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "output_tokens": self.output_tokens,
+            "latency": self.latencies.distribution(),
+            "ttft": self.ttfts.distribution(),
+            "tokens_per_second": self.tokens_per_second.distribution(),
+        }
+
+
+class TaskStats:
+    """Running aggregates over the results of one task, reported in summary.json.
+
+    Prompts that share a context are sent back-to-back: the first request of a
+    group (the leader) warms the provider's prompt cache and the following
+    ones should be served from it. The leader/follower split makes the
+    latency saving of that ordering visible.
+
+    Token usage and cost, latency, time-to-first-token and decode rate (the
+    last two only for streamed responses) are aggregated over the task and
+    per context_length.
+    """
+
+    def __init__(self) -> None:
+        self.prefix_groups = 0
+        self.usage = empty_usage()
+        self.usage_by_context_length: Dict[Any, Dict[str, Any]] = {}
+        self.leader_latencies = Reservoir()
+        self.follower_latencies = Reservoir()
+        self.timing = TimingStats()
+        self.timing_by_context_length: Dict[Any, TimingStats] = {}
+
+    def add(
+        self, 
+        metadata: Dict[str, Any], 
+        prefix_leader: bool = False, 
+        context_length: Optional[int] = None,
+    ) -> None:
+        """Add the metadata returned by generate_with_metadata for one entry."""
+        if prefix_leader:
+            self.prefix_groups += 1
+
+        usage = metadata.get("usage")
+        if not usage:
+            return
+
+        add_usage(self.usage, usage, metadata.get("cost"))
+        if context_length is not None:
+            if context_length not in self.usage_by_context_length:
+                self.usage_by_context_length[context_length] = empty_usage()
+            add_usage(self.usage_by_context_length[context_length], usage, metadata.get("cost"))
+
+        if metadata.get("latency") is not None:
+            if prefix_leader:
+                self.leader_latencies.add(metadata["latency"])
+            else:
+                self.follower_latencies.add(metadata["latency"])
+
+        self.timing.add(metadata)
+        if context_length is not None:
+            if context_length not in self.timing_by_context_length:
+                self.timing_by_context_length[context_length] = TimingStats()
+            self.timing_by_context_length[context_length].add(metadata)
+
+    def to_dict(self) -> Dict[str, Any]:
+        prompt_tokens = self.usage["prompt_tokens"]
+        cached_tokens = self.usage["cached_tokens"]
+
+        return {
+            "usage": dict(
+                self.usage,
+                by_context_length={
+                    str(context_length): dict(
+                        usage,
+                        mean_prompt_tokens=usage["prompt_tokens"] / usage["requests"],
+                        mean_completion_tokens=usage["completion_tokens"] / usage["requests"],
+                    )
+                    for context_length, usage in sorted(self.usage_by_context_length.items())
+                },
+            ),
+            "prefix_cache": {
+                "groups": self.prefix_groups,
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens,
+                "hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+                "leader_mean_latency": self.leader_latencies.mean(),
+                "follower_mean_latency": self.follower_latencies.mean(),
+            },
+            "timing": dict(
+                self.timing.to_dict(),
+                by_context_length={
+                    str(context_length): stats.to_dict()
+                    for context_length, stats in sorted(self.timing_by_context_length.items())
+                },
+            ),
+        }
@@ -1,10 +1,13 @@
 import argparse
+import asyncio
+import hashlib
 import json
 import logging
 import os
+import socket
 import sys
 import time
-from typing import Dict, List, Any, Optional
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Any, Optional, Set, Tuple, Union
 import yaml
 from tqdm import tqdm
 
@@ -19,8 +22,18 @@ from task.compute_on_sets_and_lists import *
 from task.stateful_processing import *
 from task.composite import *
 
-from inference import Azure_LLM_API
+from inference import create_backend
+from batch import BatchJob
+from load_balancer import Pooled_LLM_API
+from rate_limiter import RateLimiter
+from response_cache import CACHE_MODES, ResponseCache
 from evaluate import evaluate_generation
+from run_summary import TaskStats, empty_usage, merge_usage
+from estimate import TokenCounter, select_within_budget, summarize_estimate
+from hedging import Hedger
+from work_queue import WorkQueue
+from result_writer import ResultWriter
+from result_loader import hash_task_file, slim_result
 
 # Configure logging
 logging.basicConfig(
@@ -30,103 +43,1394 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Every task prompt starts with its context and ends with the instruction
+PROMPT_PREFIX_DELIMITER = "\n\nInstruction:\n"
 
-def load_task_data(task_data_path: str) -> List[Dict[str, Any]]:
-    """Load task data from a JSONL file.
+
+def iter_task_data(task_data_path: str) -> Iterator[Dict[str, Any]]:
+    """Read the entries of a JSONL task file one at a time.
     
     Args:
         task_data_path: Path to the task data file.
         
-    Returns:
-        List of task data entries.
+    Yields:
+        Task data entries, in file order.
     """
-    data = []
-
     if not os.path.exists(task_data_path):
         logger.error(f"Task data file not found: {task_data_path}")
-        return data
+        return
     
     try:
         with open(task_data_path, 'r') as f:
             for line in f:
                 try:
                     entry = json.loads(line.strip())
-                    data.append(entry)
                 except json.JSONDecodeError:
                     logger.warning(f"Skipping invalid JSON line in {task_data_path}")
+                    continue
+                yield entry
     except Exception as e:
         logger.error(f"Error loading task data from {task_data_path}: {e}")
+
+
+def load_task_data(task_data_path: str) -> List[Dict[str, Any]]:
+    """Load task data from a JSONL file.
     
+    Args:
+        task_data_path: Path to the task data file.
+        
+    Returns:
+        List of task data entries.
+    """
+    data = list(iter_task_data(task_data_path))
     logger.info(f"Loaded {len(data)} examples from {task_data_path}")
     return data
     
 
-def run_test(
-    task_data: List[Dict[str, Any]], 
-    llm_api: Any, 
-    metrics: Optional[List[str]] = None,
-    result_file_path: Optional[str] = None,
+def get_prompt_prefix_key(prompt: str) -> str:
+    """Hash the part of a prompt that precedes the instruction (i.e. its context)."""
+    prefix = prompt.split(PROMPT_PREFIX_DELIMITER, 1)[0]
+    return hashlib.sha1(prefix.encode("utf-8")).hexdigest()
+
+
+def group_by_prompt_prefix(task_data: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Group entries whose prompts share the same context.
+    
+    Groups are ordered by their first entry in ``task_data`` and keep the
+    relative order of their entries, so the schedule is deterministic.
+    
+    Args:
+        task_data: List of task data entries.
+        
+    Returns:
+        List of groups of entries.
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in task_data:
+        key = get_prompt_prefix_key(entry.get("prompt", ""))
+        groups.setdefault(key, []).append(entry)
+
+    return list(groups.values())
+
+
+def iter_prompt_prefix_groups(
+    task_data: Iterable[Dict[str, Any]], 
+    prefix_ordering: bool = True,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Group consecutive entries whose prompts share the same context, without reading ahead.
+
+    Unlike group_by_prompt_prefix, only adjacent entries are grouped, so a
+    task file can be streamed. generate_test.py writes the entries built on
+    one context next to each other.
+
+    Args:
+        task_data: Task data entries, e.g. streamed by iter_task_data.
+        prefix_ordering: If False, every entry is a group of its own.
+
+    Yields:
+        Groups of entries, in the order of ``task_data``.
+    """
+    group: List[Dict[str, Any]] = []
+    group_key = None
+    for entry in task_data:
+        key = get_prompt_prefix_key(entry.get("prompt", "")) if prefix_ordering else None
+        if group and (not prefix_ordering or key != group_key):
+            yield group
+            group = []
+        group.append(entry)
+        group_key = key
+
+    if group:
+        yield group
+
+
+def get_shard(entry_id: Any, num_shards: int) -> int:
+    """Assign an entry to a shard by a stable hash of its id, identical on every machine."""
+    digest = hashlib.sha256(str(entry_id).encode("utf-8")).hexdigest()
+    return int(digest[:16], 16) % num_shards
+
+
+def get_shard_suffix(shard: Optional[Tuple[int, int]] = None) -> str:
+    """Suffix of the result and summary files written by one shard, e.g. ".shard-0-of-4"."""
+    if not shard:
+        return ""
+    return f".shard-{shard[0]}-of-{shard[1]}"
+
+
+def call_llm(llm_api: Any, prompt: str, max_new_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """Generate a response, with usage and latency if the API provides them."""
+    if hasattr(llm_api, "generate_with_metadata"):
+        return llm_api.generate_with_metadata(prompt, max_new_tokens=max_new_tokens)
+
+    start_time = time.time()
+    generation = llm_api.generate(prompt, max_new_tokens=max_new_tokens)
+    return {"generation": generation, "usage": None, "latency": time.time() - start_time}
+
+
+def get_hedge_key(task_name: str, entry: Dict[str, Any]) -> str:
+    """Key under which the hedger tracks the latency of an entry: its task and context length."""
+    if entry.get("context_length") is None:
+        return task_name
+    return f"{task_name}/{entry['context_length']}"
+
+
+async def acall_llm(
+    llm_api: Any, 
+    prompt: str, 
+    max_new_tokens: Optional[int] = None, 
+    hedge_key: Optional[str] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> Dict[str, Any]:
+    """Async counterpart of call_llm().
+
+    If the API has a hedger, slow requests are duplicated once their latency
+    passes the percentile observed for ``hedge_key`` (see get_hedge_key). The
+    caller holds a slot of ``semaphore`` for the request; the duplicate
+    acquires one of its own.
+    """
+    async def call(on_send: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        if hasattr(llm_api, "agenerate_with_metadata"):
+            return await llm_api.agenerate_with_metadata(prompt, max_new_tokens=max_new_tokens, on_send=on_send)
+
+        if on_send:
+            on_send()
+        start_time = time.time()
+        generation = await llm_api.agenerate(prompt, max_new_tokens=max_new_tokens)
+        return {"generation": generation, "usage": None, "latency": time.time() - start_time}
+
+    hedger = getattr(llm_api, "hedger", None)
+    if hedger:
+        return await hedger.run(hedge_key, call, semaphore)
+    return await call()
+
+
+def build_result(
+    entry: Dict[str, Any], 
+    generation: Optional[str], 
+    metrics: Optional[List[str]] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    task_file_hash: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Build the result record for a single entry.
+    
+    Args:
+        entry: Task data entry that was sent to the model.
+        generation: Text generated by the model (None if the request failed).
+        metrics: List of metrics to evaluate the generation with.
+        metadata: Metadata returned by generate_with_metadata.
+        task_file_hash: Hash of the task file the entry comes from. If given,
+            a slim record referencing the entry by id is built instead of
+            copying the entry (see result_loader).
+        
+    Returns:
+        Result record containing the entry, the generation and its scores.
+    """
+    result = entry.copy()
+    result["generation"] = generation
+    result["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    if metadata:
+        result["latency"] = metadata.get("latency")
+        result["ttft"] = metadata.get("ttft")
+        result["output_tokens"] = metadata.get("output_tokens")
+        result["tokens_per_second"] = metadata.get("tokens_per_second")
+        result["usage"] = metadata.get("usage")
+        result["cost"] = metadata.get("cost")
+        if metadata.get("hedged"):
+            result["hedged"] = True
+
+    if metrics:
+        result["scores"] = {}
+        for metric in metrics:
+            score = evaluate_generation(
+                generation, 
+                entry.get("reference", ""), 
+                metrics=[metric]
+            )
+            result["scores"][metric] = score
+
+    if task_file_hash:
+        return slim_result(result, task_file_hash)
+    return result
+
+
+def open_result_file(result_file_path: Optional[str], append: bool = False) -> Optional[ResultWriter]:
+    """Open a write-behind writer on a result file, creating its directory if needed."""
+    if not result_file_path:
+        return None
+
+    return ResultWriter(result_file_path, append=append)
+
+
+def index_completed_results(result_file_path: str) -> Dict[Any, int]:
+    """Locate the successful results of an existing result file without keeping them in memory.
+    
+    Records whose generation is null (failed requests) and truncated lines
+    left by an interrupted run are ignored. If an entry has several
+    successful results, the last one is kept.
+    
+    Args:
+        result_file_path: Path to a *_results.jsonl file.
+        
+    Returns:
+        Dictionary mapping entry ids to the line number of their result record.
+    """
+    completed = {}
+    if not os.path.exists(result_file_path):
+        return completed
+
+    with open(result_file_path, 'r') as f:
+        for line_number, line in enumerate(f):
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping invalid JSON line in {result_file_path}")
+                continue
+            if result.get("id") is not None and result.get("generation") is not None:
+                completed[result["id"]] = line_number
+
+    return completed
+
+
+def load_completed_ids(result_file_path: str) -> Set[Any]:
+    """Return the ids of the entries that have a successful result in a result file."""
+    return set(index_completed_results(result_file_path))
+
+
+def prepare_resume(result_file_path: str) -> Set[Any]:
+    """Compact an existing result file down to its successful results so a run can append to it.
+
+    The file is rewritten line by line, so its size does not matter.
+
+    Args:
+        result_file_path: Path to a *_results.jsonl file.
+
+    Returns:
+        Ids of the completed entries.
+    """
+    completed = index_completed_results(result_file_path)
+    if not os.path.exists(result_file_path):
+        return set(completed)
+
+    # Rewrite atomically so an interruption here cannot lose completed results
+    kept_lines = set(completed.values())
+    tmp_path = result_file_path + ".tmp"
+    with open(result_file_path, 'r') as source, open(tmp_path, 'w') as f:
+        for line_number, line in enumerate(source):
+            if line_number in kept_lines:
+                f.write(line if line.endswith("\n") else line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, result_file_path)
+
+    return set(completed)
+
+
+def run_test(
+    task_data: Iterable[Dict[str, Any]], 
+    llm_api: Any, 
+    metrics: Optional[List[str]] = None,
+    result_file_path: Optional[str] = None,
+    append: bool = False,
+    stats: Optional[TaskStats] = None,
+    prefix_ordering: bool = True,
+    task_file_hash: Optional[str] = None,
+) -> int:
+    """Run a memory test using the provided task data and LLM API.
+    
+    Entries are consumed one at a time and each result is handed to the
+    result writer as soon as it is built, so ``task_data`` can be streamed
+    (e.g. from iter_task_data) and memory does not grow with the task.
+    
+    Args:
+        task_data: Task data entries.
+        llm_api: Instance of the LLM API to use for inference.
+        metrics: List of metrics to evaluate the results.
+        result_file_path: Path to save the results.
+        append: Append to the result file instead of overwriting it.
+        stats: Optional TaskStats to accumulate usage and latency into.
+        prefix_ordering: Send entries that share a context back-to-back so
+            the provider's prompt cache can serve all but the first one.
+        task_file_hash: Hash of the task file, to write slim result records.
+        
+    Returns:
+        Number of results written.
+    """
+    written = 0
+    result_file = open_result_file(result_file_path, append=append)
+
+    schedule = (
+        (entry, position == 0)
+        for group in iter_prompt_prefix_groups(task_data, prefix_ordering)
+        for position, entry in enumerate(group)
+    )
+
+    try:
+        for entry, prefix_leader in tqdm(schedule, desc="Processing entries"):
+            entry_id = entry.get('id', 'unknown')
+            try:
+                prompt = entry.get("prompt", "")
+                if not prompt:
+                    logger.warning(f"No prompt found for entry {entry_id}. Skipping.")
+                    break
+
+                metadata = call_llm(llm_api, prompt, entry.get("max_new_tokens"))
+                result = build_result(entry, metadata["generation"], metrics, metadata, task_file_hash)
+                if stats:
+                    stats.add(metadata, prefix_leader=prefix_leader, context_length=entry.get("context_length"))
+
+                written += 1
+                if result_file:
+                    result_file.write(result)
+                    
+            except Exception as e:
+                logger.error(f"Error processing entry {entry_id}: {e}")
+
+    
+    finally:
+        if result_file:
+            result_file.close()
+    
+    return written
+
+
+async def aiter_prompt_prefix_groups(
+    task_data: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]], 
+    prefix_ordering: bool = True,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Async counterpart of iter_prompt_prefix_groups(), also accepting an async iterable of entries."""
+    if not hasattr(task_data, "__aiter__"):
+        for group in iter_prompt_prefix_groups(task_data, prefix_ordering):
+            yield group
+        return
+
+    group: List[Dict[str, Any]] = []
+    group_key = None
+    async for entry in task_data:
+        key = get_prompt_prefix_key(entry.get("prompt", "")) if prefix_ordering else None
+        if group and (not prefix_ordering or key != group_key):
+            yield group
+            group = []
+        group.append(entry)
+        group_key = key
+
+    if group:
+        yield group
+
+
+async def arun_test(
+    task_data: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]], 
+    llm_api: Any, 
+    metrics: Optional[List[str]] = None,
+    result_file_path: Optional[str] = None,
+    concurrency: int = 8,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    append: bool = False,
+    stats: Optional[TaskStats] = None,
+    prefix_ordering: bool = True,
+    hedge_key: Optional[str] = None,
+    window: Optional[int] = None,
+    task_file_hash: Optional[str] = None,
+) -> int:
+    """Run a memory test with several requests in flight at once.
+    
+    With ``prefix_ordering``, entries whose prompts share a context are
+    grouped: the first entry of each group is sent alone to warm the
+    provider's prompt cache and the rest of the group follows once it has
+    returned. Requests may complete in any order, but results are written to
+    the result file in schedule order, which only depends on ``task_data``.
+
+    Entries are read from ``task_data`` only as long as fewer than ``window``
+    of them are waiting to be written, so the task can be streamed and
+    memory does not grow with its size.
+    
+    Args:
+        task_data: Task data entries (an iterable or an async iterable).
+        llm_api: Instance of the LLM API to use for inference (must provide ``agenerate``).
+        metrics: List of metrics to evaluate the results.
+        result_file_path: Path to save the results.
+        concurrency: Maximum number of requests in flight (ignored if ``semaphore`` is given).
+        semaphore: Semaphore shared with other tasks to bound the total number of requests.
+        append: Append to the result file instead of overwriting it.
+        stats: Optional TaskStats to accumulate usage and latency into.
+        prefix_ordering: Schedule entries that share a context back-to-back.
+        hedge_key: Task name under which the hedger of the API tracks the latencies of this test
+            (with the context length of each entry, see get_hedge_key).
+        window: Maximum number of entries read but not yet written (defaults
+            to 4 * ``concurrency``); a whole group of entries sharing a
+            context is always read at once.
+        task_file_hash: Hash of the task file, to write slim result records.
+        
+    Returns:
+        Number of results written.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(concurrency)
+    window = window or 4 * concurrency
+
+    # Results of the entries read so far, by position in the schedule, until they are written
+    results: Dict[int, Optional[Dict[str, Any]]] = {}
+    next_to_write = 0
+    written = 0
+
+    result_file = open_result_file(result_file_path, append=append)
+    progress = tqdm(desc="Processing entries")
+
+    async def write_ready_results() -> None:
+        # Write the completed prefix of results to keep the file order deterministic
+        nonlocal next_to_write, written
+        while next_to_write in results:
+            result = results.pop(next_to_write)
+            next_to_write += 1
+            if result is not None:
+                written += 1
+                if result_file:
+                    await result_file.awrite(result)
+
+    async def process_entry(index: int, entry: Dict[str, Any], prefix_leader: bool) -> None:
+        entry_id = entry.get('id', 'unknown')
+        result = None
+        try:
+            prompt = entry.get("prompt", "")
+            if not prompt:
+                logger.warning(f"No prompt found for entry {entry_id}. Skipping.")
+                return
+
+            async with semaphore:
+                metadata = await acall_llm(
+                    llm_api, prompt, entry.get("max_new_tokens"), get_hedge_key(hedge_key, entry), semaphore
+                )
+
+            result = build_result(entry, metadata["generation"], metrics, metadata, task_file_hash)
+            if stats:
+                stats.add(metadata, prefix_leader=prefix_leader, context_length=entry.get("context_length"))
+
+        except Exception as e:
+            logger.error(f"Error processing entry {entry_id}: {e}")
+
+        finally:
+            results[index] = result
+            progress.update(1)
+            await write_ready_results()
+
+    async def process_group(group: List) -> None:
+        (leader_index, leader), followers = group[0], group[1:]
+        await process_entry(leader_index, leader, prefix_leader=True)
+        await asyncio.gather(
+            *(process_entry(index, entry, prefix_leader=False) for index, entry in followers)
+        )
+
+    in_flight = set()
+    index = 0
+    try:
+        async for group in aiter_prompt_prefix_groups(task_data, prefix_ordering):
+            while in_flight and index - next_to_write >= window:
+                _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
+            in_flight.add(asyncio.ensure_future(process_group(list(enumerate(group, start=index)))))
+            index += len(group)
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    finally:
+        for pending in in_flight:
+            pending.cancel()
+        progress.close()
+        if result_file:
+            await result_file.aclose()
+
+    return written
+
+
+def collect_tasks(
+    task_dir: str,
+    model_result_dir: str,
+    categories: List[str],
+    task_name: Optional[str] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    selection: Optional[Dict[str, Set[Any]]] = None,
+    result_format: str = "full",
+) -> List[Dict[str, Any]]:
+    """Instantiate the tasks to run and resolve their data and result paths.
+
+    Args:
+        task_dir: Directory containing the test data.
+        model_result_dir: Directory to save the results of the model.
+        categories: Task categories to run.
+        task_name: Optional specific task to run.
+        shard: Optional (shard index, number of shards) to run only one shard
+            of the entries, writing shard-suffixed result files.
+        selection: Optional ids of the entries to run, keyed by
+            "<category>/<task_name>" (e.g. chosen to fit a --budget).
+        result_format: "full" to copy each entry into its result record,
+            "slim" to only reference it by id and task file hash.
+
+    Returns:
+        List of dictionaries describing each task to run.
+    """
+    tasks = []
+    for category in categories:
+        category_dir = os.path.join(task_dir, category)
+        if not os.path.exists(category_dir):
+            logger.warning(f"Category directory not found: {category_dir}")
+            continue
+            
+        category_result_dir = os.path.join(model_result_dir, category)
+        os.makedirs(category_result_dir, exist_ok=True)
+
+        # Get all task instances for this category
+        for task_class_info in TASK_CLASSES[category]:
+            try:
+                if isinstance(task_class_info, dict):
+                    task_class = task_class_info["class"]
+                    params = task_class_info["params"]
+                    task_instance = task_class(**params)
+                else:
+                    task_class = task_class_info
+                    task_instance = task_class()
+                    
+                # Filter by task name if specified
+                if task_name and task_instance.task_name != task_name:
+                    continue
+                    
+            except Exception as e:
+                logger.error(f"Error instantiating task {task_class.__name__}: {e}")
+                continue
+
+            task_data_path = os.path.join(category_dir, f"{task_instance.task_name}.jsonl")
+            tasks.append({
+                "category": category,
+                "task_instance": task_instance,
+                "task_data_path": task_data_path,
+                "result_file_path": os.path.join(
+                    category_result_dir, 
+                    f"{task_instance.task_name}_results{get_shard_suffix(shard)}.jsonl",
+                ),
+                "shard": shard,
+                "selected_ids": None if selection is None else selection.get(f"{category}/{task_instance.task_name}", set()),
+                "task_file_hash": (
+                    hash_task_file(task_data_path) 
+                    if result_format == "slim" and os.path.exists(task_data_path) else None
+                ),
+                "stats": TaskStats(),
+            })
+
+    return tasks
+
+
+def is_in_scope(task: Dict[str, Any], entry: Dict[str, Any]) -> bool:
+    """Return True if an entry belongs to the shard and selection of a task returned by collect_tasks."""
+    if task.get("shard"):
+        shard_index, num_shards = task["shard"]
+        if get_shard(entry.get("id"), num_shards) != shard_index:
+            return False
+
+    return task.get("selected_ids") is None or entry.get("id") in task["selected_ids"]
+
+
+def prepare_task(
+    task: Dict[str, Any], 
+    resume: bool = False, 
+    read_only: bool = False,
+) -> Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Return a function that decides, entry by entry, whether a task returned by collect_tasks runs it.
+
+    The function fills in the output budget of entries from task files
+    generated before it was stored, drops entries of other shards and entries
+    not in the selection, and counts the remaining entries in
+    ``task["examples_total"]``. With ``resume``, the result file is compacted
+    first and entries that already have a successful result are dropped too
+    and counted in ``task["examples_resumed"]``.
+
+    Args:
+        task: Task returned by collect_tasks.
+        resume: Skip entries already present in the result file.
+        read_only: Only read the completed ids of the result file instead of
+            compacting it, for runs that send no requests (dry runs, estimates).
+
+    Returns:
+        Function returning the entry if it should be run, None otherwise.
+    """
+    task_instance = task["task_instance"]
+    task["examples_total"] = 0
+    task["examples_resumed"] = 0
+    if not resume:
+        completed = set()
+    elif read_only:
+        completed = load_completed_ids(task["result_file_path"])
+    else:
+        completed = prepare_resume(task["result_file_path"])
+
+    def select(entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Task files generated before output budgets were stored in the entries
+        if "max_new_tokens" not in entry:
+            entry["max_new_tokens"] = task_instance.get_max_new_tokens(entry.get("reference", ""))
+
+        if not is_in_scope(task, entry):
+            return None
+
+        task["examples_total"] += 1
+        if entry.get("id") in completed:
+            task["examples_resumed"] += 1
+            return None
+
+        return entry
+
+    return select
+
+
+def load_task(
+    task: Dict[str, Any], 
+    resume: bool = False, 
+    task_data: Optional[Iterable[Dict[str, Any]]] = None,
+    read_only: bool = False,
+) -> Optional[Iterator[Dict[str, Any]]]:
+    """Stream the entries of a task returned by collect_tasks that still need to be run.
+
+    Entries are read from the task file lazily (see prepare_task for the
+    entries that are dropped), so ``task["examples_total"]`` and
+    ``task["examples_resumed"]`` are only complete once the returned iterator
+    is exhausted.
+
+    Args:
+        task: Task returned by collect_tasks.
+        resume: Skip entries already present in the result file.
+        task_data: Entries of the task if they were already loaded.
+        read_only: Leave the result file untouched (see prepare_task).
+
+    Returns:
+        Iterator over the entries to run, or None if the task should be skipped.
+    """
+    task_instance = task["task_instance"]
+    task_data_path = task["task_data_path"]
+
+    logger.info(f"Running task: {task_instance.task_name}")
+    if task_data is None:
+        if not os.path.exists(task_data_path):
+            logger.warning(f"Data file not found: {task_data_path}. Skipping.")
+            return None
+
+        task_data = iter_task_data(task_data_path)
+
+    select = prepare_task(task, resume=resume, read_only=read_only)
+    return (entry for entry in map(select, task_data) if entry is not None)
+
+
+def update_summary(
+    summary: Dict[str, Any], 
+    category: str, 
+    examples_total: int, 
+    examples_completed: int,
+    examples_resumed: int = 0,
+) -> None:
+    """Add the statistics of a finished task to the run summary."""
+    summary["tasks_run"] += 1
+    summary["examples_total"] += examples_total
+    summary["examples_completed"] += examples_completed
+    summary["examples_resumed"] += examples_resumed
+
+    category_summary = summary["categories"].setdefault(
+        category, {"tasks_run": 0, "examples_total": 0, "examples_completed": 0, "examples_resumed": 0}
+    )
+    category_summary["tasks_run"] += 1
+    category_summary["examples_total"] += examples_total
+    category_summary["examples_completed"] += examples_completed
+    category_summary["examples_resumed"] += examples_resumed
+
+
+def finish_task(
+    task: Dict[str, Any], 
+    summary: Dict[str, Any], 
+    examples_run: int, 
+    elapsed: float,
+) -> None:
+    """Log a finished task and add it to the run summary.
+
+    Args:
+        task: Task returned by collect_tasks, after its entries were streamed.
+        summary: Run summary to update.
+        examples_run: Number of results written by this run.
+        elapsed: Seconds the task took.
+    """
+    task_instance = task["task_instance"]
+    task["finished"] = True
+    if not task["examples_total"]:
+        logger.warning(f"No data loaded for task: {task_instance.task_name}. Skipping.")
+        return
+
+    examples_completed = task["examples_resumed"] + examples_run
+    if task["examples_resumed"]:
+        logger.info(f"Resumed '{task_instance.task_name}': {task['examples_resumed']} examples were already completed")
+    logger.info(f"Completed {examples_completed}/{task['examples_total']} examples for '{task_instance.task_name}' in {elapsed:.2f}s")
+
+    update_summary(
+        summary, 
+        task["category"], 
+        task["examples_total"], 
+        examples_completed, 
+        task["examples_resumed"],
+    )
+    add_task_stats(summary, task)
+
+
+def add_task_stats(summary: Dict[str, Any], task: Dict[str, Any]) -> None:
+    """Record the aggregates of a task under its category and roll its usage up into the category and run."""
+    category_summary = summary["categories"][task["category"]]
+    task_stats = task["stats"].to_dict()
+    category_summary.setdefault("tasks", {})[task["task_instance"].task_name] = task_stats
+
+    merge_usage(category_summary.setdefault("usage", empty_usage()), task_stats["usage"])
+    merge_usage(summary.setdefault("usage", empty_usage()), task_stats["usage"])
+
+
+def add_unfinished_tasks(summary: Dict[str, Any], tasks: List[Dict[str, Any]]) -> None:
+    """Count the results already on disk for tasks that were interrupted."""
+    for task in tasks:
+        if "examples_total" not in task or task.get("finished"):
+            continue
+
+        # The entries of an interrupted task were only counted up to where it was streamed
+        examples_total = sum(is_in_scope(task, entry) for entry in iter_task_data(task["task_data_path"]))
+        completed = load_completed_ids(task["result_file_path"])
+        update_summary(
+            summary,
+            task["category"],
+            examples_total,
+            len(completed),
+            task["examples_resumed"],
+        )
+        add_task_stats(summary, task)
+
+
+async def arun_tasks(
+    tasks: List[Dict[str, Any]], 
+    llm_api: Any, 
+    summary: Dict[str, Any], 
+    concurrency: int = 8,
+    resume: bool = False,
+    prefix_ordering: bool = True,
+) -> None:
+    """Run several tasks concurrently, sharing one budget of in-flight requests.
+
+    Overlapping tasks keeps the request pipe full while a slow task is finishing.
+
+    Args:
+        tasks: Tasks returned by collect_tasks.
+        llm_api: LLM API instance to use for inference.
+        summary: Run summary to update as tasks finish.
+        concurrency: Maximum number of requests in flight across all tasks.
+        resume: Skip entries already present in the result files.
+        prefix_ordering: Send entries that share a context back-to-back.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_task(task: Dict[str, Any]) -> None:
+        task_data = load_task(task, resume=resume)
+        if task_data is None:
+            return
+
+        start_time = time.time()
+        examples_run = await arun_test(
+            task_data,
+            llm_api,
+            metrics=task["task_instance"].metrics,
+            result_file_path=task["result_file_path"],
+            concurrency=concurrency,
+            semaphore=semaphore,
+            append=resume,
+            stats=task["stats"],
+            prefix_ordering=prefix_ordering,
+            hedge_key=task["task_instance"].task_name,
+            task_file_hash=task["task_file_hash"],
+        )
+
+        finish_task(task, summary, examples_run, time.time() - start_time)
+
+    try:
+        await asyncio.gather(*(run_task(task) for task in tasks))
+    finally:
+        if hasattr(llm_api, "aclose"):
+            await llm_api.aclose()
+
+
+def run_batch_tasks(
+    tasks: List[Dict[str, Any]], 
+    llm_api: Any, 
+    summary: Dict[str, Any], 
+    batch_dir: str,
+    resume: bool = False,
+    prefix_ordering: bool = True,
+    max_requests: int = 50000,
+    max_mb: float = 190,
+    poll_interval: float = 30,
+    price_factor: float = 0.5,
+) -> None:
+    """Run tasks through the provider's batch API and join the outputs back into result files.
+
+    All entries of all tasks are submitted together (split into as many batch
+    files as the size limits require), so this trades latency for throughput
+    and price.
+
+    Args:
+        tasks: Tasks returned by collect_tasks.
+        llm_api: LLM API instance to use for inference.
+        summary: Run summary to update as tasks finish.
+        batch_dir: Directory for the batch request files and batch state.
+        resume: Skip entries already present in the result files, and reuse the
+            batches already submitted for identical batch files.
+        prefix_ordering: Write entries that share a context next to each other.
+        max_requests: Maximum number of requests per batch file.
+        max_mb: Maximum size of a batch file in megabytes.
+        poll_interval: Seconds between two polls of the batch status.
+        price_factor: Multiplier applied to the cost of batched requests.
+    """
+    job = BatchJob(
+        llm_api,
+        batch_dir,
+        max_requests=max_requests,
+        max_bytes=int(max_mb * 1024 * 1024),
+        poll_interval=poll_interval,
+        price_factor=price_factor,
+        resume=resume,
+    )
+
+    loaded_tasks = []
+    entries = []
+    for task in tasks:
+        task_data = load_task(task, resume=resume)
+        if task_data is None:
+            continue
+
+        # Batch files hold every request, so the entries are loaded up front
+        task_data = list(task_data)
+        if prefix_ordering:
+            task_data = [entry for group in group_by_prompt_prefix(task_data) for entry in group]
+
+        for entry in task_data:
+            if not entry.get("prompt"):
+                logger.warning(f"No prompt found for entry {entry.get('id', 'unknown')}. Skipping.")
+                continue
+            entries.append(entry)
+        loaded_tasks.append((task, task_data))
+
+    start_time = time.time()
+    outputs = job.run(entries)
+    elapsed = time.time() - start_time
+
+    for task, task_data in loaded_tasks:
+        examples_run = 0
+        result_file = open_result_file(task["result_file_path"], append=resume)
+        leaders = set()
+
+        try:
+            for entry in task_data:
+                if entry.get("id") not in outputs:
+                    continue
+
+                metadata = outputs[entry["id"]]
+                result = build_result(
+                    entry, metadata["generation"], task["task_instance"].metrics, metadata, task["task_file_hash"]
+                )
+
+                prefix_key = get_prompt_prefix_key(entry["prompt"])
+                task["stats"].add(metadata, prefix_leader=prefix_key not in leaders, context_length=entry.get("context_length"))
+                leaders.add(prefix_key)
+
+                examples_run += 1
+                if result_file:
+                    result_file.write(result)
+        finally:
+            if result_file:
+                result_file.close()
+
+        finish_task(task, summary, examples_run, elapsed)
+
+
+def enqueue_tasks(queue: WorkQueue, tasks: List[Dict[str, Any]], prefix_ordering: bool = True) -> None:
+    """Load the entries of all tasks into the work queue (entries already queued are kept as they are).
+
+    With ``prefix_ordering``, entries that share a context are queued next to
+    each other so that they tend to be leased by the same worker.
+    """
+    for task in tasks:
+        task_data = load_task(task)
+        if task_data is None:
+            continue
+
+        task_data = list(task_data)
+        positions = {id(entry): position for position, entry in enumerate(task_data)}
+        if prefix_ordering:
+            task_data = [entry for group in group_by_prompt_prefix(task_data) for entry in group]
+
+        added = queue.enqueue(
+            task["category"], 
+            task["task_instance"].task_name, 
+            [(positions[id(entry)], entry) for entry in task_data if entry.get("prompt")],
+        )
+        logger.info(f"Queued {added} new entries of '{task['task_instance'].task_name}' ({len(task_data)} in the task)")
+
+
+async def arun_queue_worker(
+    queue: WorkQueue, 
+    llm_api: Any, 
+    tasks: List[Dict[str, Any]], 
+    worker_id: str,
+    concurrency: int = 8,
+    batch_size: Optional[int] = None,
+    lease_seconds: float = 600,
+    poll_interval: float = 5,
+) -> int:
+    """Lease entries from the work queue, run them and ack their results until the queue is drained.
+
+    Up to ``concurrency`` requests are in flight; a new batch of ``batch_size``
+    entries is leased whenever the previous one has been handed out. The
+    worker renews its leases every third of ``lease_seconds`` while it runs,
+    so long requests are not handed to another worker. Entries still leased
+    when the worker stops are released back to the queue. Queue operations
+    run in a thread, so waiting on the queue's file lock does not stall the
+    requests in flight. An entry whose request or ack raises is logged and
+    acked as failed (retried up to the queue's ``max_attempts``) without
+    stopping the worker.
+
+    Args:
+        queue: Shared work queue filled by the coordinator.
+        llm_api: LLM API instance to use for inference.
+        tasks: Tasks returned by collect_tasks, used to look up the metrics of each entry.
+        worker_id: Name of this worker, recorded with its leases.
+        concurrency: Maximum number of requests in flight.
+        batch_size: Number of entries leased at a time (defaults to ``concurrency``).
+        lease_seconds: Seconds after which an entry that was neither renewed nor acked is handed to another worker.
+        poll_interval: Seconds to wait before asking again when other workers hold all remaining entries.
+
+    Returns:
+        Number of results recorded by the queue for this worker.
+    """
+    metrics = {
+        (task["category"], task["task_instance"].task_name): task["task_instance"].metrics
+        for task in tasks
+    }
+    batch_size = batch_size or concurrency
+    leased = []
+    in_flight = set()
+    acked = 0
+
+    # Only bounds hedged duplicates: at most ``concurrency`` items run at once
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_item(item: Tuple[str, str, str, Dict[str, Any]]) -> bool:
+        key, category, task_name, entry = item
+        try:
+            async with semaphore:
+                metadata = await acall_llm(
+                    llm_api, entry["prompt"], entry.get("max_new_tokens"), get_hedge_key(task_name, entry), semaphore
+                )
+            result = build_result(entry, metadata["generation"], metrics.get((category, task_name)), metadata)
+            return await asyncio.to_thread(queue.ack, key, worker_id, result)
+        except Exception as e:
+            logger.error(f"Failed to run {key}: {e}")
+
+        # Count the attempt, so that an entry that always fails is eventually recorded as failed
+        try:
+            return await asyncio.to_thread(queue.ack, key, worker_id, build_result(entry, None))
+        except Exception as e:
+            logger.error(f"Failed to ack {key} as failed: {e}")
+            return False
+
+    async def heartbeat() -> None:
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            try:
+                await asyncio.to_thread(queue.renew, worker_id, lease_seconds)
+            except Exception as e:
+                logger.warning(f"Failed to renew the leases of {worker_id}: {e}")
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        while True:
+            if not leased and len(in_flight) < concurrency:
+                leased = await asyncio.to_thread(queue.lease, worker_id, batch_size, lease_seconds)
+
+            while leased and len(in_flight) < concurrency:
+                in_flight.add(asyncio.create_task(run_item(leased.pop(0))))
+
+            if in_flight:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                acked += sum(finished.result() for finished in done)
+                continue
+
+            if await asyncio.to_thread(queue.is_drained):
+                break
+
+            stats = await asyncio.to_thread(queue.get_stats)
+            logger.info(f"Waiting for entries leased by other workers: {stats['leases_by_worker']}")
+            await asyncio.sleep(poll_interval)
+    finally:
+        heartbeat_task.cancel()
+        for pending in in_flight:
+            pending.cancel()
+        await asyncio.to_thread(queue.release, worker_id)
+        if hasattr(llm_api, "aclose"):
+            await llm_api.aclose()
+
+    return acked
+
+
+def export_queue_results(queue: WorkQueue, tasks: List[Dict[str, Any]], summary: Dict[str, Any]) -> None:
+    """Write the results acked to the work queue to the usual result files and add them to the summary.
+
+    Results are written in task file order; entries without a result yet are
+    counted as not completed.
+    """
+    for task in tasks:
+        items = queue.get_items(task["category"], task["task_instance"].task_name)
+        if not items:
+            continue
+
+        completed = 0
+        leaders = set()
+        result_file = open_result_file(task["result_file_path"])
+        try:
+            for entry, result in items:
+                if result is None:
+                    continue
+
+                prefix_key = get_prompt_prefix_key(entry["prompt"])
+                task["stats"].add(result, prefix_leader=prefix_key not in leaders, context_length=entry.get("context_length"))
+                leaders.add(prefix_key)
+
+                result_file.write(slim_result(result, task["task_file_hash"]) if task["task_file_hash"] else result)
+                if result.get("generation") is not None:
+                    completed += 1
+        finally:
+            result_file.close()
+
+        update_summary(summary, task["category"], len(items), completed)
+        add_task_stats(summary, task)
+
+
+def run_queue_coordinator(
+    task_dir: str,
+    result_dir: str,
+    model_name: str,
+    queue_path: str,
+    task_category: Optional[str] = None,
+    task_name: Optional[str] = None,
+    prefix_ordering: bool = True,
+    poll_interval: float = 30,
+    result_format: str = "full",
+) -> Dict[str, Any]:
+    """Fill the work queue, wait for the workers to drain it and export the results.
+
+    Re-running the coordinator on an existing queue keeps the results already
+    acked, so it can be restarted at any time.
+
+    Returns:
+        Dictionary with summary of test results.
+    """
+    model_result_dir = os.path.join(result_dir, model_name)
+    tasks = collect_tasks(
+        task_dir, model_result_dir, get_categories_to_run(task_category), task_name, result_format=result_format
+    )
+
+    queue = WorkQueue(queue_path)
+    queue.set_meta("model_name", model_name)
+    enqueue_tasks(queue, tasks, prefix_ordering=prefix_ordering)
+
+    summary = init_summary(model_name, tasks, mode="queue", prefix_ordering=prefix_ordering, result_format=result_format)
+    try:
+        while not queue.is_drained():
+            stats = queue.get_stats()
+            logger.info(f"Queue: {stats['done']}/{stats['total']} done, {stats['leased']} leased by {len(stats['leases_by_worker'])} workers, {stats['pending']} pending")
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        summary["interrupted"] = True
+        logger.warning("Interrupted: exporting the results acked so far. Re-run the coordinator to continue.")
+
+    export_queue_results(queue, tasks, summary)
+    summary["queue"] = queue.get_stats()
+    queue.close()
+
+    summary_path = save_summary(summary, model_result_dir, None)
+    logger.info(f"Testing complete: {summary['examples_completed']}/{summary['examples_total']} examples across {summary['tasks_run']} tasks")
+    logger.info(f"Summary saved to {summary_path}")
+
+    return summary
+
+
+def run_queue_worker(
+    task_dir: str,
+    result_dir: str,
+    llm_api: Any,
+    model_name: str,
+    queue_path: str,
+    concurrency: int = 8,
+    batch_size: Optional[int] = None,
+    lease_seconds: float = 600,
+) -> int:
+    """Run entries from a work queue filled by run_queue_coordinator until it is drained.
+
+    Any number of workers (on any number of hosts sharing the queue file on a
+    filesystem with working POSIX locks, see WorkQueue) can be started or
+    stopped while the queue is being processed.
+
+    Returns:
+        Number of results acked by this worker.
+    """
+    queue = WorkQueue(queue_path)
+    queued_model_name = queue.get_meta("model_name")
+    if queued_model_name and queued_model_name != model_name:
+        logger.warning(f"Queue {queue_path} was filled for {queued_model_name}, running it with {model_name}")
+
+    model_result_dir = os.path.join(result_dir, model_name)
+    tasks = collect_tasks(task_dir, model_result_dir, get_categories_to_run())
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+    start_time = time.time()
+    try:
+        acked = asyncio.run(arun_queue_worker(
+            queue, 
+            llm_api, 
+            tasks, 
+            worker_id, 
+            concurrency=concurrency, 
+            batch_size=batch_size, 
+            lease_seconds=lease_seconds,
+        ))
+    finally:
+        queue.close()
+
+    logger.info(f"Worker {worker_id} acked {acked} results in {time.time() - start_time:.2f}s")
+    return acked
+
+
+def save_summary(summary: Dict[str, Any], model_result_dir: str, llm_api: Any) -> str:
+    """Finalize the run summary and write it to summary.json.
+
+    Returns:
+        Path of the written summary.
+    """
+    rate_limiter = getattr(llm_api, "rate_limiter", None)
+    if rate_limiter:
+        summary["rate_limit"] = rate_limiter.get_stats()
+
+    response_cache = getattr(llm_api, "response_cache", None)
+    if response_cache:
+        summary["response_cache"] = response_cache.get_stats()
+
+    if isinstance(llm_api, Pooled_LLM_API):
+        summary["deployments"] = llm_api.get_stats()
+
+    hedger = getattr(llm_api, "hedger", None)
+    if hedger:
+        summary["hedging"] = hedger.get_stats()
+
+    summary["end_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    summary["duration_seconds"] = time.time() - time.mktime(time.strptime(summary["start_time"], "%Y-%m-%d %H:%M:%S"))
+    
+    summary_path = os.path.join(model_result_dir, f"summary{get_shard_suffix(summary.get('shard'))}.json")
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    return summary_path
+
+
+def init_summary(
+    model_name: str,
+    tasks: List[Dict[str, Any]],
+    mode: str = "sync",
+    concurrency: int = 8,
+    resume: bool = False,
+    prefix_ordering: bool = True,
+    shard: Optional[Tuple[int, int]] = None,
+    result_format: str = "full",
+) -> Dict[str, Any]:
+    """Create the run summary of a model, with an empty entry per category to run."""
+    summary = {
+        "model": model_name,
+        "mode": mode,
+        "resume": resume,
+        "prefix_ordering": prefix_ordering,
+        "tasks_run": 0,
+        "examples_total": 0,
+        "examples_completed": 0,
+        "examples_resumed": 0,
+        "categories": {},
+        "start_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if mode == "async":
+        summary["concurrency"] = concurrency
+    if shard:
+        summary["shard"] = list(shard)
+    if result_format != "full":
+        summary["result_format"] = result_format
+
+    for task in tasks:
+        summary["categories"].setdefault(
+            task["category"], 
+            {"tasks_run": 0, "examples_total": 0, "examples_completed": 0, "examples_resumed": 0},
+        )
+
+    return summary
+
+
+def get_categories_to_run(task_category: Optional[str] = None) -> List[str]:
+    return [
+        category for category in TASK_CLASSES.keys() 
+        if not task_category or category == task_category
+    ]
+
+
+# Entry fields that are not variables of the task
+ENTRY_FIELDS = {"id", "prompt", "reference", "task", "category"}
+
+
+def get_stratum(task: Dict[str, Any], entry: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Task and variable values of an entry, used to stratify budget selections."""
+    variables = [name for name in task["task_instance"].variables if name in entry]
+    if not variables:
+        variables = sorted(name for name in entry if name not in ENTRY_FIELDS)
+
+    task_key = f"{task['category']}/{task['task_instance'].task_name}"
+    return (task_key,) + tuple((name, json.dumps(entry[name])) for name in variables)
+
+
+def estimate_entries(
+    tasks: List[Dict[str, Any]], 
+    counter: TokenCounter, 
+    resume: bool = False, 
+    prefix_ordering: bool = True,
 ) -> List[Dict[str, Any]]:
-    """Run a memory test using the provided task data and LLM API.
-    
+    """Token estimates of the entries the tasks would run, in the order they would be sent.
+
+    Output tokens are estimated from the length of the reference answer.
+    """
+    entries = []
+    for task in tasks:
+        if not os.path.exists(task["task_data_path"]):
+            continue
+
+        task_data = load_task_data(task["task_data_path"])
+        counts = counter.count_task(task["task_data_path"], task_data, PROMPT_PREFIX_DELIMITER)
+        positions = {id(entry): position for position, entry in enumerate(task_data)}
+
+        # Estimates must not rewrite the result files of the run they are made for
+        to_run = load_task(task, resume=resume, task_data=task_data, read_only=True)
+        if to_run is None:
+            continue
+        if prefix_ordering:
+            to_run = [entry for group in group_by_prompt_prefix(to_run) for entry in group]
+
+        for entry in to_run:
+            if not entry.get("prompt"):
+                continue
+
+            position = positions[id(entry)]
+            entries.append({
+                "task": f"{task['category']}/{task['task_instance'].task_name}",
+                "id": entry.get("id"),
+                "prefix_key": get_prompt_prefix_key(entry["prompt"]),
+                "prompt_tokens": counts["prompt"][position],
+                "prefix_tokens": counts["prefix"][position],
+                "output_tokens": min(counts["reference"][position], entry["max_new_tokens"]),
+                "stratum": get_stratum(task, entry),
+            })
+
+    return entries
+
+
+def get_quota(config: Dict[str, Any]) -> Tuple[Optional[float], Optional[float]]:
+    """Requests and tokens per minute available to a model, summed over its deployments (None if unlimited)."""
+    deployments = config.get("deployments") or [{}]
+    quota = []
+    for key in ["requests_per_minute", "tokens_per_minute"]:
+        limits = [deployment.get(key, config.get(key)) for deployment in deployments]
+        quota.append(sum(limits) if all(limits) else None)
+    return quota[0], quota[1]
+
+
+def estimate_run(
+    tasks: List[Dict[str, Any]],
+    models: List[Dict[str, Any]],
+    result_dir: str,
+    resume: bool = False,
+    prefix_ordering: bool = True,
+    budget: Optional[float] = None,
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Set[Any]]]]:
+    """Project the tokens, cost and rate-limited duration of a run without sending any request.
+
+    Token counts are cached in ``result_dir/token_counts.json`` and the
+    estimate is written to ``result_dir/estimate.json``.
+
     Args:
-        task_data: List of task data entries.
-        llm_api: Instance of the LLM API to use for inference.
-        metrics: List of metrics to evaluate the results.
-        result_file_path: Path to save the results.
-        max_retries: Maximum number of retries for failed API calls.
-        
+        tasks: Tasks returned by collect_tasks.
+        models: List of {"model_name", "config"} dictionaries the entries will be sent to.
+        result_dir: Directory to save the estimate and the token count cache.
+        resume: Only count entries missing from the result files.
+        prefix_ordering: Entries sharing a context are sent back-to-back and
+            all but the first are served from the provider's prompt cache.
+        budget: Optional maximum cost. The largest subset of entries that fits,
+            stratified by task and variable values, is selected.
+
     Returns:
-        List of results from the test.
+        The estimate, and the ids of the selected entries keyed by
+        "<category>/<task_name>" (None without a budget).
+
+    Raises:
+        ValueError: If a budget is given but a model has no price.
     """
-    results = []
-    
-    # Create the directory if it doesn't exist
-    if result_file_path:
-        os.makedirs(os.path.dirname(os.path.abspath(result_file_path)), exist_ok=True)
-        result_file = open(result_file_path, 'w')
-    else:
-        result_file = None
+    start_time = time.time()
+    counter = TokenCounter(os.path.join(result_dir, "token_counts.json"))
+    entries = estimate_entries(tasks, counter, resume=resume, prefix_ordering=prefix_ordering)
+    counter.save()
 
-    try:
-        for entry in tqdm(task_data, desc="Processing entries"):
-            entry_id = entry.get('id', 'unknown')
-            try:
-                prompt = entry.get("prompt", "")
-                if not prompt:
-                    logger.warning(f"No prompt found for entry {entry_id}. Skipping.")
-                    break
+    prices = [model["config"].get("prices", {}).get(model["model_name"]) for model in models]
+    estimate = {
+        "examples": len(entries),
+        "prefix_ordering": prefix_ordering,
+        "models": {
+            model["model_name"]: summarize_estimate(entries, [price], get_quota(model["config"]), prefix_ordering)
+            for model, price in zip(models, prices)
+        },
+        "estimate_seconds": time.time() - start_time,
+    }
 
-                generation = llm_api.generate(prompt)
+    selection = None
+    if budget is not None:
+        if any(price is None for price in prices):
+            raise ValueError("--budget needs a price for every model in the prices table of the API configuration")
 
-                result = entry.copy()
-                result["generation"] = generation
-                result["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        selected = select_within_budget(entries, budget, prices, prefix_ordering)
+        selection = {}
+        for entry in selected:
+            selection.setdefault(entry["task"], set()).add(entry["id"])
 
-                if metrics:
-                    result["scores"] = {}
-                    for metric in metrics:
-                        score = evaluate_generation(
-                            generation, 
-                            entry.get("reference", ""), 
-                            metrics=[metric]
-                        )
-                        result["scores"][metric] = score
+        estimate["budget"] = {
+            "budget": budget,
+            "examples_selected": len(selected),
+            "strata": len({entry["stratum"] for entry in entries}),
+            "strata_selected": len({entry["stratum"] for entry in selected}),
+            "models": {
+                model["model_name"]: summarize_estimate(selected, [price], get_quota(model["config"]), prefix_ordering)
+                for model, price in zip(models, prices)
+            },
+        }
 
-                results.append(result)
-                if result_file:
-                    result_file.write(json.dumps(result) + "\n")
-                    result_file.flush()
-                    
-            except Exception as e:
-                logger.error(f"Error processing entry {entry_id}: {e}")
+    os.makedirs(result_dir, exist_ok=True)
+    estimate_path = os.path.join(result_dir, "estimate.json")
+    with open(estimate_path, 'w') as f:
+        json.dump(estimate, f, indent=2)
 
-    
-    finally:
-        if result_file:
-            result_file.close()
-    
-    return results
+    for model_name, model_estimate in estimate["models"].items():
+        for task_key, task_estimate in model_estimate["tasks"].items():
+            logger.info(f"{model_name} {task_key}: {task_estimate['requests']} requests, {task_estimate['prompt_tokens']} prompt tokens, {task_estimate['completion_tokens']} completion tokens, cost {task_estimate['cost']}")
+        logger.info(f"{model_name}: {model_estimate['requests']} requests, {model_estimate['prompt_tokens']} prompt tokens ({model_estimate['cached_tokens']} cached), {model_estimate['completion_tokens']} completion tokens, cost {model_estimate['cost']}, at least {model_estimate['rate_limited_minutes']} minutes under the rate limits")
+
+    if budget is not None:
+        logger.info(f"Budget {budget}: selected {len(selected)}/{len(entries)} examples covering {estimate['budget']['strata_selected']}/{estimate['budget']['strata']} strata")
+    logger.info(f"Estimate saved to {estimate_path} in {estimate['estimate_seconds']:.2f}s")
+
+    return estimate, selection
 
 
 def run_memory_tests(
@@ -135,10 +1439,23 @@ def run_memory_tests(
     llm_api: Any, 
     model_name: str, 
     task_category: Optional[str] = None, 
-    task_name: Optional[str] = None
+    task_name: Optional[str] = None,
+    mode: str = "sync",
+    concurrency: int = 8,
+    resume: bool = False,
+    prefix_ordering: bool = True,
+    batch_options: Optional[Dict[str, Any]] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    selection: Optional[Dict[str, Set[Any]]] = None,
+    result_format: str = "full",
 ) -> Dict[str, Any]:
     """Run LLM memory tests and save results.
 
+    If the run is interrupted (e.g. with Ctrl-C), the results written so far are
+    kept and a partial summary marked ``"interrupted": true`` is saved before
+    KeyboardInterrupt is re-raised. Re-running with ``resume`` then only sends
+    the entries that are missing or failed.
+
     Args:
         task_dir: Directory containing the test data.
         result_dir: Directory to save the test results.
@@ -146,6 +1463,23 @@ def run_memory_tests(
         model_name: Name of the model being tested.
         task_category: Optional category of tasks to run.
         task_name: Optional specific task to run.
+        mode: "sync" to send one request at a time, "async" to run all tasks
+            concurrently with up to ``concurrency`` requests in flight, "batch"
+            to submit all entries through the provider's batch API.
+        concurrency: Maximum number of requests in flight in async mode.
+        resume: Skip entries that already have a successful result and append
+            to the existing result files.
+        prefix_ordering: Send entries whose prompts share a context back-to-back
+            so that provider-side prompt caching can serve them.
+        batch_options: Keyword arguments of run_batch_tasks (size limits, poll
+            interval, price factor) in batch mode.
+        shard: Optional (shard index, number of shards). Only the entries whose
+            id hashes to this shard are run, and results go to shard-suffixed
+            files to be combined with merge_results.py.
+        selection: Optional ids of the entries to run per task, as returned by
+            estimate_run() for a budget.
+        result_format: "full" to copy each entry into its result record,
+            "slim" to only reference it (load slim results with result_loader).
         
     Returns:
         Dictionary with summary of test results.
@@ -153,104 +1487,64 @@ def run_memory_tests(
     model_result_dir = os.path.join(result_dir, model_name)
     os.makedirs(model_result_dir, exist_ok=True)
     
-    # Track overall statistics
-    summary = {
-        "model": model_name,
-        "tasks_run": 0,
-        "examples_total": 0,
-        "examples_completed": 0,
-        "categories": {},
-        "start_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-    }
-    
     # Find all available categories
-    categories_to_run = []
-    for category in TASK_CLASSES.keys():
-        if not task_category or category == task_category:
-            categories_to_run.append(category)
+    categories_to_run = get_categories_to_run(task_category)
     
     if task_category and not categories_to_run:
         logger.error(f"Task category '{task_category}' not found")
-        return summary
-        
-    # Run tests for each category
-    for category in categories_to_run:
-        category_dir = os.path.join(task_dir, category)
-        if not os.path.exists(category_dir):
-            logger.warning(f"Category directory not found: {category_dir}")
-            continue
-            
-        category_result_dir = os.path.join(model_result_dir, category)
-        os.makedirs(category_result_dir, exist_ok=True)
-        
-        category_summary = {"tasks_run": 0, "examples_total": 0, "examples_completed": 0}
-        summary["categories"][category] = category_summary
+        return init_summary(model_name, [], mode, concurrency, resume, prefix_ordering, shard)
 
-        # Get all task instances for this category
-        task_instances = []
-        for task_class_info in TASK_CLASSES[category]:
-            try:
-                if isinstance(task_class_info, dict):
-                    task_class = task_class_info["class"]
-                    params = task_class_info["params"]
-                    task_instance = task_class(**params)
-                else:
-                    task_class = task_class_info
-                    task_instance = task_class()
-                    
-                # Filter by task name if specified
-                if task_name and task_instance.task_name != task_name:
-                    continue
-                    
-                task_instances.append(task_instance)
-            except Exception as e:
-                logger.error(f"Error instantiating task {task_class.__name__}: {e}")
-        
-        # Run each task
-        for task_instance in task_instances:
-            logger.info(f"Running task: {task_instance.task_name}")
-            
-            task_data_path = os.path.join(category_dir, f"{task_instance.task_name}.jsonl")
-            if not os.path.exists(task_data_path):
-                logger.warning(f"Data file not found: {task_data_path}. Skipping.")
-                continue
-                
-            # Load task data
-            task_data = load_task_data(task_data_path)
-            if not task_data:
-                logger.warning(f"No data loaded for task: {task_instance.task_name}. Skipping.")
-                continue
+    tasks = collect_tasks(task_dir, model_result_dir, categories_to_run, task_name, shard, selection, result_format)
 
-            # Run the test
-            result_file_path = os.path.join(category_result_dir, f"{task_instance.task_name}_results.jsonl")
-            start_time = time.time()
-            
-            results = run_test(
-                task_data, 
+    # Track overall statistics
+    summary = init_summary(model_name, tasks, mode, concurrency, resume, prefix_ordering, shard, result_format)
+
+    try:
+        if mode == "async":
+            asyncio.run(arun_tasks(tasks, llm_api, summary, concurrency=concurrency, resume=resume, prefix_ordering=prefix_ordering))
+        elif mode == "batch":
+            run_batch_tasks(
+                tasks, 
                 llm_api, 
-                metrics=task_instance.metrics, 
-                result_file_path=result_file_path
+                summary, 
+                batch_dir=os.path.join(model_result_dir, f"batches{get_shard_suffix(shard)}"),
+                resume=resume, 
+                prefix_ordering=prefix_ordering,
+                **(batch_options or {}),
             )
-            
-            elapsed = time.time() - start_time
-            logger.info(f"Completed {len(results)}/{len(task_data)} examples for '{task_instance.task_name}' in {elapsed:.2f}s")
-            
-            # Update statistics
-            summary["tasks_run"] += 1
-            summary["examples_total"] += len(task_data)
-            summary["examples_completed"] += len(results)
-            
-            category_summary["tasks_run"] += 1
-            category_summary["examples_total"] += len(task_data)
-            category_summary["examples_completed"] += len(results)
+        else:
+            # Run each task
+            for task in tasks:
+                task_data = load_task(task, resume=resume)
+                if task_data is None:
+                    continue
+
+                # Run the test
+                start_time = time.time()
+                
+                examples_run = run_test(
+                    task_data, 
+                    llm_api, 
+                    metrics=task["task_instance"].metrics, 
+                    result_file_path=task["result_file_path"],
+                    append=resume,
+                    stats=task["stats"],
+                    prefix_ordering=prefix_ordering,
+                    task_file_hash=task["task_file_hash"],
+                )
+                
+                # Update statistics
+                finish_task(task, summary, examples_run, time.time() - start_time)
+
+    except KeyboardInterrupt:
+        summary["interrupted"] = True
+        add_unfinished_tasks(summary, tasks)
+        summary_path = save_summary(summary, model_result_dir, llm_api)
+        logger.warning(f"Interrupted: partial summary saved to {summary_path}. Re-run with --resume to continue.")
+        raise
     
     # Save summary
-    summary["end_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
-    summary["duration_seconds"] = time.time() - time.mktime(time.strptime(summary["start_time"], "%Y-%m-%d %H:%M:%S"))
-    
-    summary_path = os.path.join(model_result_dir, "summary.json")
-    with open(summary_path, 'w') as f:
-        json.dump(summary, f, indent=2)
+    summary_path = save_summary(summary, model_result_dir, llm_api)
     
     logger.info(f"Testing complete: {summary['examples_completed']}/{summary['examples_total']} examples across {summary['tasks_run']} tasks")
     logger.info(f"Summary saved to {summary_path}")
@@ -258,6 +1552,426 @@ def run_memory_tests(
     return summary
 
 
+async def arun_sweep(
+    models: List[Dict[str, Any]], 
+    resume: bool = False, 
+    prefix_ordering: bool = True,
+) -> None:
+    """Run the tasks of several models concurrently, reading each task file once.
+
+    Each model has its own budget of in-flight requests, so the sweep takes
+    about as long as its slowest model. Task files are streamed: every entry
+    is parsed once and handed to each model through a bounded queue, so a
+    model can only run ahead of the others by a few batches of entries.
+
+    Args:
+        models: Models prepared by run_model_sweep, each with its llm_api,
+            concurrency, summary and tasks (aligned across models).
+        resume: Skip entries already present in the result files.
+        prefix_ordering: Send entries that share a context back-to-back.
+    """
+    for model in models:
+        model["semaphore"] = asyncio.Semaphore(model["concurrency"])
+
+    async def read_feed(feed: asyncio.Queue) -> AsyncIterator[Dict[str, Any]]:
+        while True:
+            entry = await feed.get()
+            if entry is None:
+                return
+            yield entry
+
+    async def run_model_task(model: Dict[str, Any], task: Dict[str, Any], task_data: AsyncIterable[Dict[str, Any]]) -> None:
+        start_time = time.time()
+        examples_run = await arun_test(
+            task_data,
+            model["llm_api"],
+            metrics=task["task_instance"].metrics,
+            result_file_path=task["result_file_path"],
+            concurrency=model["concurrency"],
+            semaphore=model["semaphore"],
+            append=resume,
+            stats=task["stats"],
+            prefix_ordering=prefix_ordering,
+            hedge_key=task["task_instance"].task_name,
+            task_file_hash=task["task_file_hash"],
+        )
+
+        finish_task(task, model["summary"], examples_run, time.time() - start_time)
+
+    async def run_shared_task(index: int) -> None:
+        task_data_path = models[0]["tasks"][index]["task_data_path"]
+        if not os.path.exists(task_data_path):
+            logger.warning(f"Data file not found: {task_data_path}. Skipping.")
+            return
+
+        logger.info(f"Running task: {models[0]['tasks'][index]['task_instance'].task_name}")
+        feeds = []
+        model_tasks = []
+        for model in models:
+            task = model["tasks"][index]
+            feed = asyncio.Queue(maxsize=model["concurrency"])
+            feeds.append((prepare_task(task, resume=resume), feed))
+            model_tasks.append(run_model_task(model, task, read_feed(feed)))
+
+        async def read_task_data() -> None:
+            for entry in iter_task_data(task_data_path):
+                for select, feed in feeds:
+                    if select(entry) is not None:
+                        await feed.put(entry)
+            for _, feed in feeds:
+                await feed.put(None)
+
+        await asyncio.gather(read_task_data(), *model_tasks)
+
+    try:
+        await asyncio.gather(*(run_shared_task(index) for index in range(len(models[0]["tasks"]))))
+    finally:
+        for model in models:
+            if hasattr(model["llm_api"], "aclose"):
+                await model["llm_api"].aclose()
+
+
+def run_model_sweep(
+    task_dir: str, 
+    result_dir: str, 
+    models: List[Dict[str, Any]], 
+    task_category: Optional[str] = None, 
+    task_name: Optional[str] = None,
+    resume: bool = False,
+    prefix_ordering: bool = True,
+    shard: Optional[Tuple[int, int]] = None,
+    selection: Optional[Dict[str, Set[Any]]] = None,
+    result_format: str = "full",
+) -> Dict[str, Any]:
+    """Run the memory tests against several models at once.
+
+    Task files are read once and their entries sent to all models
+    concurrently. Results and summary.json of each model go to
+    ``result_dir/<model_name>/`` as in run_memory_tests, and a combined
+    summary is written to ``result_dir/sweep_summary.json``.
+
+    Args:
+        task_dir: Directory containing the test data.
+        result_dir: Directory to save the test results.
+        models: List of {"model_name", "llm_api", "concurrency"} dictionaries.
+        task_category: Optional category of tasks to run.
+        task_name: Optional specific task to run.
+        resume: Skip entries that already have a successful result.
+        prefix_ordering: Send entries that share a context back-to-back.
+        shard: Optional (shard index, number of shards) to run.
+        selection: Optional ids of the entries to run per task.
+        result_format: "full" or "slim" result records (see run_memory_tests).
+
+    Returns:
+        Combined summary with the summary of each model.
+    """
+    categories_to_run = get_categories_to_run(task_category)
+    if task_category and not categories_to_run:
+        logger.error(f"Task category '{task_category}' not found")
+        return {"models": {}}
+
+    sweep_summary = {
+        "models": {},
+        "start_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    start_time = time.time()
+
+    for model in models:
+        model["model_result_dir"] = os.path.join(result_dir, model["model_name"])
+        os.makedirs(model["model_result_dir"], exist_ok=True)
+        model["tasks"] = collect_tasks(
+            task_dir, model["model_result_dir"], categories_to_run, task_name, shard, selection, result_format
+        )
+        model["summary"] = init_summary(
+            model["model_name"], model["tasks"], "async", model["concurrency"], resume, prefix_ordering, shard, result_format
+        )
+
+    def save_summaries() -> str:
+        for model in models:
+            save_summary(model["summary"], model["model_result_dir"], model["llm_api"])
+            sweep_summary["models"][model["model_name"]] = model["summary"]
+
+        sweep_summary["end_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        sweep_summary["duration_seconds"] = time.time() - start_time
+
+        sweep_summary_path = os.path.join(result_dir, f"sweep_summary{get_shard_suffix(shard)}.json")
+        with open(sweep_summary_path, 'w') as f:
+            json.dump(sweep_summary, f, indent=2)
+        return sweep_summary_path
+
+    try:
+        asyncio.run(arun_sweep(models, resume=resume, prefix_ordering=prefix_ordering))
+
+    except KeyboardInterrupt:
+        sweep_summary["interrupted"] = True
+        for model in models:
+            model["summary"]["interrupted"] = True
+            add_unfinished_tasks(model["summary"], model["tasks"])
+        sweep_summary_path = save_summaries()
+        logger.warning(f"Interrupted: partial summaries saved to {sweep_summary_path}. Re-run with --resume to continue.")
+        raise
+
+    sweep_summary_path = save_summaries()
+    for model in models:
+        summary = model["summary"]
+        logger.info(f"{model['model_name']}: {summary['examples_completed']}/{summary['examples_total']} examples across {summary['tasks_run']} tasks")
+    logger.info(f"Sweep summary saved to {sweep_summary_path}")
+
+    return sweep_summary
+
+
+def create_rate_limiter(config: Dict[str, Any]) -> Optional[RateLimiter]:
+    """Create a rate limiter if a deployment quota is configured."""
+    if not (config.get("requests_per_minute") or config.get("tokens_per_minute")):
+        return None
+
+    return RateLimiter(
+        requests_per_minute=config.get("requests_per_minute"),
+        tokens_per_minute=config.get("tokens_per_minute"),
+    )
+
+
+def create_hedger(config: Dict[str, Any]) -> Optional[Hedger]:
+    """Create a hedger if a hedge budget is configured."""
+    if not config.get("hedge_budget"):
+        return None
+
+    return Hedger(
+        budget=config["hedge_budget"],
+        quantile=config.get("hedge_quantile", 95),
+        min_samples=config.get("hedge_min_samples", 20),
+    )
+
+
+def create_llm_api(
+    config: Dict[str, Any], 
+    model_name: str, 
+    response_cache: Optional[ResponseCache] = None,
+    concurrency: int = 8,
+) -> Any:
+    """Create the LLM API described by an API configuration.
+
+    The ``backend`` key selects the implementation (see inference.BACKENDS).
+    If the configuration lists ``deployments``, requests are load-balanced
+    across them; each deployment inherits the top-level settings it does not
+    override and gets its own rate limiter.
+
+    Args:
+        config: Parsed API configuration.
+        model_name: Name of the model (deployment) to use when not overridden.
+        response_cache: Optional response cache shared by all deployments.
+        concurrency: Maximum number of requests in flight, used to size connection pools.
+
+    Returns:
+        LLM API instance.
+    """
+    deployments = config.get("deployments")
+    if not deployments:
+        llm_api = create_backend(
+            config,
+            model_name,
+            rate_limiter=create_rate_limiter(config),
+            response_cache=response_cache,
+            max_connections=concurrency,
+        )
+        llm_api.hedger = create_hedger(config)
+        return llm_api
+
+    members, weights, names = [], [], []
+    for deployment in deployments:
+        deployment_config = {key: value for key, value in config.items() if key != "deployments"}
+        deployment_config.update(deployment)
+
+        deployment_model_name = deployment.get("model_name", model_name)
+        members.append(create_backend(
+            deployment_config,
+            deployment_model_name,
+            rate_limiter=create_rate_limiter(deployment_config),
+            response_cache=response_cache,
+            max_connections=concurrency,
+        ))
+        weights.append(deployment.get("weight", 1))
+        endpoint = deployment_config.get("endpoint") or deployment_config.get("base_url")
+        names.append(deployment.get("name", f"{endpoint}{deployment_model_name}"))
+
+    llm_api = Pooled_LLM_API(
+        members, 
+        weights=weights, 
+        names=names,
+        eject_seconds=config.get("eject_seconds", 30),
+    )
+    llm_api.hedger = create_hedger(config)
+    return llm_api
+
+
+def use_mock_backend(config: Dict[str, Any], mock_url: str) -> Dict[str, Any]:
+    """Point an API configuration (and all of its deployments) at the local mock server."""
+    config = dict(config)
+    config["endpoint"] = mock_url
+    config["base_url"] = f"{mock_url.rstrip('/')}/v1"
+    config["api_key"] = "mock"
+    config["api_version"] = config.get("api_version") or "2024-06-01"
+
+    # Deployments inherit the mock endpoint and key from the top level
+    if config.get("deployments"):
+        config["deployments"] = [
+            {key: value for key, value in deployment.items() if key not in ("endpoint", "base_url", "api_key")}
+            for deployment in config["deployments"]
+        ]
+
+    return config
+
+
+def load_api_config(path: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Load an API configuration and apply the command-line overrides (--backend, --stream, --hedge-budget)."""
+    with open(path, 'r') as f:
+        config = yaml.safe_load(f)
+
+    if args.backend == "mock":
+        config = use_mock_backend(config, args.mock_url)
+
+    if args.stream:
+        config["stream"] = True
+
+    if args.hedge_budget is not None:
+        config["hedge_budget"] = args.hedge_budget
+
+    return config
+
+
+def estimate_from_args(
+    args: argparse.Namespace, 
+    models: List[Dict[str, Any]], 
+    shard: Optional[Tuple[int, int]] = None,
+) -> Optional[Dict[str, Set[Any]]]:
+    """Handle --dry-run and --budget before any request is sent.
+
+    A dry run writes the estimate and exits. With --budget, the ids of the
+    entries that fit the budget are returned (with --resume, entries are
+    counted against the result files of the first model).
+    """
+    if not args.dry_run and args.budget is None:
+        return None
+
+    tasks = collect_tasks(
+        args.task_dir, 
+        os.path.join(args.result_dir, models[0]["model_name"]), 
+        get_categories_to_run(args.task_category), 
+        args.task_name, 
+        shard,
+    )
+    try:
+        _, selection = estimate_run(
+            tasks,
+            models,
+            args.result_dir,
+            resume=args.resume,
+            prefix_ordering=not args.no_prefix_ordering,
+            budget=args.budget,
+        )
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    if args.dry_run:
+        sys.exit(0)
+    return selection
+
+
+def create_response_cache(args: argparse.Namespace) -> Optional[ResponseCache]:
+    """Open the response cache selected by --cache-mode (None when it is off).
+
+    Opening the cache evicts stale entries, so it is only called once requests
+    are about to be sent, after a dry run has exited.
+    """
+    if args.cache_mode == "off":
+        return None
+
+    return ResponseCache(
+        args.cache_path or os.path.join(args.result_dir, "response_cache.sqlite"),
+        mode=args.cache_mode,
+        max_age_days=args.cache_max_age_days,
+        max_size_mb=args.cache_max_size_mb,
+    )
+
+
+def run_sweep_from_args(
+    args: argparse.Namespace, 
+    shard: Optional[Tuple[int, int]] = None,
+) -> None:
+    """Create the models listed in --models_config and run them as one sweep.
+
+    Each model entry names its ``model_name`` and may set ``llm_api_config``
+    (defaults to --llm_api_config), ``concurrency`` (defaults to
+    --concurrency) and any API configuration key to override.
+    """
+    try:
+        with open(args.models_config, 'r') as f:
+            model_specs = yaml.safe_load(f)["models"]
+    except Exception as e:
+        logger.error(f"Failed to load models configuration: {e}")
+        sys.exit(1)
+
+    models = []
+    try:
+        for spec in model_specs:
+            config = load_api_config(spec.get("llm_api_config", args.llm_api_config), args)
+            config.update({
+                key: value for key, value in spec.items() 
+                if key not in ("llm_api_config", "concurrency")
+            })
+
+            model_name = spec["model_name"]
+            if any(model["model_name"] == model_name for model in models):
+                raise ValueError(f"Model {model_name} is listed twice")
+
+            models.append({
+                "model_name": model_name,
+                "concurrency": spec.get("concurrency", args.concurrency),
+                "config": config,
+            })
+    except Exception as e:
+        logger.error(f"Failed to load API configurations: {e}")
+        sys.exit(1)
+
+    selection = estimate_from_args(args, models, shard)
+    response_cache = create_response_cache(args)
+
+    try:
+        for model in models:
+            model["llm_api"] = create_llm_api(
+                model["config"], 
+                model["model_name"], 
+                response_cache=response_cache, 
+                concurrency=model["concurrency"],
+            )
+    except Exception as e:
+        logger.error(f"Failed to initialize LLM APIs: {e}")
+        sys.exit(1)
+
+    try:
+        run_model_sweep(
+            task_dir=args.task_dir,
+            result_dir=args.result_dir,
+            models=models,
+            task_category=args.task_category,
+            task_name=args.task_name,
+            resume=args.resume,
+            prefix_ordering=not args.no_prefix_ordering,
+            shard=shard,
+            selection=selection,
+            result_format=args.result_format,
+        )
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except Exception as e:
+        logger.error(f"Sweep execution failed: {e}")
+        if "--debug" in sys.argv:
+            import traceback
+            traceback.print_exc()
+        sys.exit(1)
+
+
 def main():
     """Parse arguments and run the memory test suite."""
     parser = argparse.ArgumentParser(
@@ -272,14 +1986,70 @@ def main():
                         help="Name of the model being tested")
     parser.add_argument("--llm_api_config", type=str, default="src/azure_api_config.yaml", 
                         help="Path to API configuration YAML file")
+    parser.add_argument("--models_config", type=str,
+                        help="YAML file listing several models to evaluate concurrently in one sweep (overrides --model_name; always async, so --mode cannot be set)")
+    parser.add_argument("--shard-index", type=int, default=0,
+                        help="Index of the shard of entries to run (0 <= index < --num-shards)")
+    parser.add_argument("--num-shards", type=int, default=1,
+                        help="Split the entries into this many shards by a stable hash of their id; combine with src/merge_results.py")
     parser.add_argument("--task_category", type=str, 
                         help="Run only tasks in this category")
     parser.add_argument("--task_name", type=str, 
                         help="Run only this specific task")
+    parser.add_argument("--backend", type=str, choices=["azure", "mock"], default="azure",
+                        help="Send requests to Azure OpenAI or to the local mock server (src/mock_server.py)")
+    parser.add_argument("--mock_url", type=str, default="http://127.0.0.1:8000",
+                        help="Base URL of the mock server when --backend mock is used")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream completions to record time-to-first-token and decode rate")
+    parser.add_argument("--hedge-budget", type=float, default=None,
+                        help="Duplicate async requests slower than the p95 latency of their task and context length, for at most this fraction of requests (overrides hedge_budget of the API config, 0 disables)")
+    parser.add_argument("--mode", type=str, choices=["sync", "async", "batch", "queue"], default=None,
+                        help="Send requests one at a time (sync, the default), concurrently across all tasks (async), through the provider's batch API (batch) or from a shared work queue (queue)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Maximum number of requests in flight in async and queue mode")
+    parser.add_argument("--batch-max-requests", type=int, default=50000,
+                        help="Maximum number of requests per batch file in batch mode")
+    parser.add_argument("--batch-max-mb", type=float, default=190,
+                        help="Maximum size of a batch file in megabytes in batch mode")
+    parser.add_argument("--batch-poll-interval", type=float, default=30,
+                        help="Seconds between two polls of the batch status in batch mode")
+    parser.add_argument("--queue", type=str,
+                        help="Path of the shared work queue in queue mode (defaults to <result_dir>/<model_name>/work_queue.sqlite)")
+    parser.add_argument("--queue-role", type=str, choices=["coordinator", "worker"], default="worker",
+                        help="In queue mode, fill the queue and export the results (coordinator) or run queued entries (worker)")
+    parser.add_argument("--queue-batch-size", type=int,
+                        help="Number of entries a worker leases at a time (defaults to --concurrency)")
+    parser.add_argument("--queue-lease-seconds", type=float, default=600,
+                        help="Seconds after which entries leased by a worker that stopped renewing them are re-queued")
+    parser.add_argument("--resume", action="store_true",
+                        help="Only run entries that are missing or failed in existing result files")
+    parser.add_argument("--result-format", type=str, choices=["full", "slim"], default="full",
+                        help="Copy each entry into its result record (full) or only reference it by id and task file hash (slim, read back with result_loader.py)")
+    parser.add_argument("--no-prefix-ordering", action="store_true",
+                        help="Send entries in file order instead of grouping entries that share a context")
+    parser.add_argument("--cache-mode", type=str, choices=CACHE_MODES, default="off",
+                        help="Use of the on-disk response cache (off by default, so every run queries the model)")
+    parser.add_argument("--cache-path", type=str,
+                        help="Path of the response cache (defaults to <result_dir>/response_cache.sqlite)")
+    parser.add_argument("--cache-max-age-days", type=float, default=30,
+                        help="Evict cached responses not used for this many days")
+    parser.add_argument("--cache-max-size-mb", type=float, default=2048,
+                        help="Evict least recently used cached responses above this size")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Estimate the tokens, cost and rate-limited duration of the run without sending requests, then exit")
+    parser.add_argument("--budget", type=float,
+                        help="Only run the largest subset of entries, stratified by task variables, whose estimated cost fits this budget")
     parser.add_argument("--list-tasks", action="store_true", 
                         help="List available task categories and names, then exit")
     args = parser.parse_args()
 
+    # Sweeps send the requests of all models concurrently, whatever the mode
+    if args.models_config and args.mode in ("sync", "batch"):
+        parser.error(f"--models_config runs every model asynchronously and cannot be combined with --mode {args.mode}")
+    if args.mode is None:
+        args.mode = "async" if args.models_config else "sync"
+
     # List all available tasks if requested
     if args.list_tasks:
         print("Available task categories and tasks:")
@@ -301,44 +2071,100 @@ def main():
         logger.error(f"Task directory not found: {args.task_dir}")
         sys.exit(1)
     
+    if args.num_shards < 1 or not 0 <= args.shard_index < args.num_shards:
+        logger.error(f"Invalid shard {args.shard_index} of {args.num_shards}")
+        sys.exit(1)
+    shard = (args.shard_index, args.num_shards) if args.num_shards > 1 else None
+
+    if args.mode == "queue":
+        if shard or args.models_config or args.dry_run or args.budget is not None:
+            logger.error("Queue mode cannot be combined with --num-shards, --models_config, --dry-run or --budget")
+            sys.exit(1)
+
+        queue_path = args.queue or os.path.join(args.result_dir, args.model_name, "work_queue.sqlite")
+        if args.queue_role == "coordinator":
+            try:
+                run_queue_coordinator(
+                    task_dir=args.task_dir,
+                    result_dir=args.result_dir,
+                    model_name=args.model_name,
+                    queue_path=queue_path,
+                    task_category=args.task_category,
+                    task_name=args.task_name,
+                    prefix_ordering=not args.no_prefix_ordering,
+                    result_format=args.result_format,
+                )
+            except Exception as e:
+                logger.error(f"Queue coordinator failed: {e}")
+                sys.exit(1)
+            return
+
+    if args.models_config:
+        run_sweep_from_args(args, shard)
+        return
+
     # Load API configuration
     if not os.path.exists(args.llm_api_config):
         logger.error(f"API configuration file not found: {args.llm_api_config}")
         sys.exit(1)
         
     try:
-        with open(args.llm_api_config, 'r') as f:
-            config = yaml.safe_load(f)
+        config = load_api_config(args.llm_api_config, args)
     except Exception as e:
         logger.error(f"Failed to load API configuration: {e}")
         sys.exit(1)
 
     # Use specified model name or fallback to config
     model_name = args.model_name or config.get("model_name", "gpt-4o")
-    
+
+    selection = estimate_from_args(args, [{"model_name": model_name, "config": config}], shard)
+    response_cache = create_response_cache(args)
+
     # Initialize the API
     try:
-        llm_api = Azure_LLM_API(
-            model_name=model_name, 
-            endpoint=config.get("endpoint"),
-            api_version=config.get("api_version"),
-            client_id=config.get("client_id"),
-            scope=config.get("scope")
-        )
+        llm_api = create_llm_api(config, model_name, response_cache=response_cache, concurrency=args.concurrency)
     except Exception as e:
         logger.error(f"Failed to initialize LLM API: {e}")
         sys.exit(1)
 
     # Run the tests
     try:
+        if args.mode == "queue":
+            run_queue_worker(
+                task_dir=args.task_dir,
+                result_dir=args.result_dir,
+                llm_api=llm_api,
+                model_name=model_name,
+                queue_path=queue_path,
+                concurrency=args.concurrency,
+                batch_size=args.queue_batch_size,
+                lease_seconds=args.queue_lease_seconds,
+            )
+            return
+
         run_memory_tests(
             task_dir=args.task_dir,
             result_dir=args.result_dir,
             llm_api=llm_api,
             model_name=model_name,
             task_category=args.task_category,
-            task_name=args.task_name
+            task_name=args.task_name,
+            mode=args.mode,
+            concurrency=args.concurrency,
+            resume=args.resume,
+            prefix_ordering=not args.no_prefix_ordering,
+            batch_options={
+                "max_requests": args.batch_max_requests,
+                "max_mb": args.batch_max_mb,
+                "poll_interval": args.batch_poll_interval,
+                "price_factor": config.get("batch_price_factor", 0.5),
+            },
+            shard=shard,
+            selection=selection,
+            result_format=args.result_format,
         )
+    except KeyboardInterrupt:
+        sys.exit(130)
     except Exception as e:
         logger.error(f"Test execution failed: {e}")
         if "--debug" in sys.argv:
@@ -7,14 +7,19 @@ providing standard interfaces and utilities for test generation.
 
 import logging
 import json
+import math
+import random
 from typing import Dict, List, Any, Optional, Union
-from uuid import uuid4
+from uuid import UUID
 
 from task.context_utils import ContextGenerator
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Completion budget of tasks that do not declare a smaller one (the default of inference.LLM_API)
+DEFAULT_MAX_NEW_TOKENS = 4096
+
 
 class Task:
     """Base class for all LLM memory evaluation tasks.
@@ -30,7 +35,11 @@ class Task:
         variables: Dictionary of parameters to vary across test samples.
         task_data: List of generated test entries.
         metrics: Dictionary of evaluation metrics for this task.
-        WORDS: List of common words for context generation.
+        output_budget: Policy for the completion budget of each entry: a fixed
+            cap ("max_new_tokens"), or a multiple of the reference length in
+            tokens ("reference_multiplier") plus "min_new_tokens", never above
+            "max_new_tokens".
+        WORDS: Vocabulary of common words for context generation (a read-only sequence).
         task_data_filepath: Path where task data should be saved.
     """
     
@@ -47,6 +56,8 @@ class Task:
 
         self.metrics: Dict[str, Any] = {}
 
+        self.output_budget: Dict[str, Any] = {"max_new_tokens": DEFAULT_MAX_NEW_TOKENS}
+
         # Access words list from ContextGenerator
         self.WORDS = ContextGenerator.WORDS
 
@@ -59,10 +70,45 @@ class Task:
     def create_entry_id(self) -> str:
         """Generate a unique ID for a test entry.
         
+        The ID is drawn from the random module, so that seeded generation
+        reproduces it.
+        
         Returns:
             A UUID string for the test entry.
         """
-        return str(uuid4())
+        return str(UUID(int=random.getrandbits(128), version=4))
+
+    def get_max_new_tokens(self, reference: Any) -> int:
+        """Compute the completion budget of an entry from the output budget policy.
+        
+        Args:
+            reference: Reference answer of the entry.
+            
+        Returns:
+            Maximum number of tokens the model may generate for the entry.
+        """
+        max_new_tokens = self.output_budget.get("max_new_tokens", DEFAULT_MAX_NEW_TOKENS)
+        multiplier = self.output_budget.get("reference_multiplier")
+        if multiplier is None:
+            return max_new_tokens
+
+        reference_text = reference if isinstance(reference, str) else json.dumps(reference)
+        reference_tokens = ContextGenerator.get_context_length(reference_text)
+        budget = math.ceil(reference_tokens * multiplier) + self.output_budget.get("min_new_tokens", 0)
+        return min(budget, max_new_tokens)
+
+    def add_output_budgets(self, task_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Store the completion budget of each entry under "max_new_tokens".
+        
+        Args:
+            task_data: Test entries with their reference answers.
+            
+        Returns:
+            The same entries.
+        """
+        for entry in task_data:
+            entry["max_new_tokens"] = self.get_max_new_tokens(entry.get("reference", ""))
+        return task_data
 
     def compile_task_data(self) -> List[Dict[str, Any]]:
         """Generate all test samples for this task.
@@ -19,6 +19,7 @@ class ProcessingDataBlocks(Task):
         }
 
         self.metrics = ["exact_match", "rouge"]
+        self.output_budget = {"reference_multiplier": 1.5, "min_new_tokens": 64, "max_new_tokens": 4096}
 
     def format_prompt(self, roles, query_role, query_word):
         n_turns = len(roles["Role 1"])
@@ -1,6 +1,7 @@
 import random
 
 from task.base_task import Task
+from task.context_utils import ContextGenerator
 
 
 class GroupMembership(Task):
@@ -19,6 +20,7 @@ class GroupMembership(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 16}
 
     def format_prompt(self, lists, query_word):
         context = ""
@@ -43,6 +45,10 @@ class GroupMembership(Task):
     def sample_query_word(self, context, lists, list_index):
         if list_index == len(lists):
             # If list_index is equal to the number of lists, we need to sample a word not in any list
+            items = context.split(", ")
+            if ContextGenerator.is_composite(items):
+                return ContextGenerator.sample_absent_items(1, set(items))[0], "no"
+
             # Convert context to a set for O(1) membership checks
             context_words = set(context)
         
@@ -120,6 +126,7 @@ class GroupAssociation(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 16}
 
     def format_prompt(self, lists, query_word, reference_word):
         context = ""
@@ -205,6 +212,7 @@ class AlternatingGroupAssociation(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 16}
 
     def format_prompt(self, roles, query_word, reference_word):
         n_turns = len(roles["Role 1"])
@@ -310,6 +318,7 @@ class Iterate(Task):
         }
 
         self.metrics = ["exact_match", "rouge"]
+        self.output_budget = {"reference_multiplier": 1.5, "min_new_tokens": 64, "max_new_tokens": 4096}
 
     def format_prompt(self, lists):
         context = ""
@@ -1,11 +1,17 @@
+import array
+import itertools
+import math
 import os
 import random
+import re
 import string
 
 import tiktoken
 
 import logging
 
+from task.vocabulary import load_vocabulary
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -19,9 +25,18 @@ def get_word_list(filename="words_alpha.txt"):
     return words
 
 
+def get_vocabulary(filename="words_alpha.txt"):
+    """Memory-map the compiled vocabulary of a word list, compiling it on first use."""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return load_vocabulary(os.path.join(current_dir, filename))
+
+
 class ContextGenerator:
     tokenizer = tiktoken.encoding_for_model("gpt-4")
-    WORDS = get_word_list()
+    WORDS = get_vocabulary()
+
+    # Token counts of context item segments (e.g. ", word"), shared by all contexts built by the process
+    segment_token_counts = {}
     
     def __init__(self):
         self.max_length = 4096
@@ -54,6 +69,115 @@ class ContextGenerator:
         trimmed_context = ", ".join(trimmed_context.split(", ")[:-1])
         return trimmed_context
 
+    @staticmethod
+    def get_item_segments(item, first):
+        """Split an item of a ", "-joined context into the pieces it is tokenized as, with their separators.
+
+        Items are split at ": " (word pairs) and "-" (composite words).
+        """
+        parts = re.split(r"(: |-)", item)
+        segments = [("" if first else ", ") + parts[0]]
+        for index in range(1, len(parts), 2):
+            segments.append(parts[index] + parts[index + 1])
+        return segments
+
+    @classmethod
+    def count_segments(cls, segments, cache=True):
+        """Return the number of tokens of each segment, tokenizing each distinct segment once."""
+        counts = cls.segment_token_counts if cache else {}
+        missing = [segment for segment in dict.fromkeys(segments) if segment not in counts]
+        if missing:
+            for segment, tokens in zip(missing, cls.tokenizer.encode_ordinary_batch(missing)):
+                counts[segment] = len(tokens)
+
+        return [counts[segment] for segment in segments]
+
+    @classmethod
+    def trim_items(cls, items, max_length, cache=True, chunk_size=1024):
+        """Return trim_context(", ".join(items), max_length) without tokenizing the whole context.
+
+        The gpt-4 tokenizer never merges text across ", ", ": " or before "-",
+        so the token count of the joined context is the sum of the counts of
+        its item segments, which are looked up (or tokenized once and kept if
+        ``cache``). Items are read and counted ``chunk_size`` at a time until
+        the budget is reached, so ``items`` may be a generator that is only
+        consumed as far as the context goes. Only the items around the
+        boundary are tokenized in context; if they do not tokenize as counted
+        (a tokenizer that merges across separators), the context is trimmed
+        with trim_context instead, reading at most ``max_length + 1`` items
+        since every non-empty item takes at least one token.
+
+        Args:
+            items: Items of the context, e.g. words or "word: attribute" pairs.
+            max_length: Token budget of the context.
+            cache: Keep the counts of the segments (for items drawn from a
+                fixed vocabulary rather than random strings).
+            chunk_size: Number of items counted at a time.
+        """
+        remaining = iter(items)
+        items = []
+        total = 0
+        boundary = None
+
+        def trim_read_items():
+            # Items may be a lazy stream of composite words far longer than the budget
+            return cls.trim_context(
+                ", ".join(items + list(itertools.islice(remaining, max(0, max_length + 1 - len(items))))),
+                max_length,
+            )
+
+        while boundary is None:
+            chunk = list(itertools.islice(remaining, chunk_size))
+            if not chunk:
+                break
+            start = len(items)
+            items += chunk
+
+            segments = [
+                cls.get_item_segments(item, start + offset == 0)
+                for offset, item in enumerate(chunk)
+            ]
+            counts = iter(cls.count_segments([segment for item_segments in segments for segment in item_segments], cache))
+            for offset, item_segments in enumerate(segments):
+                count = sum(next(counts) for _ in item_segments)
+                if total + count > max_length:
+                    boundary = start + offset
+                    break
+                total += count
+
+        # The whole context fits, or its first item does not
+        if not boundary:
+            return trim_read_items()
+
+        # Read the items the boundary check needs
+        items += itertools.islice(remaining, max(0, boundary + 2 - len(items)))
+
+        # Check that the items around the boundary are tokenized in context as they were counted
+        window_start, window_end = boundary - 1, min(len(items), boundary + 2)
+        item_tokens = {}
+        for index in range(window_start, window_end):
+            item_tokens[index] = [
+                token
+                for segment in cls.get_item_segments(items[index], index == 0)
+                for token in cls.tokenizer.encode(segment)
+            ]
+        window = ("" if window_start == 0 else ", ") + ", ".join(items[window_start:window_end])
+        if cls.tokenizer.encode(window) != [token for index in sorted(item_tokens) for token in item_tokens[index]]:
+            return trim_read_items()
+
+        boundary_text = ", " + items[boundary]
+        partial = cls.tokenizer.decode(item_tokens[boundary][:max_length - total])
+        if not boundary_text.startswith(partial):
+            return trim_read_items()
+
+        # Same rules as trim_context, applied to the decoded token prefix
+        trimmed_context = ", ".join(items[:boundary]) + partial
+        if boundary_text[len(partial)] in [",", " "]:
+            if trimmed_context[-1] != ":":
+                return trimmed_context.rstrip(", ")
+        # discard the last token if it is not complete
+        return trimmed_context.rpartition(", ")[0]
+
     def generate_context(self, context_type, length=None, num_samples=None):
         valid_context_types = [
             "random_numbers",
@@ -87,31 +211,88 @@ class ContextGenerator:
 
         return data
     
+    @classmethod
+    def iter_composite_words(cls):
+        """Yield distinct "word-word" items in random order, for contexts longer than the vocabulary.
+
+        Item k is the pair of words at position (a * k + b) mod V^2 of the
+        vocabulary squared, with a coprime to V^2, so no item repeats before
+        all V^2 pairs have been yielded. Both words go through a random
+        permutation of the vocabulary so that consecutive items do not follow
+        its alphabetical order. Memory does not depend on the number of items.
+        """
+        size = len(cls.WORDS)
+        pairs = size * size
+        order = array.array("I", random.sample(range(size), size))
+        multiplier = random.randrange(1, pairs)
+        while math.gcd(multiplier, pairs) != 1:
+            multiplier = random.randrange(1, pairs)
+        offset = random.randrange(pairs)
+
+        for k in range(pairs):
+            first, second = divmod((multiplier * k + offset) % pairs, size)
+            yield cls.WORDS[order[first]] + "-" + cls.WORDS[order[second]]
+
+    @classmethod
+    def sample_unique_words(cls, count):
+        """Return ``count`` distinct words in random order.
+
+        Up to the size of the vocabulary this is random.sample(WORDS, count);
+        beyond it, composite "word-word" items are generated lazily (see
+        iter_composite_words), so the result is an iterator.
+        """
+        if count <= len(cls.WORDS):
+            return random.sample(cls.WORDS, count)
+        return itertools.islice(cls.iter_composite_words(), count)
+
+    @staticmethod
+    def is_composite(items):
+        """Whether the items of a context are composite "word-word" items (the vocabulary has no hyphens)."""
+        return bool(items) and "-" in items[0]
+
+    @classmethod
+    def sample_absent_items(cls, count, exclude=()):
+        """Return ``count`` distinct composite "word-word" items that are not in ``exclude``.
+
+        In a composite context nearly every vocabulary word occurs as part of
+        some item, so words that must be absent from it (or replace items of
+        it) are drawn from the same composite space instead.
+        """
+        items = []
+        while len(items) < count:
+            item = random.choice(cls.WORDS) + "-" + random.choice(cls.WORDS)
+            if item not in exclude and item not in items:
+                items.append(item)
+        return items
+
     def generate_unique_words(self, length):
-        candidate_words = random.sample(self.WORDS, length)
-        return self.trim_context(", ".join(candidate_words), length)
+        candidate_words = self.sample_unique_words(length)
+        return self.trim_items(candidate_words, length)
 
     def generate_random_numbers(self, length):
-        numbers = [str(random.randint(0, 1000)) for _ in range(length)]
-        context = ", ".join(numbers)
-        return self.trim_context(context, length)
+        if length > len(self.WORDS):
+            numbers = (str(random.randint(0, 1000)) for _ in range(length))
+        else:
+            numbers = [str(random.randint(0, 1000)) for _ in range(length)]
+        return self.trim_items(numbers, length)
 
     def generate_word_pairs(self, length):
-        candidate_words = random.sample(self.WORDS, length * 2)
-        word_pairs = []
-        for i in range(0, length * 2, 2):
-            word_pairs.append(f"{candidate_words[i]}: {candidate_words[i+1]}")
+        candidate_words = iter(self.sample_unique_words(length * 2))
+        word_pairs = (f"{first}: {second}" for first, second in zip(candidate_words, candidate_words))
 
-        return self.trim_context(", ".join(word_pairs), length)
+        return self.trim_items(word_pairs, length)
 
     def generate_gibberish_words(self, length):
-        words = []
-        for _ in range(length):
+        def make_word():
             word_length = random.randint(2, 9)
-            word = "".join(random.choices(string.ascii_lowercase, k=word_length))
-            words.append(word)
+            return "".join(random.choices(string.ascii_lowercase, k=word_length))
+
+        if length > len(self.WORDS):
+            words = (make_word() for _ in range(length))
+        else:
+            words = [make_word() for _ in range(length)]
 
-        return self.trim_context(", ".join(words), length)
+        return self.trim_items(words, length, cache=False)
 
 
 if __name__ == "__main__":
@@ -22,6 +22,7 @@ class ComparePositions(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 16}
 
     def format_prompt(self, context, word_1, word_2):
         instruction = self.task_instruction.format(word_1=word_1, word_2=word_2)
@@ -111,6 +112,7 @@ class FindDuplicates(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 32}
 
     def format_prompt(self, context_str):
         return "Context:\n" + context_str + "\n\nInstruction:\n" + self.task_instruction
@@ -181,6 +183,7 @@ class Count(Task):
         }
 
         self.metrics = ["exact_match", "count_accuracy"]
+        self.output_budget = {"max_new_tokens": 32}
 
     def format_prompt(self, context_str, repeated_word):
         instruction = self.task_instruction.format(repeated_word=repeated_word)
@@ -253,6 +256,7 @@ class CheckAssociation(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 16}
 
     def format_prompt(self, context, query_word, reference_word):
         instruction = self.task_instruction.format(
@@ -263,15 +267,14 @@ class CheckAssociation(Task):
         )
 
     def create_context_data(self, n_attribute, length=4096):
-        words = random.sample(self.WORDS, length)
+        words = ContextGenerator.sample_unique_words(length)
         attribute_words = ["ATT_" + str(i) for i in range(1, n_attribute + 1)]
-        context = []
-        for word in words:
-            attribute = random.choice(attribute_words[:n_attribute])
-            context.append(f"{word}: {attribute}")
+        context = (f"{word}: {random.choice(attribute_words[:n_attribute])}" for word in words)
+        if length <= len(self.WORDS):
+            # Draw every attribute up front, as the samples that follow depend on the random state
+            context = list(context)
 
-        context = ", ".join(context)
-        context = ContextGenerator.trim_context(context, length)
+        context = ContextGenerator.trim_items(context, length)
 
         return context
 
@@ -1,6 +1,7 @@
 import random
 
 from task.base_task import Task
+from task.context_utils import ContextGenerator
 
 
 class Snapshot(Task):
@@ -19,6 +20,7 @@ class Snapshot(Task):
         self.variables = {"context_length": [4000]}
 
         self.metrics = ["exact_match", "rouge"]
+        self.output_budget = {"reference_multiplier": 1.25, "min_new_tokens": 64, "max_new_tokens": 4096}
 
     def format_prompt(self, context):
         return (
@@ -78,6 +80,7 @@ class ReplaceAll(Task):
         }
 
         self.metrics = ["exact_match", "rouge"]
+        self.output_budget = {"reference_multiplier": 1.25, "min_new_tokens": 64, "max_new_tokens": 4096}
 
     def format_prompt(self, context_str, query_item, substitute):
         instruction = self.task_instruction.format(
@@ -92,8 +95,11 @@ class ReplaceAll(Task):
         )
 
     def create_context_with_repeated_item(self, context, density):
-        query_item, substitute = random.sample(self.WORDS, 2)
         new_context = context.split(", ")
+        if ContextGenerator.is_composite(new_context):
+            query_item, substitute = ContextGenerator.sample_absent_items(2, set(new_context))
+        else:
+            query_item, substitute = random.sample(self.WORDS, 2)
         num_repetition = int(len(new_context) * density)
         indices = random.sample(range(len(new_context)), num_repetition)
         for i in indices:
@@ -157,8 +163,11 @@ class ReplaceAllXToNull(ReplaceAll):
         )
 
     def create_context_with_repeated_item(self, context, density):
-        query_item = random.choice(self.WORDS)
         new_context = context.split(", ")
+        if ContextGenerator.is_composite(new_context):
+            query_item = ContextGenerator.sample_absent_items(1, set(new_context))[0]
+        else:
+            query_item = random.choice(self.WORDS)
         num_repetition = int(len(new_context) * density)
         indices = random.sample(range(len(new_context)), num_repetition)
         for i in indices:
@@ -206,6 +215,7 @@ class OverwritePositions(Task):
         }
 
         self.metrics = ["exact_match", "rouge"]
+        self.output_budget = {"reference_multiplier": 1.25, "min_new_tokens": 64, "max_new_tokens": 4096}
 
 
     def format_prompt(self, context, nth, substitute):
@@ -228,7 +238,11 @@ class OverwritePositions(Task):
 
     def compile_test_entry(self, context, length, nth):
         entry_id = self.create_entry_id()
-        substitute = random.choice(self.WORDS)
+        context_words = context.split(", ")
+        if ContextGenerator.is_composite(context_words):
+            substitute = ContextGenerator.sample_absent_items(1, set(context_words))[0]
+        else:
+            substitute = random.choice(self.WORDS)
         reference = self.get_reference(context, nth, substitute)
 
         prompt = self.format_prompt(context, nth, substitute)
@@ -311,6 +325,7 @@ class FunctionalUpdates(Task):
         self.task_instruction = ""
 
         self.metrics = ["exact_match", "rouge"]
+        self.output_budget = {"reference_multiplier": 1.25, "min_new_tokens": 64, "max_new_tokens": 4096}
 
         self.variables = {
             "context_length": [4000],
@@ -1,6 +1,7 @@
 import random
 
 from task.base_task import Task
+from task.context_utils import ContextGenerator
 
 
 class StringSearchWord(Task):
@@ -19,6 +20,7 @@ class StringSearchWord(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 16}
 
     def format_prompt(self, context, query_word):
         instruction = self.task_instruction.format(query_word=query_word)
@@ -29,6 +31,9 @@ class StringSearchWord(Task):
     def sample_query_word(self, context, depth, label):
         context_words = context.split(", ")
         if label == "no":
+            if ContextGenerator.is_composite(context_words):
+                return ContextGenerator.sample_absent_items(1, set(context_words))[0]
+
             words = random.sample(self.WORDS, 100)
             for i in range(100):
                 word = words[i]
@@ -100,6 +105,7 @@ class StringSearchSequence(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 16}
 
     def sample_query_sequence(self, context, sequence_length):
         context_words = context.split(", ")
@@ -113,6 +119,13 @@ class StringSearchSequence(Task):
 
     def corrupt_sequence(self, subsequence, n_corrupt):
         corrupted_indices = random.sample(range(len(subsequence)), n_corrupt)
+        if ContextGenerator.is_composite(subsequence):
+            # Context items are distinct, so a composite item absent from the subsequence breaks it
+            substitutes = ContextGenerator.sample_absent_items(n_corrupt, set(subsequence))
+            for i, substitute in zip(corrupted_indices, substitutes):
+                subsequence[i] = substitute
+            return subsequence
+
         for i in corrupted_indices:
             subsequence[i] = random.choice(self.WORDS)
 
@@ -191,6 +204,7 @@ class KeyValueSearch(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 32}
 
     def format_prompt(self, context, query_item):
         instruction = self.task_instruction.format(query_item=query_item)
@@ -259,6 +273,7 @@ class BatchKeyValueSearch(KeyValueSearch):
         }
 
         self.metrics = ["exact_match", "rouge"]
+        self.output_budget = {"reference_multiplier": 1.5, "min_new_tokens": 64, "max_new_tokens": 4096}
 
     def format_prompt(self, context, query_item):
         instruction = self.task_instruction.format(query_item=query_item)
@@ -21,6 +21,7 @@ class CompareTwoLists(Task):
         }
 
         self.metrics = ["exact_match", "rouge"]
+        self.output_budget = {"reference_multiplier": 1.5, "min_new_tokens": 64, "max_new_tokens": 4096}
 
     def format_prompt(self, context, chosen_list):
         if chosen_list == "first":
@@ -43,7 +44,10 @@ class CompareTwoLists(Task):
         words = context.split(", ")
         indices = random.sample(range(len(words)), n_difference)
         original_words = [words[i] for i in indices]
-        replacing_words = random.sample(self.WORDS, n_difference)
+        if ContextGenerator.is_composite(words):
+            replacing_words = ContextGenerator.sample_absent_items(n_difference, set(words))
+        else:
+            replacing_words = random.sample(self.WORDS, n_difference)
         for i in range(n_difference):
             words[indices[i]] = replacing_words[i]
 
@@ -127,6 +131,7 @@ class IdentifyOddGroup(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 16}
 
     def create_context_data(self, n_words, context_length):
         selected_words = random.sample(self.WORDS, n_words)
@@ -162,8 +167,13 @@ class IdentifyOddGroup(Task):
         anomaly_list_index = random.choice(range(n_list))
         corrupted_list = context[anomaly_list_index].split(", ")
         corrupted_indices = random.sample(range(n_words), n_anomaly)
-        for i in corrupted_indices:
-            corrupted_list[i] = random.choice(self.WORDS)
+        if ContextGenerator.is_composite(corrupted_list):
+            substitutes = ContextGenerator.sample_absent_items(n_anomaly, set(corrupted_list))
+            for i, substitute in zip(corrupted_indices, substitutes):
+                corrupted_list[i] = substitute
+        else:
+            for i in corrupted_indices:
+                corrupted_list[i] = random.choice(self.WORDS)
 
         context[anomaly_list_index] = ", ".join(corrupted_list)
 
@@ -223,6 +233,7 @@ class PatchDifference(Task):
         }
 
         self.metrics = ["exact_match"]
+        self.output_budget = {"max_new_tokens": 32}
 
     def create_context_data(self, context_length, pattern_length):
         selected_words = random.sample(self.WORDS, pattern_length)
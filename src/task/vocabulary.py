@@ -0,0 +1,265 @@
+import argparse
+import array
+import hashlib
+import mmap
+import os
+import random
+import struct
+import tempfile
+from collections.abc import Sequence
+
+import tiktoken
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+MAGIC = b"MNVVOCAB"
+VERSION = 1
+
+# magic, version, number of words, bytes of text, number of tokens, size and mtime of the word list, encoding
+HEADER = struct.Struct("=8sIIQQQq32s")
+
+
+def align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def get_layout(count, text_bytes, token_count):
+    """Byte offset and length of each section of a vocabulary artifact."""
+    sections = [
+        ("offsets", 4 * (count + 1)),
+        ("sorted_index", 4 * count),
+        ("token_offsets", 4 * (count + 1)),
+        ("tokens", 4 * token_count),
+        ("text", text_bytes),
+    ]
+    layout = {}
+    offset = align(HEADER.size)
+    for name, length in sections:
+        layout[name] = (offset, length)
+        offset = align(offset + length)
+    return layout, offset
+
+
+def compile_vocabulary(words_path, artifact_path, encoding="gpt-4"):
+    """Compile a word list (one word per line) into a vocabulary artifact.
+
+    The artifact holds the words as one UTF-8 buffer with an offsets array,
+    the permutation that sorts them (for membership tests), and their token
+    ids and token offsets under ``encoding``. It is written to a temporary
+    file and renamed, so concurrent readers never see a partial artifact.
+    """
+    with open(words_path, "rb") as f:
+        words = f.read().decode("utf-8").splitlines()
+
+    tokenizer = tiktoken.encoding_for_model(encoding)
+    encoded = [word.encode("utf-8") for word in words]
+
+    offsets = array.array("I", [0])
+    for word in encoded:
+        offsets.append(offsets[-1] + len(word))
+
+    sorted_index = array.array("I", sorted(range(len(encoded)), key=encoded.__getitem__))
+
+    token_offsets = array.array("I", [0])
+    tokens = array.array("I")
+    for word_tokens in tokenizer.encode_ordinary_batch(words):
+        tokens.extend(word_tokens)
+        token_offsets.append(len(tokens))
+
+    text = b"".join(encoded)
+    layout, size = get_layout(len(words), len(text), len(tokens))
+    stat = os.stat(words_path)
+
+    buffer = bytearray(size)
+    HEADER.pack_into(
+        buffer, 0, MAGIC, VERSION, len(words), len(text), len(tokens),
+        stat.st_size, stat.st_mtime_ns, encoding.encode("utf-8"),
+    )
+    for name, data in [
+        ("offsets", offsets.tobytes()),
+        ("sorted_index", sorted_index.tobytes()),
+        ("token_offsets", token_offsets.tobytes()),
+        ("tokens", tokens.tobytes()),
+        ("text", text),
+    ]:
+        offset, length = layout[name]
+        buffer[offset:offset + length] = data
+
+    temp_path = f"{artifact_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(buffer)
+    os.replace(temp_path, artifact_path)
+
+    logging.info(f"Compiled {len(words)} words ({len(tokens)} tokens) from {words_path} into {artifact_path}")
+
+
+def is_up_to_date(artifact_path, words_path, encoding="gpt-4"):
+    """Whether the artifact was compiled from the current version of the word list with ``encoding``."""
+    try:
+        with open(artifact_path, "rb") as f:
+            header = f.read(HEADER.size)
+        magic, version, _, _, _, source_size, source_mtime, artifact_encoding = HEADER.unpack(header)
+        stat = os.stat(words_path)
+    except (OSError, struct.error):
+        return False
+
+    return (
+        magic == MAGIC
+        and version == VERSION
+        and (source_size, source_mtime) == (stat.st_size, stat.st_mtime_ns)
+        and artifact_encoding.rstrip(b"\0").decode("utf-8") == encoding
+    )
+
+
+class Vocabulary(Sequence):
+    """Read-only word list backed by a memory-mapped vocabulary artifact.
+
+    Words are decoded from the shared buffer when they are accessed, so the
+    vocabulary costs no Python objects per word and the pages are shared by
+    every process that maps the same artifact. Being a Sequence, it can be
+    passed to random.sample and random.choice, which draw the same words as
+    they would from the equivalent list.
+    """
+
+    def __init__(self, buffer, path=None):
+        self.buffer = buffer
+        self.path = path
+        view = memoryview(buffer)
+
+        magic, version, count, text_bytes, token_count, _, _, encoding = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a vocabulary artifact, or one from another version")
+        self.encoding = encoding.rstrip(b"\0").decode("utf-8")
+
+        layout, _ = get_layout(count, text_bytes, token_count)
+
+        def section(name, fmt=None):
+            offset, length = layout[name]
+            data = view[offset:offset + length]
+            return data.cast(fmt) if fmt else data
+
+        self.offsets = section("offsets", "I")
+        self.sorted_index = section("sorted_index", "I")
+        self.token_offsets = section("token_offsets", "I")
+        self.tokens = section("tokens", "I")
+        self.text = section("text")
+        self.length = count
+        self.fingerprint = None
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a vocabulary artifact."""
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, path)
+
+    def __reduce__(self):
+        # Processes that receive a mapped vocabulary map the artifact again instead of copying it
+        if self.path is not None:
+            return (Vocabulary.load, (self.path,))
+        return (Vocabulary, (bytes(self.buffer),))
+
+    def __len__(self):
+        return self.length
+
+    def get_bytes(self, index):
+        return self.text[self.offsets[index]:self.offsets[index + 1]].tobytes()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("vocabulary index out of range")
+        return self.get_bytes(index).decode("utf-8")
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self.get_bytes(index).decode("utf-8")
+
+    def __contains__(self, word):
+        if not isinstance(word, str):
+            return False
+        return self.index_of(word) is not None
+
+    def index_of(self, word):
+        """Position of ``word`` in the word list, or None (binary search over the sorted permutation)."""
+        target = word.encode("utf-8")
+        low, high = 0, self.length
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_bytes(self.sorted_index[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.length and self.get_bytes(self.sorted_index[low]) == target:
+            return self.sorted_index[low]
+        return None
+
+    def index(self, word):
+        index = self.index_of(word)
+        if index is None:
+            raise ValueError(f"{word!r} is not in the vocabulary")
+        return index
+
+    def count(self, word):
+        return int(word in self)
+
+    def get_fingerprint(self):
+        """SHA-256 of the words, their token ids and the encoding (not of the artifact's build metadata)."""
+        if self.fingerprint is None:
+            digest = hashlib.sha256(self.encoding.encode("utf-8"))
+            digest.update(self.text)
+            digest.update(self.tokens)
+            self.fingerprint = digest.hexdigest()
+        return self.fingerprint
+
+    def get_tokens(self, index):
+        """Token ids of the word at ``index`` on its own."""
+        return self.tokens[self.token_offsets[index]:self.token_offsets[index + 1]].tolist()
+
+    def get_token_length(self, index):
+        """Number of tokens of the word at ``index`` on its own."""
+        return self.token_offsets[index + 1] - self.token_offsets[index]
+
+    def sample(self, k):
+        """Sample ``k`` distinct words (same draw as random.sample on the word list)."""
+        return random.sample(self, k)
+
+
+def load_vocabulary(words_path, artifact_path=None, encoding="gpt-4"):
+    """Load the vocabulary of a word list, compiling its artifact first if it is missing or stale.
+
+    If the artifact cannot be written (e.g. a read-only install), the
+    vocabulary is compiled into memory instead.
+    """
+    if artifact_path is None:
+        artifact_path = os.path.splitext(words_path)[0] + ".vocab"
+
+    if not is_up_to_date(artifact_path, words_path, encoding):
+        try:
+            compile_vocabulary(words_path, artifact_path, encoding)
+        except OSError as e:
+            logging.warning(f"Could not write {artifact_path} ({e}); compiling the vocabulary in memory")
+            with tempfile.TemporaryDirectory() as temp_dir:
+                temp_path = os.path.join(temp_dir, os.path.basename(artifact_path))
+                compile_vocabulary(words_path, temp_path, encoding)
+                with open(temp_path, "rb") as f:
+                    return Vocabulary(f.read())
+
+    return Vocabulary.load(artifact_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a word list into a memory-mapped vocabulary artifact.")
+    parser.add_argument("words_path", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "words_alpha.txt"))
+    parser.add_argument("--output", type=str, default=None, help="Artifact path (default: the word list with a .vocab extension)")
+    parser.add_argument("--encoding", type=str, default="gpt-4", help="Model whose tokenizer is used for the token ids")
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.words_path)[0] + ".vocab"
+    compile_vocabulary(args.words_path, output, args.encoding)
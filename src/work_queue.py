@@ -0,0 +1,285 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+
+class WorkQueue:
+    """Durable queue of task entries shared by any number of worker processes.
+
+    The queue is a single SQLite file (rollback journaling, busy timeout). A
+    coordinator enqueues the entries of every task once; workers lease
+    batches of pending entries, renew their leases while they run them and
+    ack each one with its result record. Leases that are neither renewed nor
+    acked before they expire (e.g. because the worker died) are handed out
+    again, so workers can be added or removed at any time.
+
+    Rollback journaling only relies on file locks (WAL would need memory
+    shared by all processes, i.e. a single host), so workers on several hosts
+    can share the queue on a filesystem with working POSIX advisory locks:
+    a local disk, NFSv4 or NFSv3 with lockd, Lustre or GPFS. Filesystems that
+    ignore or emulate locks (NFS mounted with ``nolock``, most SMB/CIFS
+    mounts, FUSE mounts of object stores) can corrupt the queue or lose items.
+
+    Attributes:
+        max_attempts: Failed entries (null generation) are re-queued until they
+            have been tried this many times, then recorded as failed.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS items (
+                key TEXT PRIMARY KEY,
+                category TEXT,
+                task_name TEXT,
+                position INTEGER,
+                entry TEXT,
+                status TEXT,
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER,
+                result TEXT,
+                updated_at REAL
+            )"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_expires)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+
+    @staticmethod
+    def make_key(category, task_name, entry_id):
+        return f"{category}/{task_name}/{entry_id}"
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def enqueue(self, category, task_name, entries):
+        """Add the entries of a task. Entries already in the queue are left untouched.
+
+        Args:
+            category: Category of the task.
+            task_name: Name of the task.
+            entries: (position, entry) pairs in the order they should be
+                handed out; position is the index of the entry in the task file.
+
+        Returns:
+            Number of entries added.
+        """
+        now = time.time()
+        rows = [
+            (
+                self.make_key(category, task_name, entry.get("id")),
+                category,
+                task_name,
+                position,
+                json.dumps(entry),
+                "pending",
+                None,
+                None,
+                0,
+                None,
+                now,
+            )
+            for position, entry in entries
+        ]
+
+        with self.lock:
+            before = self.connection.total_changes
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            return self.connection.total_changes - before
+
+    def lease(self, worker_id, count, lease_seconds=600):
+        """Lease up to ``count`` pending entries, re-queueing expired leases first.
+
+        Entries are handed out in enqueue order, so entries that share a
+        context tend to go to the same worker back-to-back.
+
+        Returns:
+            List of (key, category, task_name, entry) tuples.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self.connection.execute(
+                    "UPDATE items SET status = 'pending', lease_owner = NULL, lease_expires = NULL "
+                    "WHERE status = 'leased' AND lease_expires < ?",
+                    (now,),
+                ).rowcount
+                if expired:
+                    logging.warning(f"Re-queued {expired} entries whose lease expired")
+
+                rows = self.connection.execute(
+                    "SELECT key, category, task_name, entry FROM items "
+                    "WHERE status = 'pending' ORDER BY rowid LIMIT ?",
+                    (count,),
+                ).fetchall()
+                self.connection.executemany(
+                    "UPDATE items SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE key = ?",
+                    [(worker_id, now + lease_seconds, now, row[0]) for row in rows],
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+        return [(key, category, task_name, json.loads(entry)) for key, category, task_name, entry in rows]
+
+    def renew(self, worker_id, lease_seconds=600):
+        """Extend every lease held by a worker, which keeps entries it is still running from being re-queued.
+
+        Returns:
+            Number of leases extended.
+        """
+        now = time.time()
+        with self.lock:
+            return self.connection.execute(
+                "UPDATE items SET lease_expires = ?, updated_at = ? WHERE status = 'leased' AND lease_owner = ?",
+                (now + lease_seconds, now, worker_id),
+            ).rowcount
+
+    def ack(self, key, worker_id, result):
+        """Record the result of a leased entry.
+
+        A failed result (null generation) puts the entry back in the queue
+        until it has been attempted ``max_attempts`` times. Results are only
+        recorded while the entry is leased by ``worker_id``: a late result for
+        a lease that expired and went to another worker (or that was already
+        completed) is ignored.
+
+        Returns:
+            True if the result was recorded.
+        """
+        failed = result.get("generation") is None
+        now = time.time()
+
+        with self.lock:
+            if failed:
+                cursor = self.connection.execute(
+                    "UPDATE items SET "
+                    "status = CASE WHEN attempts < ? THEN 'pending' ELSE 'done' END, "
+                    "result = CASE WHEN attempts < ? THEN result ELSE ? END, "
+                    "lease_owner = CASE WHEN attempts < ? THEN NULL ELSE ? END, "
+                    "lease_expires = NULL, updated_at = ? "
+                    "WHERE key = ? AND status = 'leased' AND lease_owner = ?",
+                    (self.max_attempts, self.max_attempts, json.dumps(result), self.max_attempts, worker_id, now, key, worker_id),
+                )
+            else:
+                cursor = self.connection.execute(
+                    "UPDATE items SET status = 'done', result = ?, lease_owner = ?, "
+                    "lease_expires = NULL, updated_at = ? "
+                    "WHERE key = ? AND status = 'leased' AND lease_owner = ?",
+                    (json.dumps(result), worker_id, now, key, worker_id),
+                )
+
+        if cursor.rowcount == 0:
+            logging.info(f"Ignoring result for {key} from {worker_id}, which no longer holds its lease")
+        return cursor.rowcount > 0
+
+    def release(self, worker_id):
+        """Put every entry still leased by a worker back in the queue (e.g. when it shuts down)."""
+        with self.lock:
+            released = self.connection.execute(
+                "UPDATE items SET status = 'pending', lease_owner = NULL, lease_expires = NULL, "
+                "attempts = MAX(attempts - 1, 0) WHERE status = 'leased' AND lease_owner = ?",
+                (worker_id,),
+            ).rowcount
+
+        if released:
+            logging.info(f"Released {released} leased entries of {worker_id}")
+        return released
+
+    def is_drained(self):
+        """Return True once no entry is pending or leased."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*) FROM items WHERE status != 'done'"
+            ).fetchone()
+        return row[0] == 0
+
+    def get_tasks(self):
+        """Return the (category, task_name) pairs in the queue, in enqueue order."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT category, task_name FROM items GROUP BY category, task_name ORDER BY MIN(rowid)"
+            ).fetchall()
+
+    def get_items(self, category, task_name):
+        """Return the (entry, result) pairs of a task in enqueue order; result is None until done."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT entry, result FROM items WHERE category = ? AND task_name = ? ORDER BY position",
+                (category, task_name),
+            ).fetchall()
+
+        return [(json.loads(entry), json.loads(result) if result else None) for entry, result in rows]
+
+    def get_stats(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT status, COUNT(*) FROM items GROUP BY status"
+            ).fetchall()
+            expired = self.connection.execute(
+                "SELECT COUNT(*) FROM items WHERE status = 'leased' AND lease_expires < ?",
+                (time.time(),),
+            ).fetchone()[0]
+            leases = self.connection.execute(
+                "SELECT lease_owner, COUNT(*) FROM items WHERE status = 'leased' GROUP BY lease_owner"
+            ).fetchall()
+            completions = self.connection.execute(
+                "SELECT lease_owner, COUNT(*) FROM items WHERE status = 'done' GROUP BY lease_owner"
+            ).fetchall()
+
+        counts = dict(rows)
+        return {
+            "path": self.path,
+            "pending": counts.get("pending", 0),
+            "leased": counts.get("leased", 0),
+            "expired_leases": expired,
+            "done": counts.get("done", 0),
+            "total": sum(counts.values()),
+            "leases_by_worker": dict(leases),
+            "done_by_worker": dict(completions),
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()